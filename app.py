@@ -5,13 +5,33 @@
 import os
 import re
 import secrets
-import smtplib
+import time
+import queue
+import threading
 import oracledb
-from email.message import EmailMessage
 from datetime import datetime, timedelta, timezone
-from flask import Flask, request, redirect, url_for, flash, render_template_string, session
+from contextlib import contextmanager
+import tempfile
+from flask import (Flask, request, redirect, url_for, flash, render_template, session, g, has_request_context,
+                   send_file, before_render_template, template_rendered)
+from jinja2 import DictLoader, FileSystemBytecodeCache
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
+from db import get_conn, pool_stats, get_version, fetch_all, fetch_one, SHAPE_LARGE, WEB_THREADS
+import route_graph
+import refdata
+import mailer
+from result_cache import ResultCache
+from seatmap import SeatMap, ALL_LEGS, leg_mask
+import seat_feed
+import booking
+import fares
+import reaper
+import metrics
+import sqlstats
+import tracing
+import profiling
+import attachments
 
 
 # ---------- утилита для timezones ----------
@@ -33,14 +53,6 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
 
 DEV_SHOW_CODE = False  # показывать код во flash для отладки
 
-# ----------- Oracle config -----------
-ORA_HOST = os.getenv("ORA_HOST", "oracle")  # для Docker используем имя сервиса
-ORA_PORT = int(os.getenv("ORA_PORT", "1521"))
-ORA_SERVICE = os.getenv("ORA_SERVICE", "FREEPDB1")
-ORA_USER = os.getenv("ORA_USER", "SYSTEM")
-ORA_PASSWORD = os.getenv("ORA_PASSWORD", "AnosVoldigod0")
-DSN = f"{ORA_HOST}:{ORA_PORT}/{ORA_SERVICE}"
-
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-change-me")
 
@@ -124,7 +136,7 @@ BASE = """
         </div>
       {% endif %}
     {% endwith %}
-    {{ body|safe }}
+    {% block body %}{% endblock %}
   </main>
 
   <!-- Нужен для работы dropdown -->
@@ -161,7 +173,7 @@ app.config["MAX_CONTENT_LENGTH"] = 15 * 1024 * 1024  # ~15 МБ/файл
 def discount_request():
     if not session.get("user_login"):
         return redirect(url_for("login"))
-    return render_template_string(BASE, title="Запрос на скидку", body=DISCOUNT_REQUEST_FORM)
+    return render_template("discount_request.html", title="Запрос на скидку")
 
 @app.post("/discount/request")
 def discount_request_post():
@@ -170,7 +182,7 @@ def discount_request_post():
     user = session["user_login"]
     msg  = (request.form.get("message") or "").strip()
 
-    with get_conn() as conn:
+    with db_session() as conn:
         cur = conn.cursor()
         rid = cur.var(oracledb.NUMBER)
         cur.execute("""
@@ -182,25 +194,13 @@ def discount_request_post():
         # ВАЖНО: в oracledb var.getvalue() -> [<NUMBER>], берём первый элемент
         request_id = int(rid.getvalue()[0])
 
-        # чтобы надёжно писать BLOB-ы:
-        cur.setinputsizes(blob=oracledb.BLOB)
-
+        # файлы пишутся в BLOB кусками из потока загрузки, без f.read() целиком (attachments.py)
         files = request.files.getlist("files")
         for f in files or []:
             if not f or not f.filename:
                 continue
-            data = f.read()
-            cur.execute("""
-              INSERT INTO DISCOUNT_REQUEST_FILES (REQUEST_ID, FILENAME, MIMETYPE, SIZE_BYTES, CONTENT)
-              VALUES (:r, :fn, :mt, :sz, :blob)
-            """, {
-              "r": request_id,
-              "fn": f.filename[:255],
-              "mt": (f.mimetype or "")[:128],
-              "sz": len(data),
-              "blob": data
-            })
-        conn.commit()
+            with tracing.span("attachment", f.filename[:64]):
+                attachments.store(cur, request_id, f)
 
     flash("Запрос отправлен. Мы уведомим вас после рассмотрения.", "success")
     return redirect(url_for("search_routes"))
@@ -216,7 +216,8 @@ ADMIN_DISCOUNT_VIEW = """
     <ul class="list-group mb-3">
       {% for f in files %}
         <li class="list-group-item d-flex justify-content-between align-items-center">
-          <div><b>{{ f.FILENAME }}</b> <span class="text-muted small">({{ f.MIMETYPE or "file" }}, {{ f.SIZE_BYTES or 0 }} байт)</span></div>
+          <div><b>{{ f.FILENAME }}</b> <span class="text-muted small">({{ f.MIMETYPE or "file" }}, {{ f.SIZE_BYTES or 0 }} байт)</span>
+            {% if f.SHA256 %}<div class="text-muted small font-monospace">sha256 {{ f.SHA256 }}</div>{% endif %}</div>
           <a class="btn btn-sm btn-outline-secondary" href="{{ url_for('admin_discount_file', file_id=f.ID) }}">Скачать</a>
         </li>
       {% endfor %}
@@ -243,53 +244,129 @@ ADMIN_DISCOUNT_VIEW = """
 def admin_discount_view(req_id:int):
     guard = admin_required()
     if guard: return guard
-    with get_conn() as conn:
-        cur=conn.cursor()
-        cur.execute("""
+    with db_session() as conn:
+        rec = fetch_one(conn, """
           SELECT ID, USER_LOGIN, MESSAGE, STATUS, CREATED_AT, READ_AT
           FROM DISCOUNT_REQUESTS WHERE ID=:id
         """, {"id": req_id})
-        r = cur.fetchone()
-        if not r:
+        if not rec:
             flash("Заявка не найдена.", "warning")
             return redirect(url_for("admin_dashboard"))
-        rec = dict(zip([c[0] for c in cur.description], r))
         # пометить прочитанной
-        if not rec.get("READ_AT"):
-            cur.execute("UPDATE DISCOUNT_REQUESTS SET READ_AT=SYSTIMESTAMP WHERE ID=:id", {"id": req_id})
-            conn.commit()
-            rec["READ_AT"] = "только что"
+        if not rec.READ_AT:
+            conn.cursor().execute("UPDATE DISCOUNT_REQUESTS SET READ_AT=SYSTIMESTAMP WHERE ID=:id", {"id": req_id})
+            rec = rec._replace(READ_AT="только что")
 
-        cur.execute("""
-          SELECT ID, FILENAME, MIMETYPE, SIZE_BYTES, UPLOADED_AT
+        files = fetch_all(conn, """
+          SELECT ID, FILENAME, MIMETYPE, SIZE_BYTES, SHA256, UPLOADED_AT
           FROM DISCOUNT_REQUEST_FILES
           WHERE REQUEST_ID=:id
           ORDER BY ID
         """, {"id": req_id})
-        files = [dict(zip([c[0] for c in cur.description], x)) for x in cur.fetchall()]
-    body = render_template_string(ADMIN_DISCOUNT_VIEW, r=rec, files=files)
-    return render_template_string(BASE, title=f"Заявка #{req_id}", body=body)
+    return render_template("admin_discount.html", title=f"Заявка #{req_id}", r=rec, files=files)
 
 @app.get("/admin/discounts/file/<int:file_id>")
 def admin_discount_file(file_id:int):
     guard = admin_required()
     if guard: return guard
-    with get_conn() as conn:
-        cur=conn.cursor()
-        cur.execute("SELECT FILENAME, MIMETYPE, CONTENT FROM DISCOUNT_REQUEST_FILES WHERE ID=:id", {"id": file_id})
-        row = cur.fetchone()
-        if not row:
-            flash("Файл не найден.", "warning")
-            return redirect(url_for("admin_dashboard"))
-        filename, mimetype, content = row[0], (row[1] or "application/octet-stream"), row[2].read()
-    from io import BytesIO
-    from flask import send_file
-    return send_file(BytesIO(content), mimetype=mimetype, as_attachment=True, download_name=filename)
-
+    with db_session() as conn:
+        row = attachments.meta(conn, file_id)  # размер и хэш — без чтения BLOB
+    if not row:
+        flash("Файл не найден.", "warning")
+        return redirect(url_for("admin_dashboard"))
+    size = int(row.SIZE_BYTES or 0)
+    etag = attachments.etag(row)
+    headers = {"Accept-Ranges": "bytes", "Content-Disposition": attachments.content_disposition(row.FILENAME),
+               "Cache-Control": "private, no-cache"}
+    mimetype = row.MIMETYPE or "application/octet-stream"
+
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304, headers=headers)
+        resp.set_etag(etag)
+        return resp
+
+    start, stop, status = 0, size, 200
+    # один диапазон; несколько диапазонов или If-Range с другим ETag/датой — отдаём файл целиком
+    rng = request.range
+    if (rng is not None and len(rng.ranges) == 1
+            and ("If-Range" not in request.headers or request.if_range.etag == etag)):
+        span = rng.range_for_length(size)
+        if span is None:
+            resp = app.response_class(status=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+            resp.set_etag(etag)
+            return resp
+        (start, stop), status = span, 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+
+    # тело — генератором из своей сессии пула; для HEAD LOB не открывается вовсе
+    body = () if request.method == "HEAD" else attachments.iter_content(file_id, start, stop)
+    resp = app.response_class(body, status=status, mimetype=mimetype, headers=headers)
+    resp.content_length = stop - start
+    resp.set_etag(etag)
+    return resp
+
+
+ADMIN_SQL_STATS = """
+<div class="glass">
+  <div class="d-flex justify-content-between align-items-center mb-2">
+    <h2 class="h5 mb-0">SQL-запросы воркера</h2>
+    <a class="btn btn-sm btn-outline-secondary" href="{{ url_for('admin_dashboard') }}">Назад</a>
+  </div>
+  <div class="text-muted small mb-3">
+    PID {{ s.pid }} · с {{ s.since }} · отпечатков: {{ s.fingerprints }} · медленный — от {{ s.slow_query_ms }} мс.
+    Статистика в памяти процесса: у других воркеров — своя.
+  </div>
+  <div class="btn-group btn-group-sm mb-3">
+    <a class="btn {{ 'btn-primary' if by == 'total' else 'btn-outline-primary' }}"
+       href="{{ url_for('admin_sql_stats', by='total', limit=limit) }}">по суммарному времени</a>
+    <a class="btn {{ 'btn-primary' if by == 'p95' else 'btn-outline-primary' }}"
+       href="{{ url_for('admin_sql_stats', by='p95', limit=limit) }}">по p95</a>
+    <a class="btn btn-outline-secondary" href="{{ url_for('admin_sql_stats', by=by, limit=limit, format='json') }}">JSON</a>
+  </div>
+  {% if s.top %}
+  <div class="table-responsive">
+    <table class="table table-sm align-middle small">
+      <thead>
+        <tr>
+          <th>Запрос</th><th class="text-end">Вызовов</th><th class="text-end">Всего, мс</th>
+          <th class="text-end">p95, мс</th><th class="text-end">Среднее, мс</th><th class="text-end">Макс, мс</th>
+          <th class="text-end">Выполнение / выборка, мс</th><th class="text-end">Строк</th>
+          <th class="text-end">Round trips</th><th class="text-end">Медленных</th>
+        </tr>
+      </thead>
+      <tbody>
+        {% for r in s.top %}
+        <tr>
+          <td>
+            <div class="fw-bold">{{ r.name }}</div>
+            <div class="text-muted font-monospace text-truncate" style="max-width:480px" title="{{ r.sql }}">{{ r.sql }}</div>
+          </td>
+          <td class="text-end">{{ r.calls }}</td>
+          <td class="text-end {{ 'fw-bold' if by == 'total' }}">{{ r.total_ms }}</td>
+          <td class="text-end {{ 'fw-bold' if by == 'p95' }}">{{ r.p95_ms }}</td>
+          <td class="text-end">{{ r.avg_ms }}</td>
+          <td class="text-end">{{ r.max_ms }}</td>
+          <td class="text-end">{{ r.exec_ms }} / {{ r.fetch_ms }}</td>
+          <td class="text-end">{{ r.rows }}</td>
+          <td class="text-end">{{ r.round_trips }}</td>
+          <td class="text-end">{{ r.slow or "—" }}</td>
+        </tr>
+        {% endfor %}
+      </tbody>
+    </table>
+  </div>
+  {% else %}
+    <div class="text-muted">Этот воркер ещё не выполнял запросов.</div>
+  {% endif %}
+</div>
+"""
 
 ADMIN_TMPL = """
 <div class="glass">
-  <h2 class="h5 mb-3">Админ-панель</h2>
+  <div class="d-flex justify-content-between align-items-center mb-3">
+    <h2 class="h5 mb-0">Админ-панель</h2>
+    <a class="small" href="{{ url_for('admin_sql_stats') }}">SQL-запросы воркера →</a>
+  </div>
 
   <ul class="nav nav-tabs mb-3" role="tablist">
     <li class="nav-item"><a class="nav-link active" data-bs-toggle="tab" href="#orders">Оплаты к проверке</a></li>
@@ -529,13 +606,13 @@ RESULTS = """
               <h5 class="card-title">{{ route.CITIES_SEQUENCE }}</h5>
               <div class="row text-muted small">
                 <div class="col-6">
-                  <strong>🚗 Расстояние:</strong> {{ route.TOTAL_DISTANCE_KM }} км
+                  <strong>🚗 Расстояние:</strong> {{ route.SEG_DISTANCE_KM }} км
                 </div>
                 <div class="col-6">
-                  <strong>⏱️ Время:</strong> {{ (route.TOTAL_TIME_MINUTES // 60) }}ч {{ (route.TOTAL_TIME_MINUTES % 60) }}м
+                  <strong>⏱️ Время:</strong> {{ (route.SEG_MINUTES // 60) }}ч {{ (route.SEG_MINUTES % 60) }}м
                 </div>
                 <div class="col-6">
-                  <strong>💰 Цена:</strong> {{ route.TOTAL_PRICE }} руб.
+                  <strong>💰 Цена:</strong> {{ route.SEG_PRICE }} руб.
                 </div>
                 <div class="col-6">
                   <strong>🎯 Категория:</strong> 
@@ -549,14 +626,16 @@ RESULTS = """
             <div class="col-md-4 text-end">
               <div class="mb-2">
                 <strong>🕒 Отправление:</strong><br>
-                {{ route.START_DATETIME.strftime('%d.%m.%Y %H:%M') }}
+                {{ route.SEG_DEPART.strftime('%d.%m.%Y %H:%M') }}
               </div>
               <div class="mb-3">
                 <strong>🕒 Прибытие:</strong><br>
-                {{ route.END_DATETIME.strftime('%d.%m.%Y %H:%M') }}
+                {{ route.SEG_ARRIVE.strftime('%d.%m.%Y %H:%M') }}
               </div>
               <form method="get" action="{{ url_for('seats') }}">
               <input type="hidden" name="schedule_id" value="{{ route.SCHEDULE_ID }}">
+              <input type="hidden" name="from_seq" value="{{ route.FROM_SEQ }}">
+              <input type="hidden" name="to_seq" value="{{ route.TO_SEQ }}">
               <button class="btn btn-primary">Выбрать</button>
             </form>
             </div>
@@ -582,27 +661,40 @@ SEATS_TEMPLATE = """
 
   <!-- Переключатели вагонов -->
   <div class="d-flex align-items-center justify-content-between mb-3">
-    <a class="btn btn-outline-secondary {% if coach<=1 %}disabled{% endif %}"
-       href="{{ url_for('seats') }}?schedule_id={{ schedule_id }}&coach={{ coach-1 }}">◀ Вагон {{ coach-1 }}</a>
+    <a id="coach-prev" class="btn btn-outline-secondary {% if coach<=summary[0].COACH_NO %}disabled{% endif %}"
+       href="{{ url_for('seats', schedule_id=schedule_id, coach=coach-1, **legs) }}">◀ Вагон {{ coach-1 }}</a>
 
     <div class="d-flex justify-content-center flex-wrap" style="gap:6px">
-      {% for c in range(1, 11) %}
-        <a class="btn btn-sm {% if c==coach %}btn-primary{% else %}btn-outline-primary{% endif %}"
-           href="{{ url_for('seats') }}?schedule_id={{ schedule_id }}&coach={{ c }}">{{ c }}</a>
+      {% for c in summary %}
+        <a class="btn btn-sm {% if c.COACH_NO==coach %}btn-primary{% else %}btn-outline-primary{% endif %}"
+           title="свободно {{ c.FREE }} из {{ c.TOTAL }}" data-coach="{{ c.COACH_NO }}"
+           href="{{ url_for('seats', schedule_id=schedule_id, coach=c.COACH_NO, **legs) }}">{{ c.COACH_NO }}
+          <span class="small opacity-75">({{ c.FREE }})</span></a>
       {% endfor %}
     </div>
 
-    <a class="btn btn-outline-secondary {% if coach>=10 %}disabled{% endif %}"
-       href="{{ url_for('seats') }}?schedule_id={{ schedule_id }}&coach={{ coach+1 }}">Вагон {{ coach+1 }} ▶</a>
+    <a id="coach-next" class="btn btn-outline-secondary {% if coach>=summary[-1].COACH_NO %}disabled{% endif %}"
+       href="{{ url_for('seats', schedule_id=schedule_id, coach=coach+1, **legs) }}">Вагон {{ coach+1 }} ▶</a>
   </div>
 
-  <form method="post" action="{{ url_for('seats_post', schedule_id=schedule_id) }}">
+  <!-- автоподбор: лучший блок свободных мест по всему составу -->
+  <form method="post" action="{{ url_for('seats_post', schedule_id=schedule_id) }}"
+        class="d-flex gap-2 justify-content-center align-items-center mb-3">
+    {% for k, v in legs.items() %}<input type="hidden" name="{{ k }}" value="{{ v }}">{% endfor %}
+    <span class="small text-muted">Подобрать</span>
+    <input type="number" name="assign" min="1" max="8" value="2" class="form-control form-control-sm" style="width:72px">
+    <span class="small text-muted">мест рядом</span>
+    <button class="btn btn-sm btn-outline-primary">Подобрать</button>
+  </form>
+
+  <form id="seat-form" method="post" action="{{ url_for('seats_post', schedule_id=schedule_id) }}">
+    {% for k, v in legs.items() %}<input type="hidden" name="{{ k }}" value="{{ v }}">{% endfor %}
     <!-- легенда -->
     <div class="text-muted small mb-2 text-center">Схема (вид сверху): 2 места — коридор — 2 места</div>
 
     <!-- сетка вагона (по центру): 5 колонок (2 места + коридор + 2 места), 5 рядов (итого 20 мест) -->
     <div class="d-flex justify-content-center">
-      <div class="border rounded p-3"
+      <div id="seat-grid" class="border rounded p-3"
            style="display:grid;grid-template-columns:repeat(5, 68px);gap:10px;align-items:center;width:max-content;margin:0 auto">
 
         <!-- заголовок колонок -->
@@ -612,18 +704,18 @@ SEATS_TEMPLATE = """
         <div class="text-muted small text-center">П</div>
         <div class="text-muted small text-center">П</div>
 
-        {% for sn in range(1,21) %}
+        {% for sn in range(1, seat_map.per_coach + 1) %}
           {% set row = ((sn-1)//4)+1 %}
           {% set pos = ((sn-1)%4)+1 %}
           {% set gridcol = 1 if pos==1 else (2 if pos==2 else (4 if pos==3 else 5)) %}
-          {% set seat = (coach_seats|selectattr('SEAT_NO','equalto', sn)|list)|first %}
-          <label class="border rounded px-2 py-2 {% if seat.STATUS!='FREE' %}bg-light text-muted{% endif %}"
+          {% set st = seat_map.status_name(coach, sn) %}
+          <label class="border rounded px-2 py-2 {% if st!='FREE' %}bg-light text-muted{% endif %}"
                  style="grid-column: {{gridcol}}; text-align:center">
-            <input type="checkbox" name="seat_ids" value="{{ seat.ID }}" {% if seat.STATUS!='FREE' %}disabled{% endif %}>
+            <input type="checkbox" name="seat_ids" value="{{ seat_map.seat_id(coach, sn) or '' }}" {% if st!='FREE' %}disabled{% endif %}>
             <div class="small">Ряд {{ row }}</div>
             <div class="fw-bold">{{ sn }}</div>
             <div class="small">
-              {% if seat.STATUS=='FREE' %}свободно{% elif seat.STATUS=='HELD' %}бронь{% else %}куплено{% endif %}
+              {% if st=='FREE' %}свободно{% elif st=='HELD' %}бронь{% elif st %}куплено{% else %}—{% endif %}
             </div>
           </label>
           {% if pos==2 %}
@@ -639,9 +731,185 @@ SEATS_TEMPLATE = """
     </div>
   </form>
 </div>
+
+<!-- Переключение вагонов без перезагрузки: схема всего состава грузится один раз
+     (/api/schedules/<id>/seats), дальше её обновляют события SSE (.../seats/stream);
+     при (пере)подключении и возврате на вкладку — сверка по ETag (обычно 304). -->
+<script>
+(function () {
+  const api = "{{ url_for('api_schedule_seats', schedule_id=schedule_id, **legs) }}";
+  const mask = {{ mask }};  // перегоны поездки: статус места — по пересечению с занятыми перегонами
+  const stream = "{{ url_for('api_schedule_seats_stream', schedule_id=schedule_id) }}";
+  const grid = document.getElementById("seat-grid");
+  const form = document.getElementById("seat-form");
+  const prev = document.getElementById("coach-prev");
+  const next = document.getElementById("coach-next");
+  const selected = new Set();
+  let coach = {{ coach }}, map = null, etag = null;
+
+  grid.querySelectorAll("input[name=seat_ids]:checked").forEach(i => selected.add(i.value));
+  grid.addEventListener("change", e => {
+    if (e.target.name !== "seat_ids") return;
+    e.target.checked ? selected.add(e.target.value) : selected.delete(e.target.value);
+  });
+
+  function seatId(c, sn) {
+    const i = (c - map.first_coach) * map.per_coach + sn - 1;
+    return map.ids ? map.ids[i] : map.id_base + i;
+  }
+  function state(c, sn) { return map.state[(c - map.first_coach) * map.per_coach + sn - 1]; }
+
+  function render() {
+    const head = Array.from(grid.children).slice(0, 5);  // заголовки колонок
+    grid.replaceChildren(...head);
+    for (let sn = 1; sn <= map.per_coach; sn++) {
+      const row = Math.floor((sn - 1) / 4) + 1, pos = (sn - 1) % 4 + 1;
+      const st = state(coach, sn), free = st === "0";
+      const id = st === "-" ? "" : String(seatId(coach, sn));
+      const label = document.createElement("label");
+      label.className = "border rounded px-2 py-2" + (free ? "" : " bg-light text-muted");
+      label.style.cssText = "grid-column: " + [1, 2, 4, 5][pos - 1] + "; text-align:center";
+      label.innerHTML = '<input type="checkbox" name="seat_ids">' +
+        '<div class="small">Ряд ' + row + '</div><div class="fw-bold">' + sn + '</div>' +
+        '<div class="small">' + ({"0": "свободно", "1": "бронь", "2": "куплено"}[st] || "—") + '</div>';
+      const box = label.firstChild;
+      box.value = id;
+      box.disabled = !free;
+      box.checked = free && selected.has(id);
+      grid.appendChild(label);
+      if (pos === 2) grid.appendChild(document.createElement("div"));  // коридор
+    }
+    document.querySelectorAll("[data-coach]").forEach(a => {
+      const c = +a.dataset.coach;
+      const from = (c - map.first_coach) * map.per_coach;
+      const freeCnt = map.state.slice(from, from + map.per_coach).filter(st => st === "0").length;
+      a.classList.toggle("btn-primary", c === coach);
+      a.classList.toggle("btn-outline-primary", c !== coach);
+      a.querySelector("span").textContent = "(" + freeCnt + ")";
+    });
+    const last = map.first_coach + map.coaches - 1;
+    prev.classList.toggle("disabled", coach <= map.first_coach);
+    next.classList.toggle("disabled", coach >= last);
+    prev.textContent = "◀ Вагон " + (coach - 1);
+    next.textContent = "Вагон " + (coach + 1) + " ▶";
+  }
+
+  function show(c) {
+    coach = c;
+    const url = new URL(location.href);
+    url.searchParams.set("coach", c);
+    history.replaceState(null, "", url);
+    render();
+  }
+
+  async function load() {
+    const r = await fetch(api, {headers: etag ? {"If-None-Match": etag} : {}, cache: "no-cache"});
+    if (r.status === 304 || !r.ok) return false;
+    etag = r.headers.get("ETag");
+    map = await r.json();
+    map.state = map.state.split("");
+    return true;
+  }
+
+  function apply(changes) {
+    changes.forEach(([c, sn, held, sold]) => {
+      const i = (c - map.first_coach) * map.per_coach + sn - 1;
+      if (i < 0 || i >= map.state.length) return;
+      const st = (sold & mask) ? "2" : (held & mask) ? "1" : "0";
+      map.state[i] = st;
+      if (st !== "0") selected.delete(String(seatId(c, sn)));  // место ушло — снимаем выбор
+    });
+    render();
+  }
+
+  function refresh() { return load().then(changed => changed && render()).catch(() => {}); }
+
+  function go(e, c) {
+    if (!map) return;  // схема ещё не загружена — обычный переход по ссылке
+    e.preventDefault();
+    if (c >= map.first_coach && c < map.first_coach + map.coaches) show(c);
+  }
+  document.querySelectorAll("[data-coach]").forEach(a => a.addEventListener("click", e => go(e, +a.dataset.coach)));
+  prev.addEventListener("click", e => go(e, coach - 1));
+  next.addEventListener("click", e => go(e, coach + 1));
+
+  // выбранные места из других вагонов уходят скрытыми полями
+  form.addEventListener("submit", () => {
+    grid.querySelectorAll("input[name=seat_ids]").forEach(i => i.removeAttribute("name"));
+    selected.forEach(id => {
+      const h = document.createElement("input");
+      h.type = "hidden"; h.name = "seat_ids"; h.value = id;
+      form.appendChild(h);
+    });
+  });
+
+  document.addEventListener("visibilitychange", () => {
+    if (document.visibilityState === "visible" && map) refresh();
+  });
+  if (window.EventSource) {
+    const listen = () => {
+      const es = new EventSource(stream);
+      es.addEventListener("open", refresh);  // догоняем то, что изменилось до подписки
+      es.addEventListener("seats", e => map && apply(JSON.parse(e.data)));
+      es.addEventListener("resync", refresh);
+      es.addEventListener("error", () => {
+        // 503 (все потоки воркера заняты) закрывает EventSource насовсем — переподключаемся сами
+        if (es.readyState === EventSource.CLOSED) { refresh(); setTimeout(listen, 30000); }
+      });
+    };
+    listen();
+  } else {
+    refresh();
+  }
+})();
+</script>
+"""
+
+CHECKOUT = """
+<div class="glass">
+  <h2 class="h5 mb-3">Оплата заказа #{{ order_id }}</h2>
+  <p>Демо-режим: оплаты нет. Нажми «Оплатить» — зафиксируем покупку и места станут SOLD.</p>
+  <form method="post" action="{{ url_for('pay_order', order_id=order_id) }}">
+    <button class="btn btn-primary">Оплатить</button>
+    <a class="btn btn-outline-secondary" href="{{ url_for('search_routes') }}">Назад к поиску</a>
+  </form>
+</div>
 """
 
 
+# ---------------- Реестр шаблонов ----------------
+# Inline-шаблоны регистрируются по имени и компилируются Jinja один раз на процесс
+# (кэш окружения), скомпилированный байткод кладётся на диск — новый воркер его не перекомпилирует.
+# Страницы наследуют base.html вместо двойного рендера с body|safe.
+def _page(src: str) -> str:
+    return '{% extends "base.html" %}{% block body %}' + src + '{% endblock %}'
+
+
+TEMPLATES = {
+    "base.html": BASE,
+    "index.html": _page(INDEX),
+    "register.html": _page(REGISTER),
+    "verify.html": _page(VERIFY),
+    "success.html": _page(SUCCESS),
+    "login.html": _page(LOGIN_FORM),
+    "search.html": _page(SEARCH_FORM + RESULTS),
+    "seats.html": _page(SEATS_TEMPLATE),
+    "checkout.html": _page(CHECKOUT),
+    "discount_request.html": _page(DISCOUNT_REQUEST_FORM),
+    "admin.html": _page(ADMIN_TMPL),
+    "admin_discount.html": _page(ADMIN_DISCOUNT_VIEW),
+    "admin_sql.html": _page(ADMIN_SQL_STATS),
+}
+
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "routes_jinja_cache")
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+app.jinja_options = {
+    **app.jinja_options,
+    "loader": DictLoader(TEMPLATES),
+    "bytecode_cache": FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+    "auto_reload": False,  # шаблоны в коде: без проверки «изменился ли источник» на каждый рендер
+}
+
 
 # ---------------- Валидация ----------------
 LOGIN_RE = re.compile(r"^[A-Za-z0-9_]{3,32}$")
@@ -660,108 +928,197 @@ def valid_code(s: str) -> bool: return bool(CODE_RE.match(s or ""))
 
 # ---------------- Email ----------------
 def send_email(to_email: str, subject: str, text: str) -> None:
-    g_from = (os.getenv("FROM_GMAIL") or "").strip()
-    g_app = (os.getenv("GMAIL_APP_PW") or "").strip()
-    msg = EmailMessage()
-    msg["From"] = g_from if g_from else (os.getenv("SMTP_FROM") or "")
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    msg.set_content(text)
-
-    try:
-        if g_from and g_app:
-            with smtplib.SMTP("smtp.gmail.com", 587) as smtp:
-                smtp.ehlo();
-                smtp.starttls();
-                smtp.ehlo()
-                smtp.login(g_from, g_app)
-                smtp.send_message(msg)
-            print(f"[EMAIL][gmail] to={to_email}: OK")
-            return
-        host = (os.getenv("SMTP_HOST") or "").strip()
-        if not host:
-            raise RuntimeError("Нет настроек SMTP/Gmail")
-        port = int(os.getenv("SMTP_PORT") or "587")
-        user = (os.getenv("SMTP_USER") or "").strip()
-        pwd = (os.getenv("SMTP_PASSWORD") or "").strip()
-        use_tls = (os.getenv("SMTP_TLS") or "1").strip() in ("1", "true", "True")
-        with (smtplib.SMTP(host, port, timeout=15) if use_tls else smtplib.SMTP_SSL(host, port, timeout=15)) as s:
-            if use_tls:
-                s.ehlo();
-                s.starttls()
-            s.login(user, pwd)
-            s.send_message(msg)
-        print(f"[EMAIL][smtp] to={to_email}: OK")
-    except Exception as e:
-        print(f"[EMAIL][ERROR] to={to_email}: {e}")
-        print(f"[EMAIL][fallback] -> {to_email}: {text}")
+    """Поставить письмо в outbox (email_outbox) в транзакции текущего запроса.
+    Отправляет фоновый поток mailer.py — ответ не ждёт SMTP."""
+    with db_session() as conn, tracing.span("email", "enqueue"):
+        mailer.enqueue(conn, to_email, subject, text)
+    if has_request_context():
+        g.mail_queued = True
 
 
 # ---------------- Oracle helpers ----------------
-def get_conn():
+# get_conn() выдаёт сессию из пула процесса (см. db.py)
+@contextmanager
+def db_session():
+    """Сессия для db_* функций.
+    Внутри HTTP-запроса — одна сессия на весь запрос (берётся лениво и лежит в g),
+    коммит один раз в конце запроса. Вне запроса — отдельная сессия с коммитом на выходе."""
+    if has_request_context():
+        conn = g.get("db_conn")
+        if conn is None:
+            with tracing.span("db_acquire"):
+                conn = g.db_conn = get_conn()
+        yield conn
+        return
+    with tracing.span("db_acquire"):
+        conn = get_conn()
+    with conn:
+        yield conn
+        conn.commit()
+
+
+def db_rollback():
+    """Откатить всё, что текущий запрос успел сделать в БД."""
+    conn = g.get("db_conn") if has_request_context() else None
+    if conn is not None:
+        conn.rollback()
+
+
+@app.before_request
+def metrics_request_start():
+    g.t0 = time.perf_counter()
+    g.trace_token = tracing.start(request.endpoint or "unmatched")
+
+
+@app.after_request
+def metrics_request_end(response):
+    # регистрируется раньше db_commit_request, значит выполняется после него: коммит входит во время
+    t0 = g.pop("t0", None)
+    if t0 is not None:
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - t0, request.endpoint or "unmatched",
+                                     request.method, str(response.status_code))
+    token = g.pop("trace_token", None)
+    if token is not None:
+        response.headers["Server-Timing"] = tracing.server_timing(tracing.current())
+        tracing.finish(token, method=request.method, path=request.path, status=response.status_code)
+    return response
+
+
+@app.before_request
+def profile_request_start():
+    g.profile_run = profiling.request_started(request.endpoint)  # None, если профиль не заказан
+
+
+@app.teardown_request
+def profile_request_end(exc):
+    profiling.request_finished(g.pop("profile_run", None))
+
+
+@app.teardown_request
+def trace_request_teardown(exc):
+    # after_request не вызывался (необработанная ошибка) — трассу всё равно закрываем
+    token = g.pop("trace_token", None)
+    if token is not None:
+        tracing.finish(token, method=request.method, path=request.path, status=500, error=repr(exc))
+
+
+@before_render_template.connect_via(app)
+def metrics_render_start(sender, template, context, **extra):
+    g.setdefault("render_t0", {})[template.name] = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def metrics_render_end(sender, template, context, **extra):
+    t0 = g.get("render_t0", {}).pop(template.name, None)
+    if t0 is not None:
+        sec = time.perf_counter() - t0
+        metrics.TEMPLATE_SECONDS.observe(sec, template.name)
+        tracing.record("template", sec, template.name)
+
+
+@app.after_request
+def db_commit_request(response):
+    # коммитим до отправки ответа: если коммит упадёт, клиент получит 500, а не ложный успех
+    conn = g.get("db_conn")
+    if conn is not None:
+        with tracing.span("db", "COMMIT"):
+            conn.commit()
+        if g.get("mail_queued"):
+            mailer.wake()  # письмо закоммичено — пусть отправитель не ждёт опроса
+    return response
+
+
+@app.teardown_request
+def db_release_request(exc):
+    conn = g.pop("db_conn", None)
+    if conn is None:
+        return
     try:
-        return oracledb.connect(user=ORA_USER, password=ORA_PASSWORD, dsn=DSN)
-    except Exception as e:
-        print(f"[DB][CONNECTION ERROR] {e}")
-        raise
-def db_get_seats(schedule_id: int):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-          SELECT ID, SCHEDULE_ID, TRANSPORT_TYPE_ID, COACH_NO, SEAT_NO, STATUS
+        if exc is not None:
+            conn.rollback()
+    finally:
+        conn.close()  # возвращаем сессию в пул
+        metrics.set_pool(pool_stats())
+
+
+def db_get_seat_map(schedule_id: int, coach: int | None = None, mask: int = ALL_LEGS) -> SeatMap | None:
+    """Схема мест рейса для поездки по перегонам mask: весь состав или только вагон coach.
+    None — мест нет."""
+    sql = """
+      SELECT ID, COACH_NO, SEAT_NO, HELD_MASK, SOLD_MASK
+      FROM SCHEDULE_SEATS
+      WHERE SCHEDULE_ID = :sid
+    """
+    binds = {"sid": schedule_id}
+    if coach is not None:
+        sql += " AND COACH_NO = :coach"
+        binds["coach"] = coach
+    with db_session() as conn:
+        return SeatMap.from_rows(fetch_all(conn, sql, binds, shape=SHAPE_LARGE, name="seats"), mask)
+
+def db_get_coach_summary(schedule_id: int, mask: int = ALL_LEGS):
+    """Сводка по вагонам рейса: COACH_NO, TOTAL, FREE (свободно на перегонах mask)."""
+    with db_session() as conn:
+        return fetch_all(conn, f"""
+          SELECT COACH_NO, COUNT(*) AS TOTAL,
+                 SUM(CASE WHEN {booking.FREE_ON_LEGS} THEN 1 ELSE 0 END) AS FREE
           FROM SCHEDULE_SEATS
           WHERE SCHEDULE_ID = :sid
-          ORDER BY COACH_NO, SEAT_NO
-        """, {"sid": schedule_id})
-        rows = cur.fetchall()
-        return [dict(zip([c[0] for c in cur.description], r)) for r in rows]
-
-def db_hold_seats(seat_ids: list[int]) -> int:
-    """Переводит FREE -> HELD для указанных мест. Возвращает число забронированных записей."""
-    if not seat_ids:
-        return 0
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.executemany("""
-          UPDATE SCHEDULE_SEATS
-          SET STATUS='HELD'
-          WHERE ID=:1 AND STATUS='FREE'
-        """, [(sid,) for sid in seat_ids])
-        updated = cur.rowcount
-        conn.commit()
-        return int(updated or 0)
+          GROUP BY COACH_NO
+          ORDER BY COACH_NO
+        """, {"sid": schedule_id, "m": mask}, name="seat_summary")
+
+# SEATS_VERSION рейса растёт при любой смене статусов его мест — это ETag схемы мест
+BUMP_SEATS_VERSION_BY_ORDER = """
+  UPDATE ROUTE_SCHEDULE SET SEATS_VERSION = SEATS_VERSION + 1
+  WHERE SCHEDULE_ID = (SELECT SCHEDULE_ID FROM ORDERS WHERE ID = :id)
+"""
 
-def db_create_order(user_login: str, schedule_id: int, seat_ids: list[int], per_seat_price: float) -> int:
-    """Создаёт заказ + позиции. Возвращает order_id."""
-    total = per_seat_price * len(seat_ids)
-    with get_conn() as conn:
+def db_get_seats_version(schedule_id: int):
+    """Версия схемы мест рейса; None — рейса нет."""
+    with db_session() as conn:
         cur = conn.cursor()
-        # вставка заказа с возвратом ID
-        oid = cur.var(oracledb.NUMBER)
-        cur.execute("""
-          INSERT INTO ORDERS(USER_LOGIN, SCHEDULE_ID, TOTAL_PRICE, STATUS)
-          VALUES (:u, :sid, :tot, 'NEW')
-          RETURNING ID INTO :oid
-        """, dict(u=user_login, sid=schedule_id, tot=total, oid=oid))
-        order_id = int(oid.getvalue())
-        # позиции заказа
-        cur.executemany("""
-          INSERT INTO ORDER_ITEMS(ORDER_ID, SEAT_ID, PRICE)
-          VALUES (:1, :2, :3)
-        """, [(order_id, sid, per_seat_price) for sid in seat_ids])
-        conn.commit()
-        return order_id
+        cur.execute("SELECT SEATS_VERSION FROM ROUTE_SCHEDULE WHERE SCHEDULE_ID = :sid", {"sid": schedule_id})
+        row = cur.fetchone()
+    return int(row[0]) if row else None
+
+def db_book_seats(user_login: str, schedule_id: int, seat_ids: list[int], mask: int = ALL_LEGS) -> booking.Booking:
+    """Бронь + заказ одной транзакцией (см. booking.py); коммит — в конце запроса."""
+    with db_session() as conn:
+        return booking.book_seats(conn, user_login, schedule_id, seat_ids, mask)
+
+def db_assign_seats(user_login: str, schedule_id: int, n: int, mask: int = ALL_LEGS):
+    """Подбор n мест рядом по схеме рейса + бронь и заказ (см. booking.assign_seats).
+    Возвращает (Booking, Block) или (None, None), если мест у рейса нет."""
+    seat_map = db_get_seat_map(schedule_id, mask=mask)
+    if seat_map is None:
+        return None, None
+    with db_session() as conn:
+        return booking.assign_seats(conn, user_login, schedule_id, seat_map, n, mask)
+
+def db_seat_labels(seat_ids: list[int]) -> list[str]:
+    """«вагон N, место M» для сообщений пользователю."""
+    if not seat_ids:
+        return []
+    binds = {f"s{i}": sid for i, sid in enumerate(seat_ids)}
+    with db_session() as conn:
+        rows = fetch_all(conn, f"""
+          SELECT COACH_NO, SEAT_NO FROM SCHEDULE_SEATS
+          WHERE ID IN ({", ".join(":" + k for k in binds)})
+          ORDER BY COACH_NO, SEAT_NO
+        """, binds)
+    return [f"вагон {r.COACH_NO}, место {r.SEAT_NO}" for r in rows]
 
-def db_mark_order_paid(order_id: int) -> None:
-    with get_conn() as conn:
+def db_mark_order_paid(order_id: int) -> bool:
+    """NEW -> PAID, места -> SOLD. False — заказ уже не NEW (например, отменён по истечении брони)."""
+    with db_session() as conn:
         cur = conn.cursor()
-        cur.execute("UPDATE ORDERS SET STATUS='PAID' WHERE ID=:id", {"id": order_id})
-        cur.execute("""
-          UPDATE SCHEDULE_SEATS
-          SET STATUS='SOLD'
-          WHERE ID IN (SELECT SEAT_ID FROM ORDER_ITEMS WHERE ORDER_ID=:id)
-        """, {"id": order_id})
-        conn.commit()
+        cur.execute("UPDATE ORDERS SET STATUS='PAID' WHERE ID=:id AND STATUS='NEW'", {"id": order_id})
+        if not cur.rowcount:
+            return False
+        booking.sell_order(cur, order_id)  # бронь -> продажа только на перегонах заказа
+        cur.execute(BUMP_SEATS_VERSION_BY_ORDER, {"id": order_id})
+        return True
 
 
 def init_db():
@@ -818,160 +1175,185 @@ def check_db_connection():
 
 
 def db_get_unverified_user(login):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
+    with db_session() as conn:
+        row = fetch_one(conn, """
             SELECT LOGIN, EMAIL, PASSWORD_HASH, VERIFICATION_CODE, CODE_EXPIRES_AT, VERIFICATION_ATTEMPTS
             FROM USERS
             WHERE LOGIN = :l AND VERIFIED_AT IS NULL
-        """, [login])
-        row = cur.fetchone()
-        if not row:
-            return None
-        exp = as_aware_utc(row[4]) if row[4] else None
-        return {
-            "login": row[0],
-            "email": row[1],
-            "password_hash": row[2],
-            "code": row[3],
-            "expires_at": exp,
-            "attempts": int(row[5]),
-        }
+        """, {"l": login}, name="user_unverified")
+    if not row:
+        return None
+    return {
+        "login": row.LOGIN,
+        "email": row.EMAIL,
+        "password_hash": row.PASSWORD_HASH,
+        "code": row.VERIFICATION_CODE,
+        "expires_at": as_aware_utc(row.CODE_EXPIRES_AT) if row.CODE_EXPIRES_AT else None,
+        "attempts": int(row.VERIFICATION_ATTEMPTS),
+    }
 
 
 def db_update_verification_code(login, code, expires_at):
-    with get_conn() as conn:
+    with db_session() as conn:
         cur = conn.cursor()
         cur.execute("""
             UPDATE USERS
             SET VERIFICATION_CODE = :code, CODE_EXPIRES_AT = :expires_at, VERIFICATION_ATTEMPTS = 0
             WHERE LOGIN = :login AND VERIFIED_AT IS NULL
         """, dict(code=code, expires_at=expires_at, login=login))
-        conn.commit()
 
 
 def db_increment_attempts(login):
-    with get_conn() as conn:
+    with db_session() as conn:
         cur = conn.cursor()
         cur.execute(
             "UPDATE USERS SET VERIFICATION_ATTEMPTS = VERIFICATION_ATTEMPTS + 1 WHERE LOGIN = :l AND VERIFIED_AT IS NULL",
             [login])
-        conn.commit()
 
 
 def db_mark_verified(login):
-    with get_conn() as conn:
+    with db_session() as conn:
         cur = conn.cursor()
         cur.execute("""
             UPDATE USERS 
             SET VERIFIED_AT = :verified_at, VERIFICATION_CODE = NULL, CODE_EXPIRES_AT = NULL, VERIFICATION_ATTEMPTS = 0
             WHERE LOGIN = :login
         """, dict(verified_at=datetime.now(timezone.utc), login=login))
-        conn.commit()
 
 
 def db_create_unverified_user(login, email, password_hash, code, expires_at):
-    with get_conn() as conn:
+    with db_session() as conn:
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO USERS (LOGIN, EMAIL, PASSWORD_HASH, VERIFICATION_CODE, CODE_EXPIRES_AT)
             VALUES (:l, :e, :ph, :code, :exp)
         """, dict(l=login, e=email, ph=password_hash, code=code, exp=expires_at))
-        conn.commit()
 
 
 def db_login_taken(login: str) -> bool:
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM USERS WHERE LOGIN = :l", {"l": login})
-        return cur.fetchone() is not None
+    with db_session() as conn:
+        return fetch_one(conn, "SELECT 1 AS TAKEN FROM USERS WHERE LOGIN = :l", {"l": login},
+                         name="user_login_taken") is not None
 
 
 def db_email_taken(email: str) -> bool:
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT 1 FROM USERS WHERE EMAIL = :e", {"e": email})
-        return cur.fetchone() is not None
+    with db_session() as conn:
+        return fetch_one(conn, "SELECT 1 AS TAKEN FROM USERS WHERE EMAIL = :e", {"e": email},
+                         name="user_email_taken") is not None
 
 
 def db_get_user_by_login(login: str):
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-                    SELECT LOGIN, EMAIL, PASSWORD_HASH, VERIFIED_AT, ROLE
-                   FROM USERS
-                    WHERE LOGIN = :l AND VERIFIED_AT IS NOT NULL
-                """, {"l": login})
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {
-            "login": row[0],
-            "email": row[1],
-            "password_hash": row[2],
-            "verified_at": row[3],
-            "role": row[4],
-        }
+    with db_session() as conn:
+        row = fetch_one(conn, """
+            SELECT LOGIN, EMAIL, PASSWORD_HASH, VERIFIED_AT, ROLE
+            FROM USERS
+            WHERE LOGIN = :l AND VERIFIED_AT IS NOT NULL
+        """, {"l": login}, name="user_by_login")
+    if not row:
+        return None
+    return {
+        "login": row.LOGIN,
+        "email": row.EMAIL,
+        "password_hash": row.PASSWORD_HASH,
+        "verified_at": row.VERIFIED_AT,
+        "role": row.ROLE,
+    }
 
 
 # ---------------- Функции для поиска маршрутов ----------------
 def get_cities():
     """Получить список всех городов"""
     try:
-        with get_conn() as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT ID, NAME FROM CITY ORDER BY NAME")
-            cities = cur.fetchall()
-            return [dict(zip([col[0] for col in cur.description], city)) for city in cities]
+        return refdata.get(db_session).cities
     except Exception as e:
         print(f"[DB][ERROR getting cities] {e}")
         return []
 
 
+# Кэш результатов поиска: ключ — нормализованный запрос, одинаковые промахи делят один запрос в БД.
+# Сбрасывается, когда schedule_gen меняет версию расписания (data_version 'SCHEDULE').
+SEARCH_CACHE_TTL_SEC = float(os.getenv("SEARCH_CACHE_TTL_SEC", "60"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2048"))
+SCHEDULE_VERSION_CHECK_SEC = float(os.getenv("SCHEDULE_VERSION_CHECK_SEC", "10"))
+search_cache = ResultCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL_SEC)
+_schedule_version = {"value": None, "checked_at": 0.0}
+
+
+def sync_schedule_version():
+    """Не чаще раза в SCHEDULE_VERSION_CHECK_SEC сверить версию расписания и при смене сбросить кэш поиска."""
+    now = time.monotonic()
+    if now - _schedule_version["checked_at"] < SCHEDULE_VERSION_CHECK_SEC:
+        return
+    _schedule_version["checked_at"] = now
+    with db_session() as conn:
+        version = get_version(conn, "SCHEDULE")
+    if version != _schedule_version["value"]:
+        if _schedule_version["value"] is not None:
+            search_cache.clear()
+            fares.clear()
+            print(f"[SEARCH] schedule version {version}: cache cleared")
+        _schedule_version["value"] = version
+
+
 def search_routes_db(from_city_id, to_city_id, travel_date, category):
     """Поиск маршрутов по параметрам"""
     try:
-        with get_conn() as conn:
-            cur = conn.cursor()
-
-            travel_date = datetime.strptime(travel_date, '%Y-%m-%d')
-
-            query = """
-            SELECT 
-                rs.SCHEDULE_ID,
-                rs.ROUTE_ID,
-                rs.CATEGORY,
-                rs.CITIES_SEQUENCE,
-                rs.TOTAL_DISTANCE_KM,
-                rs.TOTAL_PRICE,
-                rs.TOTAL_TIME_MINUTES,
-                rs.START_DATETIME,
-                rs.END_DATETIME,
-                rs.PATH_CITY_IDS
-            FROM ROUTE_SCHEDULE rs
-            WHERE rs.CATEGORY = :category
-                AND TRUNC(rs.START_DATETIME) = :travel_date
-                AND INSTR('->' || rs.PATH_CITY_IDS || '->', '->' || :from_city_id || '->') > 0
-                AND INSTR('->' || rs.PATH_CITY_IDS || '->', '->' || :to_city_id || '->') > 
-                    INSTR('->' || rs.PATH_CITY_IDS || '->', '->' || :from_city_id || '->')
-            ORDER BY rs.TOTAL_PRICE ASC
-            """
-
-            cur.execute(query, {
-                'from_city_id': str(from_city_id),
-                'to_city_id': str(to_city_id),
-                'travel_date': travel_date,
-                'category': category
-            })
-
-            routes = cur.fetchall()
-            return [dict(zip([col[0] for col in cur.description], route)) for route in routes]
-
+        key = (int(from_city_id), int(to_city_id),
+               datetime.strptime(travel_date, '%Y-%m-%d').date(), category.upper())
+        sync_schedule_version()
+        return search_cache.get_or_load(key, lambda: _search_routes_query(*key))
     except Exception as e:
         print(f"[DB][ERROR searching routes] {e}")
         return []
 
 
+def _search_routes_query(from_city_id, to_city_id, day, category):
+    with db_session() as conn:
+        day_start = datetime(day.year, day.month, day.day)
+
+        # рейсы, у которых from-остановка идёт раньше to-остановки (route_schedule_stop),
+        # дата — полуинтервалом по START_DATETIME, чтобы работал индекс (category, start_datetime)
+        query = """
+        SELECT 
+            rs.SCHEDULE_ID,
+            rs.ROUTE_ID,
+            rs.CATEGORY,
+            rs.CITIES_SEQUENCE,
+            rs.TOTAL_DISTANCE_KM,
+            rs.TOTAL_PRICE,
+            rs.TOTAL_TIME_MINUTES,
+            rs.START_DATETIME,
+            rs.END_DATETIME,
+            rs.PATH_CITY_IDS,
+            rs.PRICE_PER_KM,
+            sf.STOP_SEQ AS FROM_SEQ,
+            st.STOP_SEQ AS TO_SEQ,
+            sf.CUM_DIST_KM AS FROM_KM,
+            sf.CUM_MINUTES AS FROM_MIN,
+            st.CUM_DIST_KM AS TO_KM,
+            st.CUM_MINUTES AS TO_MIN
+        FROM ROUTE_SCHEDULE rs
+        JOIN ROUTE_SCHEDULE_STOP sf
+          ON sf.SCHEDULE_ID = rs.SCHEDULE_ID AND sf.CITY_ID = :from_city_id
+        JOIN ROUTE_SCHEDULE_STOP st
+          ON st.SCHEDULE_ID = rs.SCHEDULE_ID AND st.CITY_ID = :to_city_id
+         AND st.STOP_SEQ > sf.STOP_SEQ
+        WHERE rs.CATEGORY = :category
+            AND rs.START_DATETIME >= :day_start
+            AND rs.START_DATETIME < :day_end
+        ORDER BY (st.CUM_DIST_KM - sf.CUM_DIST_KM) * rs.PRICE_PER_KM ASC
+        """
+
+        # цена и время участка from -> to — по cum-значениям остановок (fares.py)
+        return fares.with_segments(fetch_all(conn, query, {
+            'from_city_id': from_city_id,
+            'to_city_id': to_city_id,
+            'day_start': day_start,
+            'day_end': day_start + timedelta(days=1),
+            'category': category
+        }, name="search"))
+
+
 # ---------------- Вспомогательные ----------------
 def generate_code() -> str:
     return f"{secrets.randbelow(900000) + 100000:06d}"
@@ -980,45 +1362,160 @@ def generate_code() -> str:
 def admin_dashboard():
     guard = admin_required()
     if guard: return guard
-    with get_conn() as conn:
-        cur=conn.cursor()
-        cur.execute("""
+    with db_session() as conn:
+        orders = fetch_all(conn, """
           SELECT ID, USER_LOGIN, SCHEDULE_ID, TOTAL_PRICE, STATUS, CREATED_AT
           FROM ORDERS
           WHERE STATUS='NEW'
           ORDER BY CREATED_AT DESC
-        """)
-        orders = [dict(zip([c[0] for c in cur.description], r)) for r in cur.fetchall()]
-        cur.execute("""
+        """, shape=SHAPE_LARGE)
+        requests = fetch_all(conn, """
           SELECT ID, USER_LOGIN, MESSAGE, STATUS, CREATED_AT, READ_AT
           FROM DISCOUNT_REQUESTS
           WHERE STATUS='PENDING'
           ORDER BY CREATED_AT DESC
-        """)
-        requests = [dict(zip([c[0] for c in cur.description], r)) for r in cur.fetchall()]
-    body = render_template_string(ADMIN_TMPL, orders=orders, requests=requests)
-    return render_template_string(BASE, title="Админ-панель", body=body)
+        """, shape=SHAPE_LARGE)
+    return render_template("admin.html", title="Админ-панель", orders=orders, requests=requests)
+
+@app.get("/admin/pool")
+def admin_pool_stats():
+    guard = admin_required()
+    if guard: return guard
+    return pool_stats()
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Метрики всех воркеров в текстовом формате Prometheus (см. metrics.py).
+    METRICS_TOKEN задан — нужен заголовок Authorization: Bearer <token> (так ходит Prometheus),
+    не задан — только сессия администратора."""
+    token = os.getenv("METRICS_TOKEN")
+    if token:
+        if not secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return {"error": "forbidden"}, 403
+    elif not is_admin():
+        return {"error": "forbidden"}, 403
+    metrics.set_pool(pool_stats())
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.post("/admin/refdata/invalidate")
+def admin_refdata_invalidate():
+    """Сбросить справочники во всех воркерах: версия 'REFDATA' в data_version
+    (остальные воркеры увидят её не позже чем через REFDATA_VERSION_CHECK_SEC)."""
+    guard = admin_required()
+    if guard: return guard
+    with db_session() as conn:
+        version = refdata.invalidate(conn)
+    return {"ok": True, "version": version, "propagates_within_sec": refdata.REFDATA_VERSION_CHECK_SEC}
+
+@app.get("/admin/reaper")
+def admin_reaper_stats():
+    guard = admin_required()
+    if guard: return guard
+    return {"last_sweep": reaper.last_sweep(), "hold_ttl_min": reaper.HOLD_TTL_MIN}
+
+@app.get("/admin/sql")
+def admin_sql_stats():
+    """Топ отпечатков SQL этого воркера с его старта по суммарному времени или p95:
+    ?by=total|p95&limit=20; ?format=json — то же JSON-ом."""
+    guard = admin_required()
+    if guard: return guard
+    by = "p95" if request.args.get("by") == "p95" else "total"
+    limit = request.args.get("limit", "20")
+    limit = min(int(limit), 200) if limit.isdigit() else 20
+    stats = sqlstats.top(by, limit)
+    if request.args.get("format") == "json":
+        return stats
+    return render_template("admin_sql.html", title="SQL-запросы", s=stats, by=by, limit=limit)
+
+@app.get("/admin/profile")
+def admin_profile_status():
+    """Задание CPU-профиля и готовые файлы этого воркера (см. profiling.py)."""
+    guard = admin_required()
+    if guard: return guard
+    return profiling.status()
+
+@app.post("/admin/profile/cpu")
+def admin_profile_cpu():
+    """endpoint=<имя view>&requests=N — профилировать следующие N запросов; action=stop — снять."""
+    guard = admin_required()
+    if guard: return guard
+    if request.form.get("action") == "stop":
+        return profiling.disarm()
+    endpoint = request.form.get("endpoint", "")
+    if endpoint not in app.view_functions:
+        return {"error": "unknown endpoint"}, 400
+    n = request.form.get("requests", "10")
+    return profiling.arm(endpoint, int(n) if n.isdigit() else 10)
+
+@app.get("/admin/profile/files/<name>")
+def admin_profile_file(name: str):
+    guard = admin_required()
+    if guard: return guard
+    path = profiling.dump_path(name)
+    if path is None:
+        return {"error": "not found"}, 404
+    return send_file(path, as_attachment=True, download_name=name)
+
+@app.post("/admin/profile/mem")
+def admin_profile_mem():
+    """action=start[&frames=N] | snapshot | stop — tracemalloc этого воркера."""
+    guard = admin_required()
+    if guard: return guard
+    action = request.form.get("action")
+    frames = request.form.get("frames", "10")
+    try:
+        if action == "start":
+            return profiling.mem_start(int(frames) if frames.isdigit() else 10)
+        if action == "snapshot":
+            return profiling.mem_snapshot()
+        if action == "stop":
+            return profiling.mem_stop()
+    except RuntimeError as e:
+        return {"error": str(e)}, 409
+    return {"error": "action: start | snapshot | stop"}, 400
+
+@app.get("/admin/profile/mem")
+def admin_profile_mem_diff():
+    """Прирост памяти по строкам кода с последнего snapshot: ?limit=30&key=lineno|filename|traceback."""
+    guard = admin_required()
+    if guard: return guard
+    limit = request.args.get("limit", "30")
+    try:
+        return profiling.mem_diff(int(limit) if limit.isdigit() else 30, request.args.get("key", "lineno"))
+    except RuntimeError as e:
+        return {"error": str(e)}, 409
+
+@app.get("/admin/mail")
+def admin_mail_stats():
+    guard = admin_required()
+    if guard: return guard
+    return mailer.stats()
 
 @app.post("/admin/orders/<int:order_id>/paid")
 def admin_mark_paid(order_id:int):
     guard = admin_required()
     if guard: return guard
-    db_mark_order_paid(order_id)  # у тебя уже есть эта функция
-    flash(f"Заказ #{order_id} помечен как оплачен. Места зафиксированы.", "success")
+    if db_mark_order_paid(order_id):
+        flash(f"Заказ #{order_id} помечен как оплачен. Места зафиксированы.", "success")
+    else:
+        flash(f"Заказ #{order_id} уже не ожидает оплаты (отменён или оплачен).", "warning")
     return redirect(url_for("admin_dashboard"))
 
 @app.post("/admin/orders/<int:order_id>/cancel")
 def admin_cancel_order(order_id:int):
     guard = admin_required()
     if guard: return guard
-    with get_conn() as conn:
+    with db_session() as conn:
         cur=conn.cursor()
-        cur.execute("""
-          UPDATE SCHEDULE_SEATS SET STATUS='FREE'
-          WHERE ID IN (SELECT SEAT_ID FROM ORDER_ITEMS WHERE ORDER_ID=:id)
-        """, {"id": order_id})
-        cur.execute("UPDATE ORDERS SET STATUS='CANCELED' WHERE ID=:id", {"id": order_id})
-        conn.commit()
+        # сначала статус: заказ, уже отменённый (например, reaper-ом), не трогает места —
+        # его перегоны могли занять другие покупатели
+        cur.execute("UPDATE ORDERS SET STATUS='CANCELED' WHERE ID=:id AND STATUS IN ('NEW','PAID')",
+                    {"id": order_id})
+        if cur.rowcount != 1:
+            flash(f"Заказ #{order_id} уже отменён.", "warning")
+            return redirect(url_for("admin_dashboard"))
+        booking.release_orders(cur, [order_id])  # освобождаем только перегоны этого заказа
+        cur.execute(BUMP_SEATS_VERSION_BY_ORDER, {"id": order_id})
     flash(f"Заказ #{order_id} отменён, места освобождены.", "info")
     return redirect(url_for("admin_dashboard"))
 
@@ -1028,7 +1525,7 @@ def admin_discount_decide(req_id:int):
     if guard: return guard
     action  = request.form.get("action")
     percent = request.form.get("percent")
-    with get_conn() as conn:
+    with db_session() as conn:
         cur=conn.cursor()
         if action == "approve":
             pct = int(percent or 0)
@@ -1052,22 +1549,19 @@ def admin_discount_decide(req_id:int):
             cur.execute("""
               UPDATE DISCOUNT_REQUESTS SET STATUS='REJECTED', REVIEWED_AT=SYSTIMESTAMP WHERE ID=:id
             """, {"id": req_id})
-        conn.commit()
     flash("Решение по заявке сохранено.", "success")
     return redirect(url_for("admin_discount_view", req_id=req_id))
 
 # ---------------- Маршруты регистрации/входа ----------------
 @app.get("/")
 def index():
-    return render_template_string(BASE, title="Добро пожаловать",
-                                  body=render_template_string(INDEX))
+    return render_template("index.html", title="Добро пожаловать")
 
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "GET":
-        return render_template_string(BASE, title="Регистрация",
-                                      body=render_template_string(REGISTER, f={}))
+        return render_template("register.html", title="Регистрация", f={})
 
     login = (request.form.get("login") or "").strip()
     email = (request.form.get("email") or "").strip()
@@ -1076,16 +1570,13 @@ def register():
 
     if not valid_login(login):
         flash("Логин: 3–32 символа, латиница/цифры/нижнее подчёркивание.", "danger")
-        return render_template_string(BASE, title="Регистрация",
-                                      body=render_template_string(REGISTER, f={"login": login, "email": email}))
+        return render_template("register.html", title="Регистрация", f={"login": login, "email": email})
     if not valid_email(email):
         flash("Введите корректный e-mail.", "danger")
-        return render_template_string(BASE, title="Регистрация",
-                                      body=render_template_string(REGISTER, f={"login": login, "email": email}))
+        return render_template("register.html", title="Регистрация", f={"login": login, "email": email})
     if len(p1) < 8 or p1 != p2:
         flash("Пароль минимум 8 символов и должен совпадать в обоих полях.", "danger")
-        return render_template_string(BASE, title="Регистрация",
-                                      body=render_template_string(REGISTER, f={"login": login, "email": email}))
+        return render_template("register.html", title="Регистрация", f={"login": login, "email": email})
 
     if db_login_taken(login):
         unverified = db_get_unverified_user(login)
@@ -1098,32 +1589,26 @@ def register():
             if DEV_SHOW_CODE:
                 flash(f"(dev) Код: {code}", "info")
 
-            return render_template_string(
-                BASE, title="Подтверждение",
-                body=render_template_string(VERIFY, login=login, email=unverified["email"])
-            )
+            return render_template("verify.html", title="Подтверждение", login=login, email=unverified["email"])
         else:
             flash("Такой логин уже используется.", "warning")
-            return render_template_string(BASE, title="Регистрация",
-                                          body=render_template_string(REGISTER, f={"login": login, "email": email}))
+            return render_template("register.html", title="Регистрация", f={"login": login, "email": email})
 
     if db_email_taken(email):
         flash("Этот e-mail уже используется.", "warning")
-        return render_template_string(BASE, title="Регистрация",
-                                      body=render_template_string(REGISTER, f={"login": login, "email": email}))
+        return render_template("register.html", title="Регистрация", f={"login": login, "email": email})
 
     code = generate_code()
     expires_at = datetime.now(timezone.utc) + timedelta(minutes=CODE_TTL_MIN)
-    db_create_unverified_user(login, email, generate_password_hash(p1), code, expires_at)
+    with tracing.span("password_hash"):
+        password_hash = generate_password_hash(p1)
+    db_create_unverified_user(login, email, password_hash, code, expires_at)
 
     send_email(email, "Код подтверждения", f"Ваш код подтверждения: {code}")
     if DEV_SHOW_CODE:
         flash(f"(dev) Код: {code}", "info")
 
-    return render_template_string(
-        BASE, title="Подтверждение",
-        body=render_template_string(VERIFY, login=login, email=email)
-    )
+    return render_template("verify.html", title="Подтверждение", login=login, email=email)
 
 
 @app.post("/verify")
@@ -1138,13 +1623,11 @@ def verify_code():
 
     if datetime.now(timezone.utc) > as_aware_utc(unverified["expires_at"]):
         flash("Код истёк. Пожалуйста, запросите новый код.", "warning")
-        return render_template_string(BASE, title="Подтверждение",
-                                      body=render_template_string(VERIFY, login=login, email=unverified["email"]))
+        return render_template("verify.html", title="Подтверждение", login=login, email=unverified["email"])
 
     if not valid_code(code):
         flash("Неверный формат кода.", "danger")
-        return render_template_string(BASE, title="Подтверждение",
-                                      body=render_template_string(VERIFY, login=login, email=unverified["email"]))
+        return render_template("verify.html", title="Подтверждение", login=login, email=unverified["email"])
 
     if unverified["attempts"] >= MAX_ATTEMPTS:
         flash("Превышено число попыток. Повторите регистрацию.", "danger")
@@ -1153,12 +1636,10 @@ def verify_code():
     if code != unverified["code"]:
         db_increment_attempts(login)
         flash("Неверный код. Попробуйте ещё раз.", "danger")
-        return render_template_string(BASE, title="Подтверждение",
-                                      body=render_template_string(VERIFY, login=login, email=unverified["email"]))
+        return render_template("verify.html", title="Подтверждение", login=login, email=unverified["email"])
 
     db_mark_verified(login)
-    return render_template_string(BASE, title="Готово",
-                                  body=render_template_string(SUCCESS, login=login))
+    return render_template("success.html", title="Готово", login=login)
 
 
 @app.get("/verify")
@@ -1168,10 +1649,7 @@ def verify_get():
     if not unverified:
         flash("Сессия подтверждения не найдена. Пройдите регистрацию заново.", "danger")
         return redirect(url_for("register"))
-    return render_template_string(
-        BASE, title="Подтверждение",
-        body=render_template_string(VERIFY, login=login, email=unverified["email"])
-    )
+    return render_template("verify.html", title="Подтверждение", login=login, email=unverified["email"])
 
 
 @app.post("/resend")
@@ -1195,23 +1673,25 @@ def resend_code():
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "GET":
-        return render_template_string(BASE, title="Вход", body=render_template_string(LOGIN_FORM, f={}))
+        return render_template("login.html", title="Вход", f={})
 
     login_ = (request.form.get("login") or "").strip()
     password = request.form.get("password") or ""
 
     if not valid_login(login_):
         flash("Некорректный логин.", "danger")
-        return render_template_string(BASE, title="Вход", body=render_template_string(LOGIN_FORM, f={"login": login_}))
+        return render_template("login.html", title="Вход", f={"login": login_})
 
     user = db_get_user_by_login(login_)
     if not user:
         flash("Пользователь не найден.", "danger")
-        return render_template_string(BASE, title="Вход", body=render_template_string(LOGIN_FORM, f={"login": login_}))
+        return render_template("login.html", title="Вход", f={"login": login_})
 
-    if not check_password_hash(user["password_hash"], password):
+    with tracing.span("password_hash", "check"):
+        ok = check_password_hash(user["password_hash"], password)
+    if not ok:
         flash("Неверный пароль.", "danger")
-        return render_template_string(BASE, title="Вход", body=render_template_string(LOGIN_FORM, f={"login": login_}))
+        return render_template("login.html", title="Вход", f={"login": login_})
 
     session["user_login"] = user["login"]
     session["user_role"] = user.get("role") or "CLIENT"
@@ -1257,13 +1737,133 @@ def search_routes():
                 flash("По вашему запросу маршруты не найдены", "info")
 
     # Всегда передаем routes в шаблон, даже если они пустые
-    body_content = render_template_string(
-        SEARCH_FORM,
+    return render_template(
+        "search.html",
+        title="Поиск маршрутов",
         cities=cities,
+        routes=routes,
         today=datetime.now().strftime('%Y-%m-%d')
-    ) + render_template_string(RESULTS, routes=routes)
+    )
+
+
+@app.get("/api/paths")
+def api_paths():
+    """Произвольный поиск путей A→B по графу city_path (без расписания)."""
+    if not session.get("user_login"):
+        return {"error": "login required"}, 401
+    try:
+        from_city_id = int(request.args.get("from") or 0)
+        to_city_id = int(request.args.get("to") or 0)
+        k = max(1, min(30, int(request.args.get("k") or 5)))
+        tt_id = int(request.args.get("transport_type") or 1)
+    except ValueError:
+        return {"error": "bad params"}, 400
+    metric = request.args.get("metric") or "distance"
+    if metric not in route_graph.METRICS:
+        return {"error": f"metric: {', '.join(route_graph.METRICS)}"}, 400
+
+    transport = {}
+    if metric in ("time", "price"):
+        tt = refdata.get(db_session).transport.get(tt_id)
+        if not tt:
+            return {"error": "transport_type not found"}, 404
+        transport = {"speed_kmph": float(tt.SPEED_KMPH), "price_per_km": float(tt.PRICE_PER_KM)}
+    with db_session() as conn:
+        graph = route_graph.get_graph(conn, version=get_version(conn, "PATH_CATALOG"))
+
+    if metric == "popularity":
+        paths = graph.popular_paths(from_city_id, to_city_id, k)
+    else:
+        paths = graph.k_shortest_paths(from_city_id, to_city_id, k, metric, **transport)
+    return {"paths": [p._asdict() for p in paths]}
+
+
+@app.get("/api/schedules/<int:schedule_id>/seats")
+def api_schedule_seats(schedule_id: int):
+    """Компактная схема мест всего состава (см. seatmap.SeatMap.to_dict).
+    ETag = SEATS_VERSION рейса (+ маска перегонов): при совпадении If-None-Match
+    отвечаем 304 без чтения мест. ?from_seq=&to_seq= — статусы для участка поездки."""
+    if not session.get("user_login"):
+        return {"error": "login required"}, 401
+    legs = request_legs()
+    mask = leg_mask(**legs)
+    # версию читаем ДО мест: если места поменяются между запросами, клиент получит
+    # более свежие данные со старой версией и просто перезапросит их, а не наоборот
+    version = db_get_seats_version(schedule_id)
+    if version is None:
+        return {"error": "schedule not found"}, 404
+    etag = f"{schedule_id}.{version}.{mask}"
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        seat_map = db_get_seat_map(schedule_id, mask=mask)
+        if seat_map is None:
+            return {"error": "no seats"}, 404
+        resp = app.json.response({"schedule_id": schedule_id, "version": version, "mask": mask,
+                                  **seat_map.to_dict()})
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"  # кэшировать можно, но каждый раз сверять ETag
+    return resp
+
+
+SSE_PING_SEC = float(os.getenv("SSE_PING_SEC", "15"))
+SSE_MAX_SEC = float(os.getenv("SSE_MAX_SEC", "300"))  # потом EventSource переподключится сам: поток воркера не занят вечно
+# каждый открытый поток держит поток gthread воркера (WEB_THREADS, см. gunicorn.conf.py), но не сессию БД;
+# обычным запросам всегда остаются WEB_THREADS - SSE_MAX_STREAMS потоков
+SSE_MAX_STREAMS = int(os.getenv("SSE_MAX_STREAMS", str(max(WEB_THREADS - 64, 1))))
+SSE_BUSY_RETRY_SEC = 30
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+@app.get("/api/schedules/<int:schedule_id>/seats/stream")
+def api_schedule_seats_stream(schedule_id: int):
+    """SSE: изменения мест рейса по мере коммитов
+    (event: seats, data: [[вагон, место, HELD_MASK, SOLD_MASK], ...] — статус для своего участка считает клиент).
+    Сам поток БД не трогает — изменения раздаёт seat_feed процесса.
+    Больше SSE_MAX_STREAMS потоков на воркер не держим: сверх лимита — 503 с retry,
+    страница мест тогда обновляется по ETag и переподключается позже."""
+    if not session.get("user_login"):
+        return {"error": "login required"}, 401
+    if not _sse_slots.acquire(blocking=False):
+        resp = app.response_class(f"retry: {SSE_BUSY_RETRY_SEC * 1000}\n\n", status=503,
+                                  mimetype="text/event-stream")
+        resp.headers["Retry-After"] = str(SSE_BUSY_RETRY_SEC)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+
+    def stream():
+        q = seat_feed.subscribe(schedule_id)
+        try:
+            yield "retry: 3000\n\n"
+            deadline = time.monotonic() + SSE_MAX_SEC
+            while time.monotonic() < deadline:
+                try:
+                    yield seat_feed.format_sse(q.get(timeout=SSE_PING_SEC))
+                except queue.Empty:
+                    yield ": ping\n\n"  # держим соединение и замечаем ушедших клиентов
+        finally:
+            seat_feed.unsubscribe(schedule_id, q)
+
+    resp = app.response_class(stream(), mimetype="text/event-stream")
+    # слот освобождает close() ответа: он вызывается и когда генератор так и не был запущен
+    resp.call_on_close(_sse_slots.release)
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
+
+def request_legs() -> dict:
+    """Участок поездки из запроса (from_seq / to_seq из результатов поиска); {} — весь рейс."""
+    try:
+        legs = {"from_seq": int(request.values["from_seq"]), "to_seq": int(request.values["to_seq"])}
+    except (KeyError, ValueError):
+        return {}
+    return legs if leg_mask(**legs) != ALL_LEGS else {}
+
+
+def seats_url(schedule_id: int, **args) -> str:
+    return url_for("seats", schedule_id=schedule_id, **request_legs(), **args)
+
 
-    return render_template_string(BASE, title="Поиск маршрутов", body=body_content)
 @app.get("/seats")
 def seats():
     if not session.get("user_login"):
@@ -1274,60 +1874,84 @@ def seats():
         flash("Неверный рейс.", "danger")
         return redirect(url_for("search_routes"))
 
-    # какой вагон показываем (1..10)
-    try:
-        coach = int(request.args.get("coach") or 1)
-    except:
-        coach = 1
-    coach = max(1, min(10, coach))
-
-    seats = db_get_seats(schedule_id)
-    if not seats:
+    legs = request_legs()
+    mask = leg_mask(**legs)
+    summary = db_get_coach_summary(schedule_id, mask)
+    if not summary:
         flash("Для этого рейса пока нет мест (проверь триггер/инициализацию).", "warning")
         return redirect(url_for("search_routes"))
 
-    # фильтруем места текущего вагона
-    coach_seats = [s for s in seats if int(s["COACH_NO"]) == coach]
+    # какой вагон показываем (по умолчанию первый)
+    coach_nos = [c.COACH_NO for c in summary]
+    try:
+        coach = int(request.args.get("coach") or coach_nos[0])
+    except:
+        coach = coach_nos[0]
+    coach = max(coach_nos[0], min(coach_nos[-1], coach))
+
+    # из БД — только места текущего вагона
+    seat_map = db_get_seat_map(schedule_id, coach, mask)
 
-    body = render_template_string(
-        SEATS_TEMPLATE,
-        seats=seats,            # оставим на всякий случай
-        coach_seats=coach_seats,
+    return render_template(
+        "seats.html",
+        title="Выбор мест",
+        summary=summary,
+        seat_map=seat_map,
         coach=coach,
-        schedule_id=schedule_id
+        schedule_id=schedule_id,
+        legs=legs,
+        mask=mask
     )
-    return render_template_string(BASE, title="Выбор мест", body=body)
 
 
 @app.post("/seats/<int:schedule_id>")
 def seats_post(schedule_id: int):
     if not session.get("user_login"):
         return redirect(url_for("login"))
+    # режим «подберите мне N мест рядом»
+    if request.form.get("assign"):
+        return seats_assign(schedule_id)
     # список выбранных ID мест
     raw_ids = request.form.getlist("seat_ids")
     seat_ids = [int(s) for s in raw_ids if s.isdigit()]
     if not seat_ids:
         flash("Выберите хотя бы одно место.", "warning")
-        return redirect(url_for("seats") + f"?schedule_id={schedule_id}")
+        return redirect(seats_url(schedule_id))
+
+    # бронь, цена и заказ — одна транзакция; при неудаче booking уже всё откатил
+    result = db_book_seats(session["user_login"], schedule_id, seat_ids, leg_mask(**request_legs()))
+    if result.lost:
+        taken = db_seat_labels(result.lost)
+        flash("Эти места уже заняты: " + ("; ".join(taken) or f"{len(result.lost)} шт.")
+              + ". Остальные не бронировали — выбери свободные ещё раз.", "warning")
+        return redirect(seats_url(schedule_id))
+    if result.order_id is None:
+        flash("Рейс не найден.", "danger")
+        return redirect(url_for("search_routes"))
+    return redirect(url_for("checkout", order_id=result.order_id))
 
-    # фиксируем бронь
-    updated = db_hold_seats(seat_ids)
-    if updated < len(seat_ids):
-        flash("Часть мест уже была занята. Обновил схему — выбери свободные ещё раз.", "warning")
-        return redirect(url_for("seats") + f"?schedule_id={schedule_id}")
 
-    # получим цену за место = TOTAL_PRICE из route_schedule (твой поиск уже этим оперирует)
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT TOTAL_PRICE FROM ROUTE_SCHEDULE WHERE SCHEDULE_ID=:sid", {"sid": schedule_id})
-        row = cur.fetchone()
-    if not row:
+ASSIGN_MAX_SEATS = 8
+
+def seats_assign(schedule_id: int):
+    try:
+        n = int(request.form.get("assign") or 0)
+    except ValueError:
+        n = 0
+    if not 1 <= n <= ASSIGN_MAX_SEATS:
+        flash(f"Можно подобрать от 1 до {ASSIGN_MAX_SEATS} мест.", "warning")
+        return redirect(seats_url(schedule_id))
+
+    result, block = db_assign_seats(session["user_login"], schedule_id, n, leg_mask(**request_legs()))
+    if result is None:
         flash("Рейс не найден.", "danger")
         return redirect(url_for("search_routes"))
-
-    per_seat_price = float(row[0])  # простая модель: цена за 1 место = TOTAL_PRICE
-    order_id = db_create_order(session["user_login"], schedule_id, seat_ids, per_seat_price)
-    return redirect(url_for("checkout", order_id=order_id))
+    if result.order_id is None:
+        flash(f"Не нашли {n} свободных мест в одном вагоне — выбери места вручную.", "warning")
+        return redirect(seats_url(schedule_id))
+    flash(f"Подобрали места {SeatMap.TIERS[block.tier]}: вагон {block.coach}, "
+          f"места {', '.join(map(str, block.seats))}.", "success")
+    return redirect(url_for("checkout", order_id=result.order_id))
 
 
 @app.get("/checkout/<int:order_id>")
@@ -1335,24 +1959,17 @@ def checkout(order_id: int):
     if not session.get("user_login"):
         return redirect(url_for("login"))
     # можно подтянуть состав корзины для показа (сумма/места), но для краткости просто кнопка "Оплатить"
-    body = f"""
-    <div class="glass">
-      <h2 class="h5 mb-3">Оплата заказа #{order_id}</h2>
-      <p>Демо-режим: оплаты нет. Нажми «Оплатить» — зафиксируем покупку и места станут SOLD.</p>
-      <form method="post" action="{{{{ url_for('pay_order', order_id={order_id}) }}}}">
-        <button class="btn btn-primary">Оплатить</button>
-        <a class="btn btn-outline-secondary" href="{{{{ url_for('search_routes') }}}}">Назад к поиску</a>
-      </form>
-    </div>
-    """
-    return render_template_string(BASE, title="Оплата", body=body)
+    return render_template("checkout.html", title="Оплата", order_id=order_id)
 
 
 @app.post("/checkout/<int:order_id>/pay")
 def pay_order(order_id: int):
     if not session.get("user_login"):
         return redirect(url_for("login"))
-    db_mark_order_paid(order_id)
+    if not db_mark_order_paid(order_id):
+        flash(f"Заказ #{order_id} уже не ожидает оплаты: бронь истекла через "
+              f"{reaper.HOLD_TTL_MIN} мин или заказ отменён. Выберите места заново.", "warning")
+        return redirect(url_for("search_routes"))
     flash(f"Заказ #{order_id} оплачен. Спасибо!", "success")
     return redirect(url_for("search_routes"))
 
@@ -1368,6 +1985,11 @@ def initialize_app():
             init_db()
             if check_db_connection():
                 print("[APP] Database initialized successfully")
+                if os.getenv("MAIL_WORKER", "1") == "1":
+                    mailer.start_worker()  # MAIL_WORKER=0 — если отправитель запущен отдельно (python mailer.py worker)
+                metrics.start_flusher()
+                if os.getenv("REAPER", "1") == "1":
+                    reaper.start_thread()  # REAPER=0 — если запускается отдельно (python reaper.py --loop)
                 return True
             else:
                 print(f"[APP] Database connection failed, retrying in {retry_delay} seconds...")
@@ -0,0 +1,106 @@
+# attachments.py
+# --------------------
+# Вложения заявок на скидку (DISCOUNT_REQUEST_FILES.CONTENT) без чтения файла целиком.
+#
+# Загрузка: строка вставляется с EMPTY_BLOB() (RETURNING — локатор LOB), затем поток
+# загруженного файла Werkzeug пишется в LOB кусками по ATTACH_CHUNK_BYTES. Размер и
+# SHA-256 считаются в том же проходе и дописываются в строку в конце. В памяти — один кусок.
+# Выдача — так же кусками, с поддержкой Range (см. раздел «выдача» ниже).
+
+import hashlib
+import os
+import unicodedata
+from urllib.parse import quote
+import oracledb
+from db import get_conn, fetch_one
+
+ATTACH_CHUNK_BYTES = int(os.getenv("ATTACH_CHUNK_BYTES", str(1024 * 1024)))
+
+
+def _chunk_size(lob) -> int:
+    """Кратно размеру чанка LOB (так Oracle пишет без перезаписи частичных блоков)."""
+    base = lob.getchunksize() or 8192
+    return max(base, ATTACH_CHUNK_BYTES // base * base)
+
+
+def store(cur, request_id: int, upload) -> tuple[int, int, str]:
+    """Записать загруженный файл (werkzeug FileStorage) в DISCOUNT_REQUEST_FILES.
+    Возвращает (ID, размер в байтах, sha256 hex). Коммит — вызывающий."""
+    fid = cur.var(oracledb.NUMBER)
+    lob_var = cur.var(oracledb.DB_TYPE_BLOB)
+    cur.execute("""
+      INSERT INTO DISCOUNT_REQUEST_FILES (REQUEST_ID, FILENAME, MIMETYPE, SIZE_BYTES, CONTENT)
+      VALUES (:r, :fn, :mt, 0, EMPTY_BLOB())
+      RETURNING ID, CONTENT INTO :fid, :lob
+    """, {"r": request_id, "fn": upload.filename[:255], "mt": (upload.mimetype or "")[:128],
+          "fid": fid, "lob": lob_var})
+    file_id = int(fid.getvalue()[0])
+    lob = lob_var.getvalue()[0]
+
+    digest = hashlib.sha256()
+    size = 0
+    chunk = _chunk_size(lob)
+    stream = upload.stream
+    lob.open()  # одна правка индекса LOB на весь файл, а не на каждый write()
+    try:
+        while True:
+            data = stream.read(chunk)
+            if not data:
+                break
+            lob.write(data, size + 1)  # смещение в LOB — с 1
+            digest.update(data)
+            size += len(data)
+    finally:
+        lob.close()
+
+    sha = digest.hexdigest()
+    cur.execute("UPDATE DISCOUNT_REQUEST_FILES SET SIZE_BYTES = :sz, SHA256 = :h WHERE ID = :id",
+                {"sz": size, "h": sha, "id": file_id})
+    return file_id, size, sha
+
+
+# ---------- выдача ----------
+# Метаданные (размер, хэш) — без чтения тела LOB; тело отдаётся генератором кусками
+# из отдельной сессии пула: ответ стримится уже после конца запроса, когда сессия
+# запроса (g.db_conn) возвращена в пул и её локатор LOB недействителен.
+
+def meta(conn, file_id: int):
+    """ID, FILENAME, MIMETYPE, SIZE_BYTES, SHA256 файла или None. Тело LOB не читается."""
+    return fetch_one(conn, """
+      SELECT ID, FILENAME, MIMETYPE, NVL(SIZE_BYTES, DBMS_LOB.GETLENGTH(CONTENT)) AS SIZE_BYTES, SHA256
+      FROM DISCOUNT_REQUEST_FILES WHERE ID = :id
+    """, {"id": file_id})
+
+
+def etag(row) -> str:
+    # содержимое вложения после загрузки не меняется: хэш, а у старых файлов — ID и размер
+    return row.SHA256 or f"{row.ID}-{row.SIZE_BYTES}"
+
+
+def content_disposition(filename: str) -> str:
+    """attachment с filename (ASCII) и filename* (UTF-8) — как в flask.send_file."""
+    filename = "".join(c for c in filename if c >= " " and c != "\x7f")
+    simple = unicodedata.normalize("NFKD", filename).encode("ascii", "ignore").decode("ascii")
+    ascii_only = simple == filename
+    simple = simple.replace("\\", "\\\\").replace('"', '\\"')
+    if ascii_only:
+        return f'attachment; filename="{simple}"'
+    return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(filename, safe='!#$&+^`|~')}"
+
+
+def iter_content(file_id: int, start: int, stop: int):
+    """Байты [start, stop) вложения кусками по ATTACH_CHUNK_BYTES."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT CONTENT FROM DISCOUNT_REQUEST_FILES WHERE ID = :id", {"id": file_id})
+        row = cur.fetchone()
+        if row is None or row[0] is None:
+            return
+        lob = row[0]
+        offset = start
+        while offset < stop:
+            data = lob.read(offset + 1, min(ATTACH_CHUNK_BYTES, stop - offset))  # смещение в LOB — с 1
+            if not data:
+                break
+            yield data
+            offset += len(data)
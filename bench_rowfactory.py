@@ -0,0 +1,72 @@
+# bench_rowfactory.py
+# --------------------
+# Микробенчмарк маппинга строк: dict(zip(...)) по каждой строке против
+# rowfactory с namedtuple-записями (db.fetch_all) на 10k строк ROUTE_SCHEDULE.
+#
+#   python bench_rowfactory.py            # против БД (первые N строк ROUTE_SCHEDULE)
+#   python bench_rowfactory.py --offline  # без БД: синтетические строки той же формы
+
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from db import record_type, fetch_all, get_conn, SHAPE_LARGE
+
+COLUMNS = ("SCHEDULE_ID", "ROUTE_ID", "CATEGORY", "CITIES_SEQUENCE", "TOTAL_DISTANCE_KM",
+           "TOTAL_PRICE", "TOTAL_TIME_MINUTES", "START_DATETIME", "END_DATETIME", "PATH_CITY_IDS")
+SQL = f"SELECT {', '.join(COLUMNS)} FROM ROUTE_SCHEDULE FETCH FIRST :n ROWS ONLY"
+
+
+def measure(label, fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn()
+    dt = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<34} {dt * 1000:9.1f} мс   держим {current / 1024:8.0f} КБ   пик {peak / 1024:8.0f} КБ")
+    return result
+
+
+def offline(n):
+    start = datetime(2026, 1, 1, 6)
+    raw = [(i, i % 12 + 1, "FAST", "Москва → Тверь → Санкт-Петербург", 710.0, 4260.0, 266,
+            start + timedelta(hours=i), start + timedelta(hours=i, minutes=266), "1->18->2")
+           for i in range(n)]
+    description = [(c,) for c in COLUMNS]
+
+    def old():
+        return [dict(zip([c[0] for c in description], r)) for r in raw]
+
+    def new():
+        factory = record_type(tuple(c[0] for c in description))
+        return [factory(*r) for r in raw]
+
+    a = measure("dict(zip(...)) на каждую строку", old)
+    b = measure("rowfactory -> namedtuple", new)
+    assert a[-1]["PATH_CITY_IDS"] == b[-1].PATH_CITY_IDS
+
+
+def online(n):
+    with get_conn() as conn:
+        def old():
+            cur = conn.cursor()
+            cur.execute(SQL, {"n": n})
+            return [dict(zip([c[0] for c in cur.description], r)) for r in cur.fetchall()]
+
+        def new():
+            return fetch_all(conn, SQL, {"n": n}, shape=SHAPE_LARGE)
+
+        old()  # прогрев: разбор SQL, кэш курсоров
+        a = measure("dict(zip(...)), arraysize=100", old)
+        b = measure("fetch_all, arraysize=1000", new)
+    print(f"строк: {len(a)} / {len(b)}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="dict(zip) против rowfactory на выборке ROUTE_SCHEDULE")
+    ap.add_argument("-n", type=int, default=10_000)
+    ap.add_argument("--offline", action="store_true", help="без БД, на синтетических строках")
+    args = ap.parse_args()
+    (offline if args.offline else online)(args.n)
@@ -0,0 +1,181 @@
+# booking.py
+# --------------------
+# Бронирование мест одной транзакцией: бронь -> цена -> заказ -> позиции.
+#
+# Бронь — один executemany с arraydmlrowcounts: по счётчику на каждую строку
+# видно, какие именно места перехватили (0 строк = место занято на этих перегонах или чужой рейс).
+# Цена берётся тем же UPDATE, что поднимает SEATS_VERSION рейса (RETURNING TOTAL_PRICE) —
+# отдельного SELECT нет; цена участка рейса — из fares.py (префиксные суммы остановок в кэше).
+# Любая неудача — откат до точки сохранения в начале брони: брони не «протекают»,
+# а транзакция запроса (и всё, что запрос сделал до брони) остаётся вызывающему.
+#
+# Место занято не целиком, а по перегонам (HELD_MASK / SOLD_MASK, см. seatmap.leg_mask):
+# поездка Тверь -> Москва не мешает продать то же место Москва -> Сочи. STATUS места —
+# сводка «на весь рейс» (HELD, если есть бронь хоть на одном перегоне, иначе SOLD/FREE);
+# его пересчитывают те же UPDATE-ы, поэтому старые читатели STATUS работают как раньше.
+#
+# Коммит делает вызывающий (в приложении — конец запроса, см. db_session в app.py).
+
+from collections import namedtuple
+import oracledb
+from seatmap import ALL_LEGS, leg_range
+import fares
+import metrics
+
+# order_id None — заказ не создан; lost — ID мест, которые уже заняты
+Booking = namedtuple("Booking", "order_id per_seat_price total lost")
+
+
+# свободно на перегонах :m — ни брони, ни продажи
+FREE_ON_LEGS = "BITAND(HELD_MASK, :m) = 0 AND BITAND(SOLD_MASK, :m) = 0"
+
+# снять бронь и продажу на перегонах :m (отмена / истечение заказа)
+RELEASE_SQL = """
+  UPDATE SCHEDULE_SEATS
+  SET HELD_MASK = HELD_MASK - BITAND(HELD_MASK, :m),
+      SOLD_MASK = SOLD_MASK - BITAND(SOLD_MASK, :m),
+      STATUS = CASE WHEN HELD_MASK - BITAND(HELD_MASK, :m) <> 0 THEN 'HELD'
+                    WHEN SOLD_MASK - BITAND(SOLD_MASK, :m) <> 0 THEN 'SOLD'
+                    ELSE 'FREE' END,
+      HELD_AT = CASE WHEN HELD_MASK - BITAND(HELD_MASK, :m) <> 0 THEN HELD_AT END
+  WHERE ID = :id
+"""
+
+# бронь на перегонах :m -> продажа
+SELL_SQL = """
+  UPDATE SCHEDULE_SEATS
+  SET HELD_MASK = HELD_MASK - BITAND(HELD_MASK, :m),
+      SOLD_MASK = SOLD_MASK + :m - BITAND(SOLD_MASK, :m),
+      STATUS = CASE WHEN HELD_MASK - BITAND(HELD_MASK, :m) <> 0 THEN 'HELD' ELSE 'SOLD' END,
+      HELD_AT = CASE WHEN HELD_MASK - BITAND(HELD_MASK, :m) <> 0 THEN HELD_AT END
+  WHERE ID = :id
+"""
+
+
+def hold_seats(cur, schedule_id: int, seat_ids: list[int], mask: int = ALL_LEGS) -> list[int]:
+    """Бронь перегонов mask одним round-trip. Возвращает ID мест, которые захватить не удалось."""
+    with metrics.db_call("hold") as call:
+        cur.executemany(f"""
+          UPDATE SCHEDULE_SEATS
+          SET HELD_MASK = HELD_MASK + :m, STATUS = 'HELD', HELD_AT = SYSTIMESTAMP
+          WHERE ID = :id AND SCHEDULE_ID = :sid AND {FREE_ON_LEGS}
+        """, [{"id": sid, "sid": schedule_id, "m": mask} for sid in seat_ids], arraydmlrowcounts=True)
+        counts = cur.getarraydmlrowcounts()
+        call.rows = sum(counts)
+    return [sid for sid, n in zip(seat_ids, counts) if n == 0]
+
+
+def order_items(cur, order_ids: list[int]) -> list[dict]:
+    """Места заказов с масками перегонов — binds для SELL_SQL / RELEASE_SQL."""
+    binds = {f"o{i}": oid for i, oid in enumerate(order_ids)}
+    cur.execute(f"""
+      SELECT SEAT_ID, NVL(LEG_MASK, {ALL_LEGS}) FROM ORDER_ITEMS
+      WHERE ORDER_ID IN ({", ".join(":" + k for k in binds)})
+    """, binds)
+    return [{"id": sid, "m": int(m)} for sid, m in cur.fetchall()]
+
+
+def sell_order(cur, order_id: int) -> int:
+    items = order_items(cur, [order_id])
+    if items:
+        cur.executemany(SELL_SQL, items)
+    return len(items)
+
+
+def release_orders(cur, order_ids: list[int]) -> int:
+    """Освободить места заказов (только их перегоны). Возвращает число мест."""
+    items = order_items(cur, order_ids)
+    if items:
+        cur.executemany(RELEASE_SQL, items)
+    return len(items)
+
+
+def book_seats(conn, user_login: str, schedule_id: int, seat_ids: list[int], mask: int = ALL_LEGS) -> Booking:
+    """Забронировать места на перегонах mask и создать заказ NEW.
+    При любой неудаче откатывается только сделанное здесь (ROLLBACK TO SAVEPOINT)."""
+    seat_ids = list(dict.fromkeys(seat_ids))  # повтор ID иначе выглядел бы как «потерянное» место
+    cur = conn.cursor()
+    cur.execute("SAVEPOINT book_seats")
+    try:
+        lost = hold_seats(cur, schedule_id, seat_ids, mask)
+        if lost:
+            cur.execute("ROLLBACK TO SAVEPOINT book_seats")
+            return Booking(None, None, None, lost)
+
+        price = cur.var(oracledb.NUMBER)
+        cur.execute("""
+          UPDATE ROUTE_SCHEDULE SET SEATS_VERSION = SEATS_VERSION + 1
+          WHERE SCHEDULE_ID = :sid
+          RETURNING TOTAL_PRICE INTO :price
+        """, {"sid": schedule_id, "price": price})
+        if not cur.rowcount:
+            cur.execute("ROLLBACK TO SAVEPOINT book_seats")
+            return Booking(None, None, None, [])
+        per_seat_price = float(price.getvalue()[0])  # весь рейс: цена за 1 место = TOTAL_PRICE
+        legs = leg_range(mask)
+        if legs is not None:
+            # участок рейса — по префиксным суммам остановок (fares.py, обычно из кэша процесса)
+            schedule = fares.for_schedule(conn, schedule_id)
+            if schedule is None or legs[1] >= len(schedule.cum_km):
+                cur.execute("ROLLBACK TO SAVEPOINT book_seats")
+                return Booking(None, None, None, [])
+            per_seat_price = schedule.fare(*legs).price
+        total = per_seat_price * len(seat_ids)
+
+        oid = cur.var(oracledb.NUMBER)
+        with metrics.db_call("create_order") as call:
+            cur.execute("""
+              INSERT INTO ORDERS(USER_LOGIN, SCHEDULE_ID, TOTAL_PRICE, STATUS)
+              VALUES (:u, :sid, :tot, 'NEW')
+              RETURNING ID INTO :oid
+            """, dict(u=user_login, sid=schedule_id, tot=total, oid=oid))
+            order_id = int(oid.getvalue()[0])
+
+            cur.executemany("""
+              INSERT INTO ORDER_ITEMS(ORDER_ID, SEAT_ID, PRICE, LEG_MASK)
+              VALUES (:1, :2, :3, :4)
+            """, [(order_id, sid, per_seat_price, mask) for sid in seat_ids])
+            call.rows = len(seat_ids)
+        return Booking(order_id, per_seat_price, total, [])
+    except Exception:
+        cur.execute("ROLLBACK TO SAVEPOINT book_seats")
+        raise
+
+
+ASSIGN_ATTEMPTS = 3
+
+
+def lock_free_seats(cur, schedule_id: int, seat_ids: list[int], mask: int = ALL_LEGS) -> set[int]:
+    """Заблокировать свободные (на перегонах mask) из seat_ids, не дожидаясь чужих блокировок."""
+    binds = {f"s{i}": sid for i, sid in enumerate(seat_ids)}
+    cur.execute(f"""
+      SELECT ID FROM SCHEDULE_SEATS
+      WHERE SCHEDULE_ID = :sid AND {FREE_ON_LEGS} AND ID IN ({", ".join(":" + k for k in binds)})
+      FOR UPDATE SKIP LOCKED
+    """, {"sid": schedule_id, "m": mask, **binds})
+    return {r[0] for r in cur.fetchall()}
+
+
+def assign_seats(conn, user_login: str, schedule_id: int, seat_map, n: int, mask: int = ALL_LEGS):
+    """Подобрать n мест рядом по схеме в памяти (SeatMap.best_block, построена для той же
+    маски перегонов) и забронировать.
+    Если часть блока уже заблокирована или занята — не ждём, помечаем эти места
+    занятыми и подбираем заново (до ASSIGN_ATTEMPTS раз).
+    Возвращает (Booking, Block); Block None — столько мест вместе нет."""
+    cur = conn.cursor()
+    for _ in range(ASSIGN_ATTEMPTS):
+        block = seat_map.best_block(n)
+        if block is None:
+            return Booking(None, None, None, []), None
+        cur.execute("SAVEPOINT assign_seats")
+        locked = lock_free_seats(cur, schedule_id, block.ids, mask)
+        if len(locked) == len(block.ids):
+            # места уже наши — UPDATE брони не будет ждать чужих транзакций
+            return book_seats(conn, user_login, schedule_id, block.ids, mask), block
+        # отпускаем то, что успели заблокировать (блокировки строк после точки сохранения снимаются);
+        # транзакция запроса остаётся вызывающему
+        cur.execute("ROLLBACK TO SAVEPOINT assign_seats")
+        for sid in block.ids:
+            if sid not in locked:
+                seat_map.mark_taken(sid)
+    return Booking(None, None, None, []), None
@@ -0,0 +1,184 @@
+# db.py
+# --------------------
+# Подключение к Oracle: конфиг из .env и общий пул сессий процесса
+
+import os
+import threading
+from collections import namedtuple
+from functools import lru_cache
+import oracledb
+from dotenv import load_dotenv
+import metrics
+import sqlstats
+
+
+# грузим .env из папки файла (надёжно для Windows)
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"))
+
+# ----------- Oracle config -----------
+ORA_HOST = os.getenv("ORA_HOST", "oracle")  # для Docker используем имя сервиса
+ORA_PORT = int(os.getenv("ORA_PORT", "1521"))
+ORA_SERVICE = os.getenv("ORA_SERVICE", "FREEPDB1")
+ORA_USER = os.getenv("ORA_USER", "SYSTEM")
+ORA_PASSWORD = os.getenv("ORA_PASSWORD", "AnosVoldigod0")
+DSN = f"{ORA_HOST}:{ORA_PORT}/{ORA_SERVICE}"
+
+# ----------- Pool config -----------
+POOL_MIN = int(os.getenv("ORA_POOL_MIN", "1"))
+# Потоки запросов воркера gunicorn (gunicorn.conf.py). Сессию из пула держит запрос до конца
+# (db_session) и каждый фоновый поток процесса (почта, лента мест, ...); потоки SSE её не берут.
+# Поэтому по умолчанию пул не меньше числа потоков: запрос никогда не ждёт сессию. Пул растёт
+# лениво (POOL_INCREMENT), простаивающие сессии закрываются через POOL_IDLE_TIMEOUT —
+# открыто ровно столько, сколько запросов работает с БД одновременно.
+WEB_THREADS = int(os.getenv("WEB_THREADS", "256"))
+POOL_BACKGROUND = 4
+POOL_MAX = int(os.getenv("ORA_POOL_MAX", str(WEB_THREADS + POOL_BACKGROUND)))
+POOL_INCREMENT = int(os.getenv("ORA_POOL_INCREMENT", "1"))
+# сессия, простоявшая в пуле дольше N секунд, пингуется при выдаче (0 = пинг при каждой выдаче)
+POOL_PING_INTERVAL = int(os.getenv("ORA_POOL_PING_INTERVAL", "60"))
+# сколько ждать свободную сессию, мс; потом — ошибка вместо зависшего воркера
+POOL_WAIT_TIMEOUT_MS = int(os.getenv("ORA_POOL_WAIT_TIMEOUT_MS", "5000"))
+# простаивающие сверх POOL_MIN сессии закрываются через N секунд
+POOL_IDLE_TIMEOUT = int(os.getenv("ORA_POOL_IDLE_TIMEOUT", "300"))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_waiting = 0
+
+
+def get_pool():
+    """Пул процесса. Создаётся лениво в том процессе, который его использует:
+    после fork воркера gunicorn пул родителя не наследуется, а создаётся заново."""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            _pool = oracledb.create_pool(
+                user=ORA_USER, password=ORA_PASSWORD, dsn=DSN,
+                min=POOL_MIN, max=POOL_MAX, increment=POOL_INCREMENT,
+                ping_interval=POOL_PING_INTERVAL,
+                getmode=oracledb.POOL_GETMODE_TIMEDWAIT,
+                wait_timeout=POOL_WAIT_TIMEOUT_MS,
+                timeout=POOL_IDLE_TIMEOUT,
+                connectiontype=sqlstats.TracedConnection,  # курсоры с замером SQL (см. sqlstats.py)
+            )
+            _pool_pid = pid
+            print(f"[DB][POOL] created pid={pid} min={POOL_MIN} max={POOL_MAX} inc={POOL_INCREMENT}")
+    return _pool
+
+
+def get_conn():
+    """Сессия из пула. close() (в т.ч. выход из `with`) возвращает её в пул."""
+    global _waiting
+    try:
+        pool = get_pool()
+        with _pool_lock:
+            _waiting += 1
+        try:
+            return pool.acquire()
+        finally:
+            with _pool_lock:
+                _waiting -= 1
+    except Exception as e:
+        print(f"[DB][CONNECTION ERROR] {e}")
+        raise
+
+
+def pool_stats() -> dict:
+    """Текущее состояние пула этого процесса: занято/открыто/ждут сессию."""
+    if _pool is None or _pool_pid != os.getpid():
+        return {"busy": 0, "open": 0, "waiting": 0, "min": POOL_MIN, "max": POOL_MAX}
+    return {
+        "busy": _pool.busy,
+        "open": _pool.opened,
+        "waiting": _waiting,
+        "min": _pool.min,
+        "max": _pool.max,
+    }
+
+
+def close_pool() -> None:
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close(force=True)
+        _pool, _pool_pid = None, None
+
+
+# ---------- версии данных (data_version) ----------
+# Счётчики, по которым кэши процессов понимают, что данные в БД поменялись.
+def get_version(conn, name: str) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT VERSION FROM DATA_VERSION WHERE NAME = :n", {"n": name})
+    row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def bump_version(conn, name: str) -> int:
+    """Увеличить версию в текущей транзакции (коммитит вызывающий)."""
+    cur = conn.cursor()
+    ver = cur.var(oracledb.NUMBER)
+    cur.execute("""
+        UPDATE DATA_VERSION SET VERSION = VERSION + 1, UPDATED_AT = SYSTIMESTAMP
+        WHERE NAME = :n
+        RETURNING VERSION INTO :v
+    """, {"n": name, "v": ver})
+    if cur.rowcount == 0:
+        cur.execute("INSERT INTO DATA_VERSION (NAME, VERSION) VALUES (:n, 1)", {"n": name})
+        return 1
+    return int(ver.getvalue()[0])
+
+
+# ---------- выборки: строки-записи вместо dict(zip(...)) ----------
+# Размер пачки (arraysize) и предвыборки (prefetchrows) под форму запроса:
+# одна строка — без лишнего round trip на проверку конца выборки, большие списки — крупными пачками.
+SHAPE_ONE = (1, 2)
+SHAPE_SMALL = (100, 101)
+SHAPE_LARGE = (1000, 1000)
+
+
+@lru_cache(maxsize=256)
+def record_type(columns: tuple):
+    """Класс записи для набора колонок (кэшируется: один класс на форму запроса)."""
+    return namedtuple("Row", columns, rename=True)
+
+
+def _cursor(conn, shape):
+    cur = conn.cursor()
+    cur.arraysize, cur.prefetchrows = shape
+    return cur
+
+
+def _bind_rowfactory(cur):
+    # rowfactory вызывается с полями строки как аргументами — класс namedtuple подходит напрямую
+    cur.rowfactory = record_type(tuple(d[0] for d in cur.description))
+
+
+def fetch_all(conn, sql: str, binds=None, shape=SHAPE_SMALL, name: str = None) -> list:
+    """Все строки запроса как записи с доступом по имени колонки (row.NAME).
+    name — имя запроса для метрик (db_query_*), без него запрос не меряется."""
+    if name:
+        with metrics.db_call(name) as call:
+            rows = fetch_all(conn, sql, binds, shape)
+            call.rows = len(rows)
+        return rows
+    cur = _cursor(conn, shape)
+    cur.execute(sql, binds or {})
+    _bind_rowfactory(cur)
+    return cur.fetchall()
+
+
+def fetch_one(conn, sql: str, binds=None, name: str = None):
+    """Первая строка как запись или None."""
+    if name:
+        with metrics.db_call(name) as call:
+            row = fetch_one(conn, sql, binds)
+            call.rows = int(row is not None)
+        return row
+    cur = _cursor(conn, SHAPE_ONE)
+    cur.execute(sql, binds or {})
+    _bind_rowfactory(cur)
+    return cur.fetchone()
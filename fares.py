@@ -0,0 +1,94 @@
+# fares.py
+# --------------------
+# Цена и время участка рейса по префиксным суммам остановок.
+#
+# route_schedule_stop хранит для каждой остановки CUM_DIST_KM и CUM_MINUTES от
+# отправления рейса (см. schedule_gen.build_rows), поэтому участок from_seq -> to_seq —
+# две разности, без обхода перегонов:
+#   км      = cum_km[to] - cum_km[from]
+#   цена    = км * PRICE_PER_KM рейса (округление как у TOTAL_PRICE)
+#   отпр.   = START_DATETIME + cum_min[from],  приб. = START_DATETIME + cum_min[to]
+# Поиск получает cum-значения обеих остановок тем же запросом; бронь берёт остановки
+# рейса из кэша процесса (рейс после генерации не меняется).
+
+import os
+from collections import namedtuple
+from datetime import timedelta
+from db import fetch_all, record_type
+from result_cache import ResultCache
+from schedule_gen import round_half_up
+
+FARE_CACHE_SIZE = int(os.getenv("FARE_CACHE_SIZE", "4096"))
+FARE_CACHE_TTL_SEC = float(os.getenv("FARE_CACHE_TTL_SEC", "3600"))
+
+Fare = namedtuple("Fare", "distance_km price minutes depart arrive")
+
+# поля участка, которые поиск добавляет к строке рейса
+SEG_FIELDS = ("SEG_DISTANCE_KM", "SEG_PRICE", "SEG_MINUTES", "SEG_DEPART", "SEG_ARRIVE")
+
+
+def segment(start, price_per_km, from_km, from_min, to_km, to_min) -> Fare:
+    """Участок по cum-значениям двух остановок: O(1)."""
+    km = float(to_km) - float(from_km)
+    minutes = int(to_min) - int(from_min)
+    return Fare(
+        distance_km=round_half_up(km, 1),
+        price=round_half_up(km * float(price_per_km), 2),
+        minutes=minutes,
+        depart=start + timedelta(minutes=int(from_min)),
+        arrive=start + timedelta(minutes=int(to_min)),
+    )
+
+
+def with_segments(rows) -> list:
+    """Строки поиска (START_DATETIME, PRICE_PER_KM, FROM_KM, FROM_MIN, TO_KM, TO_MIN)
+    -> те же строки с полями SEG_*."""
+    if not rows:
+        return rows
+    rec = record_type(rows[0]._fields + SEG_FIELDS)
+    return [rec(*r, *segment(r.START_DATETIME, r.PRICE_PER_KM, r.FROM_KM, r.FROM_MIN, r.TO_KM, r.TO_MIN))
+            for r in rows]
+
+
+class ScheduleFares:
+    """Префиксные суммы одного рейса: cum_km[seq], cum_min[seq]."""
+    __slots__ = ("start", "price_per_km", "cum_km", "cum_min")
+
+    def __init__(self, start, price_per_km, cum_km, cum_min):
+        self.start = start
+        self.price_per_km = price_per_km
+        self.cum_km = cum_km
+        self.cum_min = cum_min
+
+    def fare(self, from_seq: int, to_seq: int) -> Fare:
+        if not 0 <= from_seq < to_seq < len(self.cum_km):
+            raise ValueError(f"bad segment {from_seq}->{to_seq}")
+        return segment(self.start, self.price_per_km,
+                       self.cum_km[from_seq], self.cum_min[from_seq],
+                       self.cum_km[to_seq], self.cum_min[to_seq])
+
+
+_cache = ResultCache(maxsize=FARE_CACHE_SIZE, ttl=FARE_CACHE_TTL_SEC)
+
+
+def _load(conn, schedule_id: int) -> ScheduleFares | None:
+    rows = fetch_all(conn, """
+        SELECT rs.START_DATETIME, rs.PRICE_PER_KM, s.CUM_DIST_KM, s.CUM_MINUTES
+        FROM ROUTE_SCHEDULE rs
+        JOIN ROUTE_SCHEDULE_STOP s ON s.SCHEDULE_ID = rs.SCHEDULE_ID
+        WHERE rs.SCHEDULE_ID = :sid
+        ORDER BY s.STOP_SEQ
+    """, {"sid": schedule_id})
+    if not rows:
+        return None
+    return ScheduleFares(rows[0].START_DATETIME, float(rows[0].PRICE_PER_KM),
+                         [float(r.CUM_DIST_KM) for r in rows], [int(r.CUM_MINUTES) for r in rows])
+
+
+def for_schedule(conn, schedule_id: int) -> ScheduleFares | None:
+    """Префиксные суммы рейса (из кэша процесса; промах — один запрос в conn). None — рейса нет."""
+    return _cache.get_or_load(schedule_id, lambda: _load(conn, schedule_id))
+
+
+def clear() -> None:
+    _cache.clear()
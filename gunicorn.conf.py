@@ -0,0 +1,20 @@
+# gunicorn.conf.py
+# --------------------
+# Настройки gunicorn (читаются из рабочего каталога: CMD ["gunicorn", "app:app"]).
+#
+# Потоки считаются вместе с пулом Oracle (db.py) и лимитом SSE (app.py):
+#   WEB_THREADS     — потоков на воркер; поток открытой страницы мест (SSE) ждёт очередь
+#                     seat_feed и сессию БД не держит;
+#   SSE_MAX_STREAMS — сколько из них могут быть SSE (по умолчанию WEB_THREADS - 64);
+#   ORA_POOL_MAX    — по умолчанию WEB_THREADS + фоновые потоки: запросы не ждут сессию.
+# Живых страниц мест на контейнер — WEB_WORKERS * SSE_MAX_STREAMS (по умолчанию 4 * 192 = 768);
+# сверх лимита — 503 и обновление схемы по ETag раз в 30 секунд.
+
+import os
+
+workers = int(os.getenv("WEB_WORKERS", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "256"))
+bind = "0.0.0.0:8000"
+timeout = 60
+loglevel = "info"
@@ -0,0 +1,348 @@
+# mailer.py
+# --------------------
+# Фоновая отправка писем через outbox (таблица email_outbox, см. «почта.sql»).
+#
+# View только кладёт письмо в outbox (в транзакции запроса) и сразу отвечает.
+# Воркер-поток забирает PENDING пачками (FOR UPDATE SKIP LOCKED — можно держать
+# по потоку в каждом воркере gunicorn), шлёт через одно живое авторизованное
+# SMTP-соединение и при ошибке откладывает письмо с экспоненциальной задержкой.
+#
+#   python mailer.py worker                  # отдельный процесс-отправитель
+#   python mailer.py debug-server --port 1025  # локальный SMTP-«приёмник» для отладки
+#   (для него: SMTP_HOST=localhost SMTP_PORT=1025 SMTP_TLS=plain, без FROM_GMAIL)
+
+import os
+import smtplib
+import socketserver
+import threading
+import time
+from email.message import EmailMessage
+from db import get_conn
+import metrics
+import tracing
+
+BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+POLL_SEC = float(os.getenv("MAIL_POLL_SEC", "2"))
+MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", "6"))
+BACKOFF_BASE_SEC = int(os.getenv("MAIL_BACKOFF_BASE_SEC", "10"))
+BACKOFF_MAX_SEC = int(os.getenv("MAIL_BACKOFF_MAX_SEC", "1800"))
+SMTP_IDLE_SEC = float(os.getenv("MAIL_SMTP_IDLE_SEC", "60"))  # дольше простаивающее соединение закрываем
+SMTP_TIMEOUT = 15
+
+
+def enqueue(conn, to_email: str, subject: str, text: str) -> None:
+    """Положить письмо в outbox. Коммит — вместе с транзакцией вызывающего."""
+    conn.cursor().execute("""
+        INSERT INTO EMAIL_OUTBOX (TO_EMAIL, SUBJECT, BODY)
+        VALUES (:to_email, :subject, :body)
+    """, {"to_email": to_email, "subject": subject[:255], "body": text[:4000]})
+
+
+# ---------- SMTP ----------
+def smtp_settings() -> dict:
+    """Gmail (FROM_GMAIL + GMAIL_APP_PW) или произвольный SMTP_HOST — как раньше в send_email.
+    SMTP_TLS: 1 — STARTTLS, plain — без шифрования и логина (локальный отладочный сервер), иначе SSL."""
+    g_from = (os.getenv("FROM_GMAIL") or "").strip()
+    g_app = (os.getenv("GMAIL_APP_PW") or "").strip()
+    if g_from and g_app:
+        return {"kind": "gmail", "host": "smtp.gmail.com", "port": 587, "mode": "starttls",
+                "user": g_from, "password": g_app, "from": g_from}
+    host = (os.getenv("SMTP_HOST") or "").strip()
+    if not host:
+        raise RuntimeError("Нет настроек SMTP/Gmail")
+    tls = (os.getenv("SMTP_TLS") or "1").strip()
+    mode = "starttls" if tls in ("1", "true", "True") else ("plain" if tls == "plain" else "ssl")
+    user = (os.getenv("SMTP_USER") or "").strip()
+    return {"kind": "smtp", "host": host, "port": int(os.getenv("SMTP_PORT") or "587"), "mode": mode,
+            "user": user, "password": (os.getenv("SMTP_PASSWORD") or "").strip(),
+            "from": os.getenv("SMTP_FROM") or user or "noreply@localhost"}
+
+
+class SMTPSender:
+    """Одно SMTP-соединение, переиспользуемое между письмами; переподключается при обрыве."""
+
+    def __init__(self):
+        self.cfg = None
+        self.smtp = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        cfg = self.cfg = smtp_settings()
+        if cfg["mode"] == "ssl":
+            smtp = smtplib.SMTP_SSL(cfg["host"], cfg["port"], timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(cfg["host"], cfg["port"], timeout=SMTP_TIMEOUT)
+            if cfg["mode"] == "starttls":
+                smtp.ehlo()
+                smtp.starttls()
+        smtp.ehlo()
+        if cfg["mode"] != "plain" or cfg["user"]:
+            smtp.login(cfg["user"], cfg["password"])
+        self.smtp = smtp
+        print(f"[EMAIL][{cfg['kind']}] connected {cfg['host']}:{cfg['port']}")
+
+    def _alive(self) -> bool:
+        if self.smtp is None:
+            return False
+        if time.monotonic() - self.last_used < 5:
+            return True
+        try:
+            return self.smtp.noop()[0] == 250
+        except smtplib.SMTPException:
+            return False
+        except OSError:
+            return False
+
+    def send(self, to_email: str, subject: str, text: str) -> None:
+        if not self._alive():
+            self.close()
+            self._connect()
+        msg = EmailMessage()
+        msg["From"] = self.cfg["from"]
+        msg["To"] = to_email
+        msg["Subject"] = subject
+        msg.set_content(text)
+        try:
+            self.smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connect()
+            self.smtp.send_message(msg)
+        self.last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self.smtp is not None and time.monotonic() - self.last_used > SMTP_IDLE_SEC:
+            self.close()
+
+    def close(self) -> None:
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+
+# ---------- метрики ----------
+_stats_lock = threading.Lock()
+_stats = {"queue_depth": 0, "sent": 0, "retried": 0, "failed": 0, "batches": 0,
+          "send_ms_last": 0.0, "send_ms_max": 0.0, "send_ms_total": 0.0}
+
+
+def _observe(**kw) -> None:
+    with _stats_lock:
+        for k, v in kw.items():
+            if k == "send_ms":
+                _stats["send_ms_last"] = v
+                _stats["send_ms_max"] = max(_stats["send_ms_max"], v)
+                _stats["send_ms_total"] += v
+            elif k == "queue_depth":
+                _stats[k] = v
+            else:
+                _stats[k] += v
+
+
+def stats() -> dict:
+    with _stats_lock:
+        s = dict(_stats)
+    s["send_ms_avg"] = s["send_ms_total"] / s["sent"] if s["sent"] else 0.0
+    return s
+
+
+# ---------- воркер ----------
+def _backoff_sec(attempts: int) -> int:
+    return min(BACKOFF_BASE_SEC * 2 ** max(attempts - 1, 0), BACKOFF_MAX_SEC)
+
+
+def process_batch(conn, sender: SMTPSender) -> int:
+    """Забрать и отправить одну пачку. Возвращает число обработанных писем."""
+    cur = conn.cursor()
+    cur.arraysize = cur.prefetchrows = BATCH_SIZE
+    # строки блокируются по мере выборки; чужие заблокированные пропускаются
+    cur.execute("""
+        SELECT ID, TO_EMAIL, SUBJECT, BODY, ATTEMPTS
+        FROM EMAIL_OUTBOX
+        WHERE STATUS = 'PENDING' AND NEXT_ATTEMPT_AT <= SYSTIMESTAMP
+        ORDER BY ID
+        FOR UPDATE SKIP LOCKED
+    """)
+    batch = cur.fetchmany(BATCH_SIZE)
+    cur.close()
+    if not batch:
+        conn.rollback()
+        return 0
+
+    sent, retry, failed = [], [], []
+    for mid, to_email, subject, body, attempts in batch:
+        t0 = time.perf_counter()
+        try:
+            with tracing.span("smtp"):
+                sender.send(to_email, subject, body)
+            sent.append((mid,))
+            _observe(sent=1, send_ms=(time.perf_counter() - t0) * 1000)
+            metrics.EMAIL_SECONDS.observe(time.perf_counter() - t0, "ok")
+            print(f"[EMAIL] to={to_email}: OK")
+        except Exception as e:
+            metrics.EMAIL_SECONDS.observe(time.perf_counter() - t0, "error")
+            sender.close()
+            attempts += 1
+            err = str(e)[:1000]
+            if attempts >= MAX_ATTEMPTS:
+                failed.append((attempts, err, mid))
+                _observe(failed=1)
+                print(f"[EMAIL][ERROR] to={to_email}: {e} (попыток: {attempts}, сдаёмся)")
+                print(f"[EMAIL][fallback] -> {to_email}: {body}")
+            else:
+                retry.append((attempts, err, _backoff_sec(attempts), mid))
+                _observe(retried=1)
+                print(f"[EMAIL][RETRY] to={to_email}: {e} (попытка {attempts})")
+
+    cur = conn.cursor()
+    if sent:
+        cur.executemany("UPDATE EMAIL_OUTBOX SET STATUS='SENT', SENT_AT=SYSTIMESTAMP WHERE ID=:1", sent)
+    if retry:
+        cur.executemany("""
+            UPDATE EMAIL_OUTBOX
+            SET ATTEMPTS=:1, LAST_ERROR=:2, NEXT_ATTEMPT_AT=SYSTIMESTAMP + NUMTODSINTERVAL(:3, 'SECOND')
+            WHERE ID=:4
+        """, retry)
+    if failed:
+        cur.executemany("UPDATE EMAIL_OUTBOX SET STATUS='FAILED', ATTEMPTS=:1, LAST_ERROR=:2 WHERE ID=:3", failed)
+    conn.commit()
+    _observe(batches=1)
+    return len(batch)
+
+
+def queue_depth(conn) -> int:
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM EMAIL_OUTBOX WHERE STATUS = 'PENDING'")
+    return int(cur.fetchone()[0])
+
+
+_wake = threading.Event()
+_stop = threading.Event()
+_worker = None
+_worker_pid = None
+
+
+def wake() -> None:
+    """Разбудить отправителя (например, сразу после коммита письма в outbox)."""
+    _wake.set()
+
+
+def run_worker() -> None:
+    sender = SMTPSender()
+    while not _stop.is_set():
+        try:
+            with get_conn() as conn:
+                while True:  # очередь не пуста — следующая пачка сразу
+                    token = tracing.start("mailer.batch")  # в TRACE_LOG — выборочно и долгие пачки
+                    n = None
+                    try:
+                        n = process_batch(conn, sender)
+                    finally:
+                        tracing.finish(token, emails=n)
+                    if n < BATCH_SIZE:
+                        break
+                _observe(queue_depth=queue_depth(conn))
+        except Exception as e:
+            print(f"[EMAIL][WORKER ERROR] {e}")
+        sender.close_if_idle()
+        _wake.wait(POLL_SEC)
+        _wake.clear()
+    sender.close()
+
+
+def start_worker() -> None:
+    """Поток-отправитель в текущем процессе (один на процесс, в т.ч. после fork воркера gunicorn)."""
+    global _worker, _worker_pid
+    if _worker is not None and _worker_pid == os.getpid() and _worker.is_alive():
+        return
+    _stop.clear()
+    _worker = threading.Thread(target=run_worker, name="mail-outbox", daemon=True)
+    _worker_pid = os.getpid()
+    _worker.start()
+
+
+def stop_worker(timeout: float = 5.0) -> None:
+    _stop.set()
+    _wake.set()
+    if _worker is not None:
+        _worker.join(timeout)
+
+
+# ---------- локальный SMTP для отладки и тестов ----------
+class _DebugSMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP: принимает письмо, печатает и складывает в server.messages."""
+
+    def reply(self, line: str) -> None:
+        self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.reply("220 debug-smtp ready")
+        mail_from, rcpt = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            cmd = line.decode(errors="replace").strip()
+            verb = cmd[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 debug-smtp")
+            elif verb == "MAIL":
+                mail_from, rcpt = cmd[10:].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                rcpt.append(cmd[8:].strip())
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b".\r\n", b".\n"):
+                        break
+                    data.append(chunk[1:] if chunk.startswith(b"..") else chunk)
+                raw = b"".join(data).decode(errors="replace")
+                self.server.messages.append({"from": mail_from, "to": rcpt, "data": raw})
+                print(f"[DEBUG-SMTP] from={mail_from} to={rcpt}\n{raw}")
+                self.reply("250 OK: queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class DebugSMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=1025):
+        super().__init__((host, port), _DebugSMTPHandler)
+        self.messages = []
+
+    def start(self) -> "DebugSMTPServer":
+        threading.Thread(target=self.serve_forever, name="debug-smtp", daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Отправка писем из email_outbox")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("worker", help="отправитель outbox отдельным процессом")
+    dbg = sub.add_parser("debug-server", help="локальный SMTP, печатающий письма")
+    dbg.add_argument("--host", default="127.0.0.1")
+    dbg.add_argument("--port", type=int, default=1025)
+    args = ap.parse_args()
+
+    if args.cmd == "worker":
+        metrics.start_flusher()
+        run_worker()
+    else:
+        print(f"[DEBUG-SMTP] listening on {args.host}:{args.port}")
+        DebugSMTPServer(args.host, args.port).serve_forever()
@@ -0,0 +1,319 @@
+# metrics.py
+# --------------------
+# Метрики процесса в текстовом формате Prometheus (GET /metrics в app.py).
+#
+# Каждый процесс копит счётчики и гистограммы в памяти, фоновый поток раз в
+# METRICS_FLUSH_SEC сбрасывает снимок в METRICS_DIR/<pid>.json (атомарно, через rename).
+# /metrics отдаёт сумму по всем файлам каталога: воркеры gunicorn видны одной цифрой,
+# свой процесс — без задержки, чужие — не старше METRICS_FLUSH_SEC.
+# Гауги учитываются только у живых процессов. Счётчики и гистограммы умершего процесса
+# переносятся в METRICS_DIR/dead.json (накопленная сумма всех завершившихся), а его файл
+# удаляется — сумма не «откатывается» назад и каталог не растёт от рестарта к рестарту.
+# Новый процесс, получивший PID умершего, сначала переносит его файл, потом пишет свой.
+# Перенос — под flock на METRICS_DIR/.lock (без fcntl, например на Windows, файлы просто копятся).
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: один процесс разработки, переносить нечего
+    fcntl = None
+
+METRICS_DIR = os.getenv("METRICS_DIR") or os.path.join(tempfile.gettempdir(), "routes_metrics")
+METRICS_FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "5"))
+
+# секунды: от быстрых выборок по индексу до медленных страниц
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROWS_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_lock = threading.Lock()
+_registry = {}
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.series = {}  # tuple значений меток -> значение
+        _registry[name] = self
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, by: float = 1) -> None:
+        with _lock:
+            self.series[labels] = self.series.get(labels, 0) + by
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        with _lock:
+            self.series[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        # значение серии: [счётчик по каждому бакету (не накопительный)..., +Inf, sum]
+        with _lock:
+            s = self.series.get(labels)
+            if s is None:
+                s = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            i = 0
+            while i < len(self.buckets) and value > self.buckets[i]:
+                i += 1
+            s[i] += 1
+            s[-1] += value
+
+
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "Время обработки запроса по endpoint Flask",
+                         ("endpoint", "method", "status"))
+DB_SECONDS = Histogram("db_query_duration_seconds", "Время именованного запроса к БД", ("query",))
+DB_ROWS = Histogram("db_query_rows", "Строк выбрано/изменено именованным запросом", ("query",), ROWS_BUCKETS)
+DB_ERRORS = Counter("db_query_errors_total", "Ошибки именованных запросов к БД", ("query",))
+POOL = Gauge("db_pool_sessions", "Сессии пула Oracle (busy/open/waiting/max)", ("state",))
+EMAIL_SECONDS = Histogram("email_send_duration_seconds", "Время отправки письма по SMTP", ("result",))
+TEMPLATE_SECONDS = Histogram("template_render_duration_seconds", "Время рендера шаблона", ("template",))
+
+
+class _DbCall:
+    __slots__ = ("rows",)
+
+    def __init__(self):
+        self.rows = None
+
+
+class db_call:
+    """with db_call("search") as call: ...; call.rows = n — время, строки и ошибки запроса."""
+    __slots__ = ("name", "call", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> _DbCall:
+        self.call = _DbCall()
+        self.t0 = time.perf_counter()
+        return self.call
+
+    def __exit__(self, exc_type, exc, tb):
+        DB_SECONDS.observe(time.perf_counter() - self.t0, self.name)
+        if exc_type is not None:
+            DB_ERRORS.inc(self.name)
+        elif self.call.rows is not None:
+            DB_ROWS.observe(self.call.rows, self.name)
+        return False
+
+
+def set_pool(stats: dict) -> None:
+    for state in ("busy", "open", "waiting", "max"):
+        POOL.set(stats[state], state)
+
+
+# ---------- снимки процессов ----------
+def snapshot() -> dict:
+    with _lock:
+        return {m.name: [[list(k), v if m.kind != "histogram" else list(v)] for k, v in m.series.items()]
+                for m in _registry.values()}
+
+
+def _path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+DEAD_FILE = "dead.json"
+
+
+def _write_json(path: str, data) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def flush() -> None:
+    """Сбросить снимок процесса в METRICS_DIR/<pid>.json."""
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(_path(os.getpid()), snapshot())
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(acc: dict, snap: dict, skip_gauges: bool) -> None:
+    """Прибавить снимок snap к acc: name -> {labels: value}."""
+    for name, series in snap.items():
+        m = _registry.get(name)
+        if m is None or (skip_gauges and m.kind == "gauge"):
+            continue
+        into = acc.setdefault(name, {})
+        for labels, value in series:
+            key = tuple(labels)
+            if m.kind == "histogram":
+                cur = into.get(key)
+                into[key] = value if cur is None else [a + b for a, b in zip(cur, value)]
+            else:
+                into[key] = into.get(key, 0) + value
+
+
+@contextmanager
+def _dir_lock():
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(METRICS_DIR, ".lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read(path: str):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # файл удалили или пишут прямо сейчас — следующий скрейп его увидит
+
+
+def _retire(pid: int) -> None:
+    """Перенести счётчики и гистограммы процесса pid в dead.json и удалить его файл (под _dir_lock)."""
+    snap = _read(_path(pid))
+    if snap is None:
+        return
+    dead_path = os.path.join(METRICS_DIR, DEAD_FILE)
+    acc = {}
+    _merge(acc, _read(dead_path) or {}, skip_gauges=True)
+    _merge(acc, snap, skip_gauges=True)
+    _write_json(dead_path, {name: [[list(k), v] for k, v in series.items()] for name, series in acc.items()})
+    os.remove(_path(pid))
+
+
+def _snapshots() -> list:
+    """(снимок, процесс жив) для всех процессов; свой — из памяти, завершившиеся — из dead.json.
+    Файлы читаются под _dir_lock и после переноса умерших: иначе процесс, перенесённый
+    посреди скрейпа, попал бы в сумму дважды или ни разу."""
+    me = os.getpid()
+    snaps = [(snapshot(), True)]
+    if not os.path.isdir(METRICS_DIR):
+        return snaps
+    with _dir_lock():
+        for fn in os.listdir(METRICS_DIR):
+            if not fn.endswith(".json") or not fn[:-5].isdigit() or int(fn[:-5]) == me:
+                continue
+            pid = int(fn[:-5])
+            alive = _alive(pid)
+            if not alive and fcntl is not None:
+                try:
+                    _retire(pid)
+                except OSError as e:
+                    print(f"[METRICS][RETIRE ERROR] {e}")
+                continue
+            snap = _read(os.path.join(METRICS_DIR, fn))
+            if snap is not None:
+                snaps.append((snap, alive))
+        dead = _read(os.path.join(METRICS_DIR, DEAD_FILE))
+        if dead is not None:
+            snaps.append((dead, False))
+    return snaps
+
+
+def collect() -> dict:
+    """Сумма по процессам: name -> {labels: value}."""
+    total = {name: {} for name in _registry}
+    for snap, alive in _snapshots():
+        _merge(total, snap, skip_gauges=not alive)
+    return total
+
+
+# ---------- текстовый формат ----------
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render() -> str:
+    lines = []
+    for name, series in collect().items():
+        m = _registry[name]
+        lines.append(f"# HELP {name} {m.doc}")
+        lines.append(f"# TYPE {name} {m.kind}")
+        for key in sorted(series):
+            value = series[key]
+            if m.kind != "histogram":
+                lines.append(f"{name}{_labels(m.labels, key)} {_num(value)}")
+                continue
+            acc = 0
+            for le, n in zip(m.buckets + ("+Inf",), value):
+                acc += n
+                lines.append(f"{name}_bucket{_labels(m.labels, key, ('le', le))} {acc}")
+            lines.append(f"{name}_sum{_labels(m.labels, key)} {_num(value[-1])}")
+            lines.append(f"{name}_count{_labels(m.labels, key)} {acc}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- фоновый сброс ----------
+_stop = threading.Event()
+_flusher = None
+_flusher_pid = None
+
+
+def _run_flusher() -> None:
+    while not _stop.wait(METRICS_FLUSH_SEC):
+        try:
+            flush()
+        except OSError as e:
+            print(f"[METRICS][FLUSH ERROR] {e}")
+
+
+def start_flusher() -> None:
+    """Поток сброса снимков (один на процесс, в т.ч. после fork воркера gunicorn)."""
+    global _flusher, _flusher_pid
+    if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    if _flusher_pid != os.getpid():
+        # файл с нашим PID, если есть, оставил завершившийся процесс: переносим до первого сброса
+        try:
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with _dir_lock():
+                if fcntl is not None:
+                    _retire(os.getpid())
+        except OSError as e:
+            print(f"[METRICS][RETIRE ERROR] {e}")
+    _stop.clear()
+    _flusher = threading.Thread(target=_run_flusher, name="metrics-flush", daemon=True)
+    _flusher_pid = os.getpid()
+    _flusher.start()
@@ -0,0 +1,166 @@
+# path_catalog.py
+# --------------------
+# Каталог путей маршрутов (route_path_catalog) и его инкрементальное обновление.
+#
+# Для каждого маршрута храним 15 кратчайших путей (FAST/BUDGET) и 15 самых
+# «популярных» (INTERESTING/PREMIUM) — ровно то, что берут INSERT-ы расписания.
+# При изменении city_path (журнал city_path_change) пересчитываются только
+# маршруты, чьи пути проходят через изменённое ребро или могут через него пройти.
+
+import os
+from route_graph import RouteGraph, MAX_DEPTH, invalidate_graph
+from db import bump_version
+
+CATALOG_K = int(os.getenv("PATH_CATALOG_K", "15"))
+VERSION_NAME = "PATH_CATALOG"
+
+
+def route_paths(graph: RouteGraph, start_city_id: int, end_city_id: int, k: int = CATALOG_K):
+    """Пути маршрута для каталога: k кратчайших ∪ k популярных, без повторов."""
+    by_key = {}
+    for p in graph.k_shortest_paths(start_city_id, end_city_id, k) + graph.popular_paths(start_city_id, end_city_id, k):
+        by_key.setdefault(p.path_city_ids, p)
+    return list(by_key.values())
+
+
+def load_routes(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT ID, START_CITY_ID, END_CITY_ID FROM ROUTE ORDER BY ID")
+    return {r[0]: (r[1], r[2]) for r in cur.fetchall()}
+
+
+def refresh_routes(conn, graph: RouteGraph, routes: dict, route_ids) -> int:
+    """Перестроить каталог для указанных маршрутов. Возвращает число записанных путей."""
+    route_ids = sorted(set(route_ids))
+    if not route_ids:
+        return 0
+    cur = conn.cursor()
+    cur.executemany("DELETE FROM ROUTE_PATH_CATALOG WHERE ROUTE_ID = :1", [(rid,) for rid in route_ids])
+    rows = []
+    for rid in route_ids:
+        start, end = routes[rid]
+        for p in route_paths(graph, start, end):
+            rows.append((rid, p.path_city_ids, p.cities_sequence, p.distance_km,
+                         p.depth, p.popularity, len(p.city_ids)))
+    if rows:
+        cur.executemany("""
+            INSERT INTO ROUTE_PATH_CATALOG
+              (ROUTE_ID, PATH_CITY_IDS, CITIES_SEQUENCE, TOTAL_DISTANCE, DEPTH, TOTAL_POPULARITY, CITIES_COUNT)
+            VALUES (:1, :2, :3, :4, :5, :6, :7)
+        """, rows)
+    return len(rows)
+
+
+def _catalog_edges(conn):
+    """route_id -> (множество рёбер путей каталога, макс. длина пути в каталоге, число путей)"""
+    cur = conn.cursor()
+    cur.execute("SELECT ROUTE_ID, PATH_CITY_IDS, TOTAL_DISTANCE FROM ROUTE_PATH_CATALOG")
+    info = {}
+    for rid, path, km in cur.fetchall():
+        ids = [int(x) for x in path.split("->")]
+        edges, worst, cnt = info.get(rid, (set(), 0.0, 0))
+        edges.update(frozenset(e) for e in zip(ids, ids[1:]))
+        info[rid] = (edges, max(worst, float(km)), cnt + 1)
+    return info
+
+
+def _via_edge_km(graph: RouteGraph, start, end, a, b, km):
+    """Длина лучшего пути start→…→a→b→…→end (или через b→a) и его глубина; None, если не собрать."""
+    def leg(x, y):
+        if x == y:
+            return 0.0, 0
+        p = graph.shortest_path(x, y)
+        return (p.distance_km, p.depth) if p else None
+
+    best = None
+    for u, v in ((a, b), (b, a)):
+        head, tail = leg(start, u), leg(v, end)
+        if head is None or tail is None:
+            continue
+        total, depth = head[0] + km + tail[0], head[1] + 1 + tail[1]
+        if depth <= MAX_DEPTH and (best is None or total < best):
+            best = total
+    return best
+
+
+def _path_edges(paths) -> set:
+    edges = set()
+    for p in paths:
+        edges.update(frozenset(e) for e in zip(p.city_ids, p.city_ids[1:]))
+    return edges
+
+
+def affected_routes(conn, graph: RouteGraph, routes: dict, changes) -> set:
+    """Маршруты, которые надо пересчитать после изменений рёбер.
+    Удалённое/перевешенное ребро — маршруты, в чьих путях оно есть.
+    Добавленное/подешевевшее ребро — маршруты, где путь через него не длиннее
+    самого длинного пути в каталоге (или каталог маршрута неполон), и маршруты,
+    в чьи k самых популярных путей на новом графе ребро попало: популярность пути
+    от длины не зависит, поэтому эту половину каталога сверяем поиском popular_paths
+    (в памяти, миллисекунды на маршрут)."""
+    catalog = _catalog_edges(conn)
+    popular = {}  # route_id -> рёбра k популярных путей нового графа
+    result = set()
+    for op, old_a, old_b, old_km, new_a, new_b, new_km in changes:
+        if op in ("U", "D"):
+            old_edge = frozenset((old_a, old_b))
+            result.update(rid for rid, (edges, _, _) in catalog.items() if old_edge in edges)
+        if op in ("I", "U"):
+            new_edge = frozenset((new_a, new_b))
+            for rid, (start, end) in routes.items():
+                if rid in result:
+                    continue
+                edges, worst, cnt = catalog.get(rid, (set(), 0.0, 0))
+                via = _via_edge_km(graph, start, end, new_a, new_b, float(new_km))
+                if via is not None and (cnt < CATALOG_K or via <= worst):
+                    result.add(rid)
+                    continue
+                if rid not in popular:
+                    popular[rid] = _path_edges(graph.popular_paths(start, end, CATALOG_K))
+                if new_edge in popular[rid]:
+                    result.add(rid)
+    return result
+
+
+def refresh(conn, full: bool = False) -> dict:
+    """Обработать журнал city_path_change. Коммит делает вызывающий."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ID, OP, OLD_A_ID, OLD_B_ID, OLD_DIST_KM, NEW_A_ID, NEW_B_ID, NEW_DIST_KM
+        FROM CITY_PATH_CHANGE
+        ORDER BY ID
+        FOR UPDATE SKIP LOCKED
+    """)
+    log = cur.fetchall()
+    if not log and not full:
+        return {"changes": 0, "routes": 0, "paths": 0}
+
+    graph = RouteGraph.from_db(conn)  # граф уже после изменений
+    routes = load_routes(conn)
+    if full:
+        route_ids = set(routes)
+    else:
+        route_ids = affected_routes(conn, graph, routes, [r[1:] for r in log])
+
+    written = refresh_routes(conn, graph, routes, route_ids)
+    if log:
+        cur.executemany("DELETE FROM CITY_PATH_CHANGE WHERE ID = :1", [(r[0],) for r in log])
+    version = bump_version(conn, VERSION_NAME)
+    invalidate_graph()
+    return {"changes": len(log), "routes": len(route_ids), "paths": written, "version": version}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from db import get_conn
+
+    ap = argparse.ArgumentParser(description="Обновление каталога путей route_path_catalog")
+    ap.add_argument("--full", action="store_true", help="пересчитать все маршруты")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    with get_conn() as conn:
+        stats = refresh(conn, full=args.full)
+        conn.commit()
+    print(f"[CATALOG] {stats} за {time.perf_counter() - t0:.2f} с")
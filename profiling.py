@@ -0,0 +1,243 @@
+# profiling.py
+# --------------------
+# Профилирование живого воркера по команде из админки (см. /admin/profile/* в app.py).
+#
+# CPU: arm(endpoint, n) — следующие n запросов к endpoint идут под cProfile, параллельно
+# поток-сэмплер раз в PROFILE_SAMPLE_MS снимает стек того же потока. По окончании в
+# PROFILE_DIR пишутся <pid>-<endpoint>-<время>.pstats (python -m pstats, snakeviz) и
+# .collapsed — «стек;стек;функция число» для flamegraph.pl / speedscope.
+# Одновременно профилируется один запрос на процесс (cProfile не вкладывается), остальные
+# идут как обычно и не уменьшают счётчик. n и число уникальных стеков ограничены.
+#
+# Память: tracemalloc включается/выключается на лету; snapshot() запоминает снимок,
+# diff() — топ строк кода по приросту памяти с последнего снимка.
+#
+# Всё состояние — в памяти текущего процесса: команда действует на воркер, который её принял.
+
+import cProfile
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "routes_profiles")
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "50"))
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "5000"))  # уникальных стеков в .collapsed
+PROFILE_MAX_DEPTH = 64
+MEM_MAX_FRAMES = 25
+
+_lock = threading.Lock()
+_active = threading.Lock()  # один профилируемый запрос на процесс
+_plan = None                # текущее задание CPU-профиля
+
+
+class _Plan:
+    __slots__ = ("endpoint", "left", "total", "profile", "stacks", "started")
+
+    def __init__(self, endpoint: str, n: int):
+        self.endpoint = endpoint
+        self.left = self.total = n
+        self.profile = cProfile.Profile()
+        self.stacks = Counter()
+        self.started = datetime.now()
+
+
+def arm(endpoint: str, n: int) -> dict:
+    """Профилировать следующие n (не больше PROFILE_MAX_REQUESTS) запросов к endpoint."""
+    global _plan
+    n = max(1, min(n, PROFILE_MAX_REQUESTS))
+    with _lock:
+        _plan = _Plan(endpoint, n)
+    return status()
+
+
+def disarm() -> dict:
+    """Снять задание; то, что уже собрано, сохраняется в файлы."""
+    global _plan
+    with _lock:
+        plan, _plan = _plan, None
+    if plan is not None and plan.left < plan.total:
+        _dump(plan)
+    return status()
+
+
+# ---------- сэмплер стеков ----------
+def _stack_of(frame) -> str:
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sample(thread_id: int, plan: _Plan, stop: threading.Event) -> None:
+    period = PROFILE_SAMPLE_MS / 1000
+    while not stop.wait(period):
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            return
+        key = _stack_of(frame)
+        if key in plan.stacks or len(plan.stacks) < PROFILE_MAX_STACKS:
+            plan.stacks[key] += 1
+
+
+class _Run:
+    __slots__ = ("plan", "stop", "sampler")
+
+    def __init__(self, plan: _Plan):
+        self.plan = plan
+        self.stop = threading.Event()
+        self.sampler = threading.Thread(target=_sample, args=(threading.get_ident(), plan, self.stop),
+                                        name="profile-sampler", daemon=True)
+
+
+def request_started(endpoint: str):
+    """Начать профиль запроса, если он в задании. Возвращает хэндл для request_finished или None."""
+    plan = _plan
+    if plan is None or plan.endpoint != endpoint or plan.left <= 0:
+        return None
+    if not _active.acquire(blocking=False):
+        return None  # уже профилируем другой запрос этого процесса
+    run = _Run(plan)
+    run.sampler.start()
+    try:
+        plan.profile.enable()
+    except ValueError:  # профилировщик уже включён кем-то ещё (например, отладчиком)
+        run.stop.set()
+        _active.release()
+        return None
+    return run
+
+
+def request_finished(run) -> None:
+    global _plan
+    if run is None:
+        return
+    plan = run.plan
+    try:
+        plan.profile.disable()
+        run.stop.set()
+        run.sampler.join(1.0)
+    finally:
+        _active.release()
+    with _lock:
+        plan.left -= 1
+        done = plan.left <= 0 and _plan is plan
+        if done:
+            _plan = None
+    if done:
+        _dump(plan)
+
+
+# ---------- файлы ----------
+_dumps = []  # последние файлы этого процесса
+
+
+def _dump(plan: _Plan) -> None:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", plan.endpoint)
+    base = os.path.join(PROFILE_DIR, f"{os.getpid()}-{safe}-{plan.started:%Y%m%d-%H%M%S}")
+    plan.profile.dump_stats(base + ".pstats")
+    with open(base + ".collapsed", "w", encoding="utf-8") as f:
+        for stack, n in plan.stacks.most_common():
+            f.write(f"{stack} {n}\n")
+    with _lock:
+        _dumps.append({"endpoint": plan.endpoint, "requests": plan.total - max(plan.left, 0),
+                       "pstats": os.path.basename(base + ".pstats"),
+                       "collapsed": os.path.basename(base + ".collapsed")})
+        del _dumps[:-20]
+    print(f"[PROFILE] {plan.endpoint}: {base}.pstats / .collapsed")
+
+
+def dump_path(name: str) -> str | None:
+    """Путь к файлу профиля по имени (только из PROFILE_DIR и только .pstats/.collapsed)."""
+    if not re.fullmatch(r"[A-Za-z0-9_.-]+\.(pstats|collapsed)", name or ""):
+        return None
+    path = os.path.join(PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def status() -> dict:
+    plan = _plan
+    with _lock:
+        dumps = list(_dumps)
+    return {
+        "pid": os.getpid(),
+        "cpu": None if plan is None else {"endpoint": plan.endpoint, "left": plan.left, "total": plan.total},
+        "dumps": dumps,
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+
+
+# ---------- память ----------
+_baseline = None
+_baseline_at = None
+
+
+def _take():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def mem_start(frames: int = 10) -> dict:
+    global _baseline, _baseline_at
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, min(frames, MEM_MAX_FRAMES)))
+        _baseline, _baseline_at = None, None
+    return mem_status()
+
+
+def mem_stop() -> dict:
+    global _baseline, _baseline_at
+    tracemalloc.stop()
+    _baseline, _baseline_at = None, None
+    return mem_status()
+
+
+def mem_snapshot() -> dict:
+    """Запомнить снимок — точку отсчёта для mem_diff()."""
+    global _baseline, _baseline_at
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc не запущен")
+    _baseline = _take()
+    _baseline_at = time.time()
+    return mem_status()
+
+
+def mem_diff(limit: int = 30, key: str = "lineno") -> dict:
+    """Топ мест выделения памяти по приросту с последнего снимка (без снимка — по объёму)."""
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("tracemalloc не запущен")
+    snap = _take()
+    key = key if key in ("lineno", "filename", "traceback") else "lineno"
+    limit = max(1, min(limit, 200))
+    if _baseline is not None:
+        rows = [{"where": str(s.traceback), "size_kb": round(s.size / 1024, 1),
+                 "diff_kb": round(s.size_diff / 1024, 1), "count": s.count, "count_diff": s.count_diff}
+                for s in snap.compare_to(_baseline, key)[:limit]]
+    else:
+        rows = [{"where": str(s.traceback), "size_kb": round(s.size / 1024, 1), "count": s.count}
+                for s in snap.statistics(key)[:limit]]
+    return {**mem_status(), "top": rows}
+
+
+def mem_status() -> dict:
+    tracing = tracemalloc.is_tracing()
+    current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+    return {
+        "pid": os.getpid(),
+        "tracing": tracing,
+        "frames": tracemalloc.get_traceback_limit() if tracing else None,
+        "current_kb": round(current / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "baseline_age_sec": round(time.time() - _baseline_at, 1) if _baseline_at else None,
+    }
@@ -0,0 +1,151 @@
+# reaper.py
+# --------------------
+# Освобождение брошенных броней: заказы NEW старше HOLD_TTL_MIN отменяются, их
+# места возвращаются в FREE; «висячие» HELD без живого заказа (HELD_AT старше TTL)
+# тоже освобождаются. Всё — пачками по REAPER_BATCH строк, set-based UPDATE-ами,
+# с коммитом на пачку и общим бюджетом времени на проход.
+#
+#   python reaper.py          # один проход
+#   python reaper.py --loop   # каждые REAPER_INTERVAL_SEC секунд
+# В приложении поток запускается сам (REAPER=1, по умолчанию); несколько
+# воркеров друг другу не мешают — заказы берутся FOR UPDATE SKIP LOCKED.
+
+import os
+import threading
+import time
+from db import get_conn
+import booking
+
+HOLD_TTL_MIN = int(os.getenv("HOLD_TTL_MIN", "20"))
+REAPER_BATCH = int(os.getenv("REAPER_BATCH", "200"))
+REAPER_BUDGET_SEC = float(os.getenv("REAPER_BUDGET_SEC", "5"))
+REAPER_INTERVAL_SEC = float(os.getenv("REAPER_INTERVAL_SEC", "60"))
+
+_EXPIRED_ORDERS = """
+    SELECT ID FROM ORDERS
+    WHERE STATUS = 'NEW' AND CREATED_AT < SYSTIMESTAMP - NUMTODSINTERVAL(:ttl, 'MINUTE')
+    FOR UPDATE SKIP LOCKED
+"""
+
+# та же версия схемы мест, что поднимают бронь/оплата/отмена (ETag /api/schedules/<id>/seats)
+_BUMP_BY_ORDER = """
+    UPDATE ROUTE_SCHEDULE SET SEATS_VERSION = SEATS_VERSION + 1
+    WHERE SCHEDULE_ID = (SELECT SCHEDULE_ID FROM ORDERS WHERE ID = :1)
+"""
+
+
+def _expire_orders(conn) -> tuple[int, int]:
+    """Одна пачка просроченных заказов. Возвращает (заказов, мест)."""
+    cur = conn.cursor()
+    cur.arraysize = cur.prefetchrows = REAPER_BATCH
+    cur.execute(_EXPIRED_ORDERS, {"ttl": HOLD_TTL_MIN})
+    ids = [(r[0],) for r in cur.fetchmany(REAPER_BATCH)]  # блокируются только выбранные строки
+    if not ids:
+        conn.rollback()
+        return 0, 0
+    seats = booking.release_orders(cur, [i for (i,) in ids])  # только перегоны этих заказов
+    cur.executemany(_BUMP_BY_ORDER, ids)
+    cur.executemany("UPDATE ORDERS SET STATUS = 'CANCELED' WHERE ID = :1", ids)
+    conn.commit()
+    return len(ids), seats
+
+
+def _release_orphan_holds(conn) -> int:
+    """Одна пачка HELD без заказа NEW/PAID (например, бронь старой версии без заказа):
+    снимаются брони на всех перегонах, продажи остаются."""
+    cur = conn.cursor()
+    sids = cur.var(int, arraysize=REAPER_BATCH)
+    # CASE ... END — то же выражение, что в функциональном индексе ix_schedule_seats_held
+    cur.execute("""
+        UPDATE SCHEDULE_SEATS s
+        SET HELD_MASK = 0, HELD_AT = NULL, STATUS = CASE WHEN SOLD_MASK <> 0 THEN 'SOLD' ELSE 'FREE' END
+        WHERE CASE WHEN STATUS = 'HELD' THEN HELD_AT END < SYSTIMESTAMP - NUMTODSINTERVAL(:ttl, 'MINUTE')
+          AND NOT EXISTS (
+            SELECT 1 FROM ORDER_ITEMS oi JOIN ORDERS o ON o.ID = oi.ORDER_ID
+            WHERE oi.SEAT_ID = s.ID AND o.STATUS IN ('NEW', 'PAID'))
+          AND ROWNUM <= :n
+        RETURNING SCHEDULE_ID INTO :sids
+    """, {"ttl": HOLD_TTL_MIN, "n": REAPER_BATCH, "sids": sids})
+    released = cur.rowcount or 0
+    if released:
+        schedules = sorted(set(sids.getvalue()))
+        cur.executemany("UPDATE ROUTE_SCHEDULE SET SEATS_VERSION = SEATS_VERSION + 1 WHERE SCHEDULE_ID = :1",
+                        [(sid,) for sid in schedules])
+    conn.commit()
+    return released
+
+
+_last_sweep = {}
+
+
+def sweep(conn) -> dict:
+    """Один проход в пределах REAPER_BUDGET_SEC. Возвращает счётчики и длительность."""
+    t0 = time.perf_counter()
+    stats = {"orders_canceled": 0, "seats_released": 0, "orphan_holds": 0, "batches": 0, "budget_hit": False}
+    for step in ("orders", "holds"):
+        while True:
+            if time.perf_counter() - t0 > REAPER_BUDGET_SEC:
+                stats["budget_hit"] = True
+                break
+            if step == "orders":
+                orders, seats = _expire_orders(conn)
+                stats["orders_canceled"] += orders
+                stats["seats_released"] += seats
+                done = orders < REAPER_BATCH
+            else:
+                released = _release_orphan_holds(conn)
+                stats["orphan_holds"] += released
+                done = released < REAPER_BATCH
+            stats["batches"] += 1
+            if done:
+                break
+    stats["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    stats["at"] = time.time()
+    _last_sweep.clear()
+    _last_sweep.update(stats)
+    if stats["orders_canceled"] or stats["orphan_holds"] or stats["budget_hit"]:
+        print(f"[REAPER] orders={stats['orders_canceled']} seats={stats['seats_released']} "
+              f"orphan_holds={stats['orphan_holds']} batches={stats['batches']} {stats['ms']} ms"
+              + (" (budget hit)" if stats["budget_hit"] else ""))
+    return stats
+
+
+def last_sweep() -> dict:
+    return dict(_last_sweep)
+
+
+def run_forever() -> None:
+    while True:
+        try:
+            with get_conn() as conn:
+                sweep(conn)
+        except Exception as e:
+            print(f"[REAPER][ERROR] {e}")
+        time.sleep(REAPER_INTERVAL_SEC)
+
+
+_thread = None
+_thread_pid = None
+
+
+def start_thread() -> None:
+    """Фоновый проход в текущем процессе (один поток на процесс)."""
+    global _thread, _thread_pid
+    if _thread is not None and _thread_pid == os.getpid() and _thread.is_alive():
+        return
+    _thread = threading.Thread(target=run_forever, name="hold-reaper", daemon=True)
+    _thread_pid = os.getpid()
+    _thread.start()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Отмена просроченных заказов NEW и освобождение броней")
+    ap.add_argument("--loop", action="store_true", help=f"повторять каждые {REAPER_INTERVAL_SEC:g} с")
+    args = ap.parse_args()
+    if args.loop:
+        run_forever()
+    else:
+        with get_conn() as conn:
+            print(sweep(conn))
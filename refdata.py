@@ -0,0 +1,95 @@
+# refdata.py
+# --------------------
+# Справочники CITY, ROUTE и TRANSPORT_TYPE в памяти процесса.
+#
+# Данные живут REFDATA_TTL_SEC секунд; по истечении TTL делается один дешёвый
+# запрос-проба (MAX(ORA_ROWSCN) + COUNT(*) по трём таблицам). Если проба не
+# изменилась — справочники не перечитываются, просто продлевается TTL.
+#
+# invalidate(conn) поднимает версию 'REFDATA' в data_version; её каждый воркер
+# сверяет не реже раза в REFDATA_VERSION_CHECK_SEC (одна строка по первичному ключу)
+# и при смене перечитывает справочники, не дожидаясь TTL.
+
+import os
+import threading
+import time
+from collections import namedtuple
+from db import get_conn, fetch_all, fetch_one, get_version, bump_version
+
+REFDATA_TTL_SEC = float(os.getenv("REFDATA_TTL_SEC", "300"))
+REFDATA_VERSION_CHECK_SEC = float(os.getenv("REFDATA_VERSION_CHECK_SEC", "10"))
+VERSION_NAME = "REFDATA"
+
+_VERSION_SQL = """
+    SELECT
+      (SELECT MAX(ORA_ROWSCN) FROM CITY) AS CITY_SCN,
+      (SELECT COUNT(*) FROM CITY) AS CITY_CNT,
+      (SELECT MAX(ORA_ROWSCN) FROM ROUTE) AS ROUTE_SCN,
+      (SELECT COUNT(*) FROM ROUTE) AS ROUTE_CNT,
+      (SELECT MAX(ORA_ROWSCN) FROM TRANSPORT_TYPE) AS TT_SCN,
+      (SELECT COUNT(*) FROM TRANSPORT_TYPE) AS TT_CNT,
+      (SELECT NVL(MAX(VERSION), 0) FROM DATA_VERSION WHERE NAME = 'REFDATA') AS REFDATA_VERSION
+    FROM DUAL
+"""
+
+# cities — список по имени (для форм), остальные — словари по ID
+RefData = namedtuple("RefData", "cities city_by_id routes transport version")
+
+
+def _load(conn, version) -> RefData:
+    cities = fetch_all(conn, "SELECT ID, NAME, POPULARITY FROM CITY ORDER BY NAME", name="cities")
+    routes = fetch_all(conn, "SELECT ID, ROUTE_NAME, START_CITY_ID, END_CITY_ID FROM ROUTE ORDER BY ID")
+    transport = fetch_all(conn, "SELECT ID, NAME, SPEED_KMPH, PRICE_PER_KM FROM TRANSPORT_TYPE ORDER BY ID")
+    return RefData(
+        cities=cities,
+        city_by_id={c.ID: c for c in cities},
+        routes={r.ID: r for r in routes},
+        transport={t.ID: t for t in transport},
+        version=version,
+    )
+
+
+_data = None
+_checked_at = 0.0  # последняя полная проба
+_synced_at = 0.0   # последняя сверка версии 'REFDATA'
+_lock = threading.Lock()
+
+
+def _fresh(data, now: float) -> bool:
+    return (data is not None and now - _checked_at < REFDATA_TTL_SEC
+            and now - _synced_at < REFDATA_VERSION_CHECK_SEC)
+
+
+def get(connect=get_conn) -> RefData:
+    """Справочники процесса. connect — фабрика контекст-менеджера сессии;
+    вызывается только для сверки версии или когда истёк TTL (в запросе приложения — db_session)."""
+    global _data, _checked_at, _synced_at
+    data = _data
+    if _fresh(data, time.monotonic()):
+        return data
+    with _lock:
+        now = time.monotonic()
+        if _fresh(_data, now):
+            return _data
+        with connect() as conn:
+            if (_data is not None and now - _checked_at < REFDATA_TTL_SEC
+                    and get_version(conn, VERSION_NAME) == _data.version[-1]):
+                _synced_at = now  # TTL ещё идёт и invalidate() никто не звал
+                return _data
+            version = tuple(fetch_one(conn, _VERSION_SQL))
+            if _data is None or _data.version != version:
+                _data = _load(conn, version)
+                print(f"[REFDATA] loaded: {len(_data.cities)} cities, {len(_data.routes)} routes, "
+                      f"{len(_data.transport)} transport types")
+        _checked_at = _synced_at = time.monotonic()
+        return _data
+
+
+def invalidate(conn) -> int:
+    """Перечитать справочники во всех процессах: поднять версию 'REFDATA' (коммитит вызывающий).
+    Этот процесс перечитает их при следующем обращении, остальные — после своей сверки версии."""
+    global _data, _checked_at
+    version = bump_version(conn, VERSION_NAME)
+    with _lock:
+        _data, _checked_at = None, 0.0
+    return version
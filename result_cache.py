@@ -0,0 +1,79 @@
+# result_cache.py
+# --------------------
+# Ограниченный LRU-кэш с TTL и single-flight: при одновременных промахах по
+# одному ключу запрос в БД делает только первый поток, остальные ждут его результат.
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, wait_timeout: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}
+        self._generation = 0        # меняется при clear(): результат «старой» загрузки не сохраняем
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.shared = 0
+
+    def get_or_load(self, key, loader):
+        """Значение из кэша или loader(); ошибки loader() не кэшируются."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+                generation = self._generation
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            if not flight.event.wait(self.wait_timeout):
+                return loader()  # ведущий завис — не ждём бесконечно
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if flight.error is None and generation == self._generation:
+                    self._data[key] = (time.monotonic() + self.ttl, flight.value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.maxsize:
+                        self._data.popitem(last=False)
+            flight.event.set()
+        return flight.value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "shared": self.shared}
@@ -0,0 +1,306 @@
+# route_graph.py
+# --------------------
+# Граф городов (city_path) в памяти процесса: кратчайший путь и k лучших путей
+# вместо рекурсивных CTE из «все пути всех маршрутов.sql».
+#
+# Граф хранится в виде массивов смежности (CSR): для вершины u её соседи лежат в
+# targets[offsets[u]:offsets[u+1]], длины рёбер — в dist_km по тем же индексам.
+
+import heapq
+import threading
+from array import array
+from collections import namedtuple
+
+MAX_DEPTH = 8  # как в CTE: не больше 8 перегонов
+METRICS = ("distance", "time", "price", "popularity")
+
+# city_ids — ID городов по порядку; depth — число перегонов
+Path = namedtuple("Path", "city_ids distance_km depth popularity path_city_ids cities_sequence")
+
+
+class RouteGraph:
+    """Неориентированный граф city_path. Вершины — индексы 0..n-1, наружу отдаются ID городов."""
+
+    def __init__(self, cities, edges):
+        """cities: [(id, name, popularity)], edges: [(city_a_id, city_b_id, dist_km)]"""
+        self.city_ids = array("l", (c[0] for c in cities))
+        self.names = [c[1] for c in cities]
+        self.popularity = array("l", (int(c[2]) for c in cities))
+        self.index = {cid: i for i, cid in enumerate(self.city_ids)}
+
+        n = len(self.city_ids)
+        adj = [[] for _ in range(n)]
+        for a, b, km in edges:
+            ia, ib = self.index[a], self.index[b]
+            adj[ia].append((ib, float(km)))
+            adj[ib].append((ia, float(km)))
+
+        self.offsets = array("l", [0])
+        self.targets = array("l")
+        self.dist_km = array("d")
+        for u in range(n):
+            for v, km in sorted(adj[u]):
+                self.targets.append(v)
+                self.dist_km.append(km)
+            self.offsets.append(len(self.targets))
+        self._weights = {}
+        self._by_popularity = None
+
+    @classmethod
+    def from_db(cls, conn):
+        cur = conn.cursor()
+        cur.execute("SELECT ID, NAME, POPULARITY FROM CITY ORDER BY ID")
+        cities = cur.fetchall()
+        cur.execute("SELECT CITY_A_ID, CITY_B_ID, DIST_KM FROM CITY_PATH")
+        edges = cur.fetchall()
+        return cls(cities, edges)
+
+    # ---------- веса рёбер ----------
+    def weights(self, metric="distance", speed_kmph=1.0, price_per_km=1.0) -> array:
+        """Вес каждого ребра CSR для метрики.
+        popularity — «интересный» вес: перегон в популярный город дешевле, чем в малоизвестный."""
+        key = (metric, float(speed_kmph), float(price_per_km))
+        w = self._weights.get(key)
+        if w is not None:
+            return w
+        if metric == "distance":
+            w = array("d", self.dist_km)
+        elif metric == "time":
+            w = array("d", (km / speed_kmph * 60 for km in self.dist_km))
+        elif metric == "price":
+            w = array("d", (km * price_per_km for km in self.dist_km))
+        elif metric == "popularity":
+            top = max(self.popularity) or 1
+            w = array("d", (km * top / max(self.popularity[v], 1) for km, v in zip(self.dist_km, self.targets)))
+        else:
+            raise ValueError(f"Неизвестная метрика: {metric}")
+        self._weights[key] = w
+        return w
+
+    # ---------- поиск ----------
+    def _dijkstra(self, src, dst, w, max_hops, banned_nodes=(), banned_edges=()):
+        """Кратчайший путь src→dst не длиннее max_hops перегонов (состояние = вершина + число перегонов).
+        Возвращает (стоимость, [индексы вершин]) или None."""
+        offsets, targets = self.offsets, self.targets
+        best = {(src, 0): 0.0}
+        prev = {}
+        heap = [(0.0, 0, src)]
+        while heap:
+            cost, hops, u = heapq.heappop(heap)
+            if u == dst:
+                path = [u]
+                state = (u, hops)
+                while state in prev:
+                    state = prev[state]
+                    path.append(state[0])
+                path.reverse()
+                return cost, path
+            if cost > best.get((u, hops), float("inf")) or hops >= max_hops:
+                continue
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                if v in banned_nodes or (u, v) in banned_edges:
+                    continue
+                nc = cost + w[e]
+                state = (v, hops + 1)
+                if nc < best.get(state, float("inf")):
+                    best[state] = nc
+                    prev[state] = (u, hops)
+                    heapq.heappush(heap, (nc, hops + 1, v))
+        return None
+
+    def _edge_weight(self, u, v, w):
+        for e in range(self.offsets[u], self.offsets[u + 1]):
+            if self.targets[e] == v:
+                return w[e]
+        raise KeyError((u, v))
+
+    def edge_km(self, a_city_id, b_city_id) -> float:
+        """Длина перегона между соседними городами."""
+        return self._edge_weight(self.index[a_city_id], self.index[b_city_id], self.dist_km)
+
+    def _yen(self, src, dst, k, w, max_depth):
+        """k кратчайших простых путей (алгоритм Йена) в индексах вершин."""
+        first = self._dijkstra(src, dst, w, max_depth)
+        if first is None:
+            return []
+        found = [first]
+        seen = {tuple(first[1])}
+        candidates = []
+        while len(found) < k:
+            last = found[-1][1]
+            for i in range(len(last) - 1):
+                spur, root = last[i], last[:i + 1]
+                root_cost = sum(self._edge_weight(root[j], root[j + 1], w) for j in range(i))
+                banned_edges = {(p[i], p[i + 1]) for _, p in found if p[:i + 1] == root}
+                spur_res = self._dijkstra(spur, dst, w, max_depth - i,
+                                          banned_nodes=set(root[:-1]), banned_edges=banned_edges)
+                if spur_res is None:
+                    continue
+                path = root[:-1] + spur_res[1]
+                if tuple(path) not in seen:
+                    seen.add(tuple(path))
+                    heapq.heappush(candidates, (root_cost + spur_res[0], path))
+            if not candidates:
+                break
+            found.append(heapq.heappop(candidates))
+        return [p for _, p in found]
+
+    def _to_path(self, nodes) -> Path:
+        km = sum(self._edge_weight(nodes[i], nodes[i + 1], self.dist_km) for i in range(len(nodes) - 1))
+        ids = tuple(self.city_ids[i] for i in nodes)
+        return Path(
+            city_ids=ids,
+            distance_km=km,
+            depth=len(nodes) - 1,
+            popularity=sum(self.popularity[i] for i in nodes),
+            path_city_ids="->".join(str(c) for c in ids),
+            cities_sequence=" → ".join(self.names[i] for i in nodes),
+        )
+
+    def shortest_path(self, from_city_id, to_city_id, metric="distance", max_depth=MAX_DEPTH, **transport):
+        paths = self.k_shortest_paths(from_city_id, to_city_id, 1, metric, max_depth, **transport)
+        return paths[0] if paths else None
+
+    def k_shortest_paths(self, from_city_id, to_city_id, k, metric="distance", max_depth=MAX_DEPTH, **transport):
+        """k простых путей A→B по возрастанию метрики (distance | time | price | popularity).
+        transport: speed_kmph / price_per_km для time и price."""
+        src, dst = self.index.get(from_city_id), self.index.get(to_city_id)
+        if src is None or dst is None or src == dst or k <= 0:
+            return []
+        w = self.weights(metric, **transport)
+        return [self._to_path(p) for p in self._yen(src, dst, k, w, max_depth)]
+
+    def _hops_to(self, dst) -> list:
+        """Наименьшее число перегонов от каждой вершины до dst (BFS); недостижимые — бесконечность."""
+        offsets, targets = self.offsets, self.targets
+        hops = [float("inf")] * len(self.city_ids)
+        hops[dst] = 0
+        frontier = [dst]
+        while frontier:
+            nxt = []
+            for u in frontier:
+                for e in range(offsets[u], offsets[u + 1]):
+                    v = targets[e]
+                    if hops[v] == float("inf"):
+                        hops[v] = hops[u] + 1
+                        nxt.append(v)
+            frontier = nxt
+        return hops
+
+    def _edges_by_popularity(self) -> list:
+        """Для каждой вершины — её рёбра CSR от самого популярного соседа к наименее популярному."""
+        if self._by_popularity is None:
+            pop, targets = self.popularity, self.targets
+            self._by_popularity = [
+                sorted(range(self.offsets[u], self.offsets[u + 1]), key=lambda e: -pop[targets[e]])
+                for u in range(len(self.city_ids))]
+        return self._by_popularity
+
+    def popular_paths(self, from_city_id, to_city_id, k, max_depth=MAX_DEPTH):
+        """Пути для категории INTERESTING — то же, что route_popularity в SQL: k простых путей
+        не длиннее max_depth перегонов с наибольшей суммарной популярностью городов
+        (при равной — более короткие по расстоянию).
+
+        Перебор в глубину с отсечением: к популярности префикса прибавляется верхняя оценка
+        остатка — сумма популярностей h самых популярных городов графа, где h — сколько городов
+        ещё можно добавить. Ветка, которая даже по оценке не обгоняет k-й найденный путь,
+        не обходится; не обходятся и вершины, откуда до B не дойти за оставшиеся перегоны.
+        Соседи перебираются от популярных к непопулярным, чтобы сильные пути нашлись рано."""
+        src, dst = self.index.get(from_city_id), self.index.get(to_city_id)
+        if src is None or dst is None or src == dst or k <= 0:
+            return []
+        hops = self._hops_to(dst)
+        if hops[src] > max_depth:
+            return []
+        pop, targets, dist_km = self.popularity, self.targets, self.dist_km
+        order = self._edges_by_popularity()
+        bound = [0]  # bound[h] — не больше, чем дадут любые h городов
+        top = sorted(pop, reverse=True)
+        for h in range(max_depth):
+            bound.append(bound[-1] + (max(top[h], 0) if h < len(top) else 0))
+
+        best = []  # min-куча k лучших: (популярность, -км, вершины)
+        visited = bytearray(len(self.city_ids))
+        visited[src] = 1
+        path = [src]
+
+        def dfs(u, depth, popularity, km):
+            if u == dst:
+                item = (popularity, -km, tuple(path))
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item[:2] > best[0][:2]:
+                    heapq.heapreplace(best, item)
+                return
+            left = max_depth - depth - 1  # перегонов останется после следующего
+            for e in order[u]:
+                v = targets[e]
+                if visited[v] or hops[v] > left:
+                    continue
+                p, d = popularity + pop[v], km + dist_km[e]
+                if len(best) == k:
+                    top, worst_km = best[0][0], -best[0][1]
+                    limit = p + bound[left]
+                    if limit < top or (limit == top and d >= worst_km):
+                        continue
+                visited[v] = 1
+                path.append(v)
+                dfs(v, depth + 1, p, d)
+                path.pop()
+                visited[v] = 0
+
+        dfs(src, 0, pop[src], 0.0)
+        best.sort(key=lambda item: (-item[0], -item[1]))
+        return [self._to_path(list(item[2])) for item in best]
+
+
+# ---------- общий граф процесса ----------
+_graph = None
+_graph_version = None
+_graph_lock = threading.Lock()
+
+
+def get_graph(conn, version=None) -> RouteGraph:
+    """Граф загружается из БД один раз на процесс.
+    version — версия каталога путей (data_version 'PATH_CATALOG'): если она сменилась, граф перечитывается."""
+    global _graph, _graph_version
+    g = _graph
+    if g is not None and (version is None or version == _graph_version):
+        return g
+    with _graph_lock:
+        if _graph is None or (version is not None and version != _graph_version):
+            _graph = RouteGraph.from_db(conn)
+            _graph_version = version
+        return _graph
+
+
+def invalidate_graph() -> None:
+    global _graph, _graph_version
+    with _graph_lock:
+        _graph, _graph_version = None, None
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from db import get_conn
+
+    ap = argparse.ArgumentParser(description="Пути между городами по графу city_path")
+    ap.add_argument("from_city", type=int)
+    ap.add_argument("to_city", type=int)
+    ap.add_argument("-k", type=int, default=5)
+    ap.add_argument("--metric", choices=METRICS, default="distance")
+    args = ap.parse_args()
+
+    with get_conn() as conn:
+        graph = RouteGraph.from_db(conn)
+    t0 = time.perf_counter()
+    if args.metric == "popularity":
+        found = graph.popular_paths(args.from_city, args.to_city, args.k)
+    else:
+        found = graph.k_shortest_paths(args.from_city, args.to_city, args.k, args.metric)
+    dt = (time.perf_counter() - t0) * 1000
+    for p in found:
+        print(f"{p.distance_km:8.0f} км  pop={p.popularity:4d}  {p.cities_sequence}")
+    print(f"[GRAPH] {len(found)} путей за {dt:.2f} мс")
@@ -0,0 +1,186 @@
+# schedule_gen.py
+# --------------------
+# Генерация расписания (route_schedule + route_schedule_stop) в Python
+# вместо четырёх INSERT ... SELECT из «расписание маршрутов.sql».
+#
+# Правила те же, что в SQL: 12 маршрутов × 15 путей из каталога на категорию,
+# отправление в 6:00 + MOD(route_id * A + day_offset * B, 16) часов.
+# Окно скользящее: добавляются только дни, которых не хватает до конца окна,
+# поэтому ночной запуск дописывает один день, а не перестраивает 90.
+#
+#   python schedule_gen.py                 # дописать недостающие дни окна
+#   python schedule_gen.py --days 90 --batch-size 2000
+
+import os
+from collections import namedtuple
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from route_graph import RouteGraph
+from db import bump_version
+import refdata
+
+WINDOW_DAYS = int(os.getenv("SCHEDULE_WINDOW_DAYS", "90"))
+BATCH_SIZE = int(os.getenv("SCHEDULE_BATCH_SIZE", "1000"))
+PATHS_PER_ROUTE = 15
+ROUTE_IDS = range(1, 13)
+VERSION_NAME = "SCHEDULE"
+
+# transport_type_id и множители хэша времени отправления — как в SQL
+Category = namedtuple("Category", "name transport_type_id route_mul day_mul order")
+CATEGORIES = (
+    Category("FAST", 2, 17, 23, lambda p: (p[3],)),                  # по расстоянию
+    Category("BUDGET", 1, 19, 29, lambda p: (p[3],)),
+    Category("INTERESTING", 1, 13, 31, lambda p: (-p[4],)),          # по популярности
+    Category("PREMIUM", 3, 11, 37, lambda p: (-p[4], p[3])),         # популярность, затем расстояние
+)
+
+
+def round_half_up(x, digits=0) -> float:
+    """ROUND() как в Oracle (Python round() округляет к чётному)."""
+    q = Decimal(1).scaleb(-digits)
+    return float(Decimal(str(x)).quantize(q, rounding=ROUND_HALF_UP))
+
+
+def departure(day: date, day_offset: int, route_id: int, cat: Category) -> datetime:
+    hour = 6 + (route_id * cat.route_mul + day_offset * cat.day_mul) % 16
+    return datetime(day.year, day.month, day.day, hour)
+
+
+def load_catalog(conn):
+    """route_id -> [(route_id, path_city_ids, cities_sequence, total_distance, total_popularity)]"""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ROUTE_ID, PATH_CITY_IDS, CITIES_SEQUENCE, TOTAL_DISTANCE, TOTAL_POPULARITY
+        FROM ROUTE_PATH_CATALOG
+        WHERE ROUTE_ID BETWEEN :lo AND :hi
+    """, {"lo": min(ROUTE_IDS), "hi": max(ROUTE_IDS)})
+    catalog = {}
+    for row in cur.fetchall():
+        catalog.setdefault(row[0], []).append(row)
+    return catalog
+
+
+def load_transport(conn):
+    """transport_type_id -> (speed_kmph, price_per_km) из справочника refdata."""
+    ref = refdata.get(lambda: nullcontext(conn))
+    return {t.ID: (float(t.SPEED_KMPH), float(t.PRICE_PER_KM)) for t in ref.transport.values()}
+
+
+def missing_days(conn, today: date, window_days: int):
+    """Для каждой категории — дни окна [today, today + window_days) после последнего уже созданного.
+    anchor — первый день расписания: от него считается day_offset, чтобы время отправления не съезжало."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT CATEGORY, MIN(START_DATETIME), MAX(START_DATETIME)
+        FROM ROUTE_SCHEDULE
+        GROUP BY CATEGORY
+    """)
+    bounds = {r[0]: (r[1].date(), r[2].date()) for r in cur.fetchall()}
+    anchor = min((b[0] for b in bounds.values()), default=today)
+    end = today + timedelta(days=window_days)
+    result = {}
+    for cat in CATEGORIES:
+        first = today
+        if cat.name in bounds:
+            first = max(first, bounds[cat.name][1] + timedelta(days=1))
+        result[cat.name] = [first + timedelta(days=i) for i in range((end - first).days)]
+    return anchor, result
+
+
+def build_rows(cat: Category, days, anchor: date, catalog, transport, graph: RouteGraph):
+    """Строки рейсов и их остановок для категории. Остановки — списком на рейс, в том же порядке."""
+    speed, ppk = transport[cat.transport_type_id]
+    paths = []
+    for route_id in ROUTE_IDS:
+        best = sorted(catalog.get(route_id, []), key=cat.order)[:PATHS_PER_ROUTE]
+        for _, path_ids, names, km, pop in best:
+            ids = [int(x) for x in path_ids.split("->")]
+            stops, cum = [], 0.0
+            for seq, city_id in enumerate(ids):
+                if seq:
+                    cum += graph.edge_km(ids[seq - 1], city_id)
+                stops.append((seq, city_id, cum, round_half_up(cum / speed * 60)))
+            paths.append((route_id, path_ids, names, float(km), int(pop), stops))
+
+    for day in days:
+        offset = (day - anchor).days
+        for route_id, path_ids, names, km, pop, stops in paths:
+            minutes = round_half_up(km / speed * 60)
+            start = departure(day, offset, route_id, cat)
+            yield (
+                dict(route_id=route_id, category=cat.name, tt=cat.transport_type_id, speed=speed, ppk=ppk,
+                     path=path_ids, names=names, pop=pop, km=km, price=round_half_up(km * ppk, 2),
+                     minutes=minutes, start_dt=start, end_dt=start + timedelta(minutes=minutes)),
+                stops,
+            )
+
+
+def insert_batch(cur, batch) -> None:
+    sid = cur.var(int, arraysize=len(batch))
+    cur.setinputsizes(sid=sid)
+    cur.executemany("""
+        INSERT INTO ROUTE_SCHEDULE (
+          ROUTE_ID, CATEGORY, TRANSPORT_TYPE_ID, SPEED_KMPH, PRICE_PER_KM,
+          PATH_CITY_IDS, CITIES_SEQUENCE, TOTAL_POPULARITY, TOTAL_DISTANCE_KM,
+          TOTAL_PRICE, TOTAL_TIME_MINUTES, START_DATETIME, END_DATETIME)
+        VALUES (:route_id, :category, :tt, :speed, :ppk, :path, :names, :pop, :km,
+                :price, :minutes, :start_dt, :end_dt)
+        RETURNING SCHEDULE_ID INTO :sid
+    """, [row for row, _ in batch])
+    stop_rows = []
+    for i, (_, stops) in enumerate(batch):
+        schedule_id = int(sid.getvalue(i)[0])
+        stop_rows.extend((schedule_id, seq, city_id, km, minutes) for seq, city_id, km, minutes in stops)
+    cur.executemany("""
+        INSERT INTO ROUTE_SCHEDULE_STOP (SCHEDULE_ID, STOP_SEQ, CITY_ID, CUM_DIST_KM, CUM_MINUTES)
+        VALUES (:1, :2, :3, :4, :5)
+    """, stop_rows)
+
+
+def generate(conn, today: date = None, window_days: int = WINDOW_DAYS, batch_size: int = BATCH_SIZE) -> dict:
+    """Дописать недостающие дни окна. Коммит делает вызывающий."""
+    today = today or date.today()
+    anchor, days_by_cat = missing_days(conn, today, window_days)
+    if not any(days_by_cat.values()):
+        return {"schedules": 0}
+
+    catalog = load_catalog(conn)
+    transport = load_transport(conn)
+    graph = RouteGraph.from_db(conn)
+    cur = conn.cursor()
+    total, batch = 0, []
+    stats = {}
+    for cat in CATEGORIES:
+        days = days_by_cat[cat.name]
+        stats[cat.name] = len(days)
+        for item in build_rows(cat, days, anchor, catalog, transport, graph):
+            batch.append(item)
+            if len(batch) >= batch_size:
+                insert_batch(cur, batch)
+                total += len(batch)
+                batch = []
+    if batch:
+        insert_batch(cur, batch)
+        total += len(batch)
+    stats["schedules"] = total
+    stats["version"] = bump_version(conn, VERSION_NAME)
+    return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from db import get_conn
+
+    ap = argparse.ArgumentParser(description="Генерация расписания на скользящее окно")
+    ap.add_argument("--days", type=int, default=WINDOW_DAYS, help="длина окна, дней")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="строк на один executemany")
+    ap.add_argument("--today", type=date.fromisoformat, default=None, help="начало окна (YYYY-MM-DD)")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    with get_conn() as conn:
+        stats = generate(conn, args.today, args.days, args.batch_size)
+        conn.commit()
+    print(f"[SCHEDULE] {stats} за {time.perf_counter() - t0:.2f} с")
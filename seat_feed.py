@@ -0,0 +1,199 @@
+# seat_feed.py
+# --------------------
+# Живые изменения мест для SSE (/api/schedules/<id>/seats/stream).
+#
+# Межпроцессная лента — таблица seat_change_log (пишет триггер на schedule_seats,
+# см. «места.sql»). В каждом воркере один поток читает ленту по ID > last и
+# раздаёт изменения подписчикам своего процесса (очереди по рейсам). Сколько бы
+# страниц мест ни было открыто, БД видит один опрос на воркер и только пока
+# есть подписчики.
+#
+# IDENTITY выдаёт ID при вставке, а видны строки после коммита — транзакция
+# с меньшим ID может закоммититься позже. Пропущенные ID («дырки») помним
+# FEED_GAP_SEC секунд и дочитываем; по истечении считаем их откатами.
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from db import get_conn, fetch_all
+
+FEED_POLL_SEC = float(os.getenv("SEAT_FEED_POLL_SEC", "0.5"))
+FEED_GAP_SEC = float(os.getenv("SEAT_FEED_GAP_SEC", "5"))
+FEED_RETENTION_MIN = int(os.getenv("SEAT_FEED_RETENTION_MIN", "60"))
+FEED_PURGE_SEC = 600
+MAX_GAP = 1000   # скачок ID больше этого (кэш IDENTITY после рестарта БД) дырками не считаем
+QUEUE_SIZE = 256  # отстающий подписчик получает resync и перечитывает схему целиком
+
+_lock = threading.Lock()
+_subscribers = defaultdict(set)  # schedule_id -> {queue.Queue}
+_has_subscribers = threading.Event()
+_thread = None
+_thread_pid = None
+
+
+def subscribe(schedule_id: int) -> queue.Queue:
+    q = queue.Queue(QUEUE_SIZE)
+    with _lock:
+        _subscribers[schedule_id].add(q)
+        _has_subscribers.set()
+    _ensure_thread()
+    return q
+
+
+def unsubscribe(schedule_id: int, q: queue.Queue) -> None:
+    with _lock:
+        subs = _subscribers.get(schedule_id)
+        if subs is not None:
+            subs.discard(q)
+            if not subs:
+                del _subscribers[schedule_id]
+        if not _subscribers:
+            _has_subscribers.clear()
+
+
+def _put(q: queue.Queue, event: dict) -> None:
+    try:
+        q.put_nowait(event)
+    except queue.Full:
+        # клиент не успевает — выбрасываем накопленное, пусть перечитает схему
+        while True:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                break
+        q.put_nowait({"resync": True})
+
+
+def publish(changes) -> None:
+    """changes — записи ленты (ID, SCHEDULE_ID, COACH_NO, SEAT_NO, HELD_MASK, SOLD_MASK); одно событие на рейс."""
+    by_schedule = defaultdict(list)
+    for c in changes:
+        by_schedule[c.SCHEDULE_ID].append(c)
+    with _lock:
+        targets = [(sid, list(_subscribers.get(sid, ()))) for sid in by_schedule]
+    for sid, subs in targets:
+        if not subs:
+            continue
+        rows = by_schedule[sid]
+        # маски перегонов как есть: статус для своего участка поездки клиент считает сам
+        event = {"id": rows[-1].ID,
+                 "changes": [[r.COACH_NO, r.SEAT_NO, int(r.HELD_MASK), int(r.SOLD_MASK)] for r in rows]}
+        for q in subs:
+            _put(q, event)
+
+
+def format_sse(event: dict) -> str:
+    if event.get("resync"):
+        return "event: resync\ndata: {}\n\n"
+    return f"id: {event['id']}\nevent: seats\ndata: {json.dumps(event['changes'])}\n\n"
+
+
+# ---------- поток чтения ленты ----------
+class _Cursor:
+    """Позиция в ленте: последний прочитанный ID и незакрытые «дырки» перед ним."""
+
+    def __init__(self, last: int):
+        self.last = last
+        self.gaps = {}  # id -> когда заметили
+
+    def low(self) -> int:
+        return min(self.gaps) - 1 if self.gaps else self.last
+
+    def accept(self, rows) -> list:
+        """Отбросить уже виденное, обновить last и дырки; вернуть новые строки."""
+        now = time.monotonic()
+        fresh = []
+        for r in rows:
+            if r.ID > self.last:
+                if r.ID - self.last <= MAX_GAP:
+                    self.gaps.update((i, now) for i in range(self.last + 1, r.ID))
+                self.last = r.ID
+                fresh.append(r)
+            elif self.gaps.pop(r.ID, None) is not None:
+                fresh.append(r)
+        for i, seen in list(self.gaps.items()):
+            if now - seen > FEED_GAP_SEC:
+                del self.gaps[i]
+        return fresh
+
+
+def _poll(conn, pos: _Cursor) -> list:
+    rows = fetch_all(conn, """
+        SELECT ID, SCHEDULE_ID, COACH_NO, SEAT_NO, HELD_MASK, SOLD_MASK
+        FROM SEAT_CHANGE_LOG
+        WHERE ID > :low
+        ORDER BY ID
+    """, {"low": pos.low()})
+    conn.rollback()  # не держим снимок/транзакцию между опросами
+    return pos.accept(rows)
+
+
+def _purge(conn) -> None:
+    cur = conn.cursor()
+    cur.execute("DELETE FROM SEAT_CHANGE_LOG WHERE CHANGED_AT < SYSTIMESTAMP - NUMTODSINTERVAL(:m, 'MINUTE')",
+                {"m": FEED_RETENTION_MIN})
+    conn.commit()
+
+
+def _resync_all() -> None:
+    """Всем подписчикам процесса — resync: пусть перечитают схему целиком."""
+    with _lock:
+        subs = [q for qs in _subscribers.values() for q in qs]
+    for q in subs:
+        _put(q, {"resync": True})
+
+
+def _run() -> None:
+    pos = None
+    lost = False  # ленту не дочитали (сбой дольше срока хранения) — после переподключения resync
+    polled_at = purged_at = 0.0
+    while True:
+        _has_subscribers.wait()
+        # после ошибки (обрыв сессии, рестарт БД) читаем дальше с pos: строки ленты живут
+        # FEED_RETENTION_MIN. Сбой дольше половины срока — часть изменений могла уйти в _purge
+        if pos is not None and time.monotonic() - polled_at > FEED_RETENTION_MIN * 30:
+            pos, lost = None, True
+        try:
+            with get_conn() as conn:
+                if pos is None:
+                    cur = conn.cursor()
+                    cur.execute("SELECT NVL(MAX(ID), 0) FROM SEAT_CHANGE_LOG")
+                    pos = _Cursor(int(cur.fetchone()[0]))
+                    polled_at = time.monotonic()
+                    if lost:
+                        # схему перечитывают уже после новой позиции: дальше ничего не теряется
+                        _resync_all()
+                        lost = False
+                while _has_subscribers.is_set():
+                    changes = _poll(conn, pos)
+                    polled_at = time.monotonic()
+                    if changes:
+                        publish(changes)
+                    if time.monotonic() - purged_at > FEED_PURGE_SEC:
+                        _purge(conn)
+                        purged_at = time.monotonic()
+                    time.sleep(FEED_POLL_SEC)
+            # подписчиков не осталось: сессию вернули в пул; новые подписчики сами
+            # перечитывают схему (ETag), поэтому ленту потом читаем с текущего конца
+            pos = None
+        except Exception as e:
+            print(f"[SEAT-FEED][ERROR] {e}")
+            time.sleep(FEED_POLL_SEC * 4)
+
+
+def _ensure_thread() -> None:
+    global _thread, _thread_pid
+    with _lock:
+        if _thread is not None and _thread_pid == os.getpid() and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run, name="seat-feed", daemon=True)
+        _thread_pid = os.getpid()
+        _thread.start()
+
+
+def stats() -> dict:
+    with _lock:
+        return {"schedules": len(_subscribers), "subscribers": sum(len(s) for s in _subscribers.values())}
@@ -0,0 +1,178 @@
+# seatmap.py
+# --------------------
+# Компактная схема мест рейса: состояние — bytearray по одному байту на место,
+# ID мест — array('q') той же длины. Индекс = (вагон - first_coach) * per_coach + (место - 1),
+# поэтому отрисовка вагона — прямой доступ по номеру места, без поиска по списку.
+# Весь состав (10 вагонов × 20 мест) кодируется строкой в 200 символов.
+
+from array import array
+from collections import namedtuple
+
+FREE, HELD, SOLD = 0, 1, 2
+MISSING = 255  # места с таким номером нет в раскладке
+CODES = {"FREE": FREE, "HELD": HELD, "SOLD": SOLD}
+NAMES = {FREE: "FREE", HELD: "HELD", SOLD: "SOLD", MISSING: None}
+_ENCODE = bytes.maketrans(bytes([FREE, HELD, SOLD, MISSING]), b"012-")
+
+# Занятость места по перегонам: бит i — перегон между остановками i и i+1
+# (stop_seq из route_schedule_stop). Поездка from_seq -> to_seq занимает биты
+# from_seq .. to_seq-1. ALL_LEGS — «весь рейс» (перегонов заведомо меньше 31).
+ALL_LEGS = 2 ** 31 - 1
+
+
+def leg_mask(from_seq=None, to_seq=None) -> int:
+    if from_seq is None or to_seq is None or not 0 <= from_seq < to_seq <= 30:
+        return ALL_LEGS
+    return (1 << to_seq) - (1 << from_seq)
+
+
+def leg_range(mask: int):
+    """(from_seq, to_seq) поездки по маске leg_mask; None — весь рейс."""
+    if mask == ALL_LEGS:
+        return None
+    return (mask & -mask).bit_length() - 1, mask.bit_length()
+
+
+def leg_status(held_mask: int, sold_mask: int, mask: int) -> int:
+    """Статус места для поездки с маской mask (куплено важнее брони)."""
+    if sold_mask & mask:
+        return SOLD
+    return HELD if held_mask & mask else FREE
+
+
+class SeatMap:
+    __slots__ = ("first_coach", "coaches", "per_coach", "state", "ids")
+
+    def __init__(self, first_coach: int, coaches: int, per_coach: int):
+        self.first_coach = first_coach
+        self.coaches = coaches
+        self.per_coach = per_coach
+        self.state = bytearray([MISSING]) * (coaches * per_coach)
+        self.ids = array("q", bytes(8 * coaches * per_coach))
+
+    @classmethod
+    def from_rows(cls, rows, mask: int | None = None) -> "SeatMap | None":
+        """rows — записи с полями ID, COACH_NO, SEAT_NO и STATUS (порядок не важен).
+        С mask статус считается по HELD_MASK / SOLD_MASK для этих перегонов."""
+        rows = list(rows)
+        if not rows:
+            return None
+        first = min(r.COACH_NO for r in rows)
+        last = max(r.COACH_NO for r in rows)
+        sm = cls(int(first), int(last - first + 1), int(max(r.SEAT_NO for r in rows)))
+        for r in rows:
+            i = sm._index(r.COACH_NO, r.SEAT_NO)
+            if mask is not None:
+                sm.state[i] = leg_status(r.HELD_MASK, r.SOLD_MASK, mask)
+            else:
+                sm.state[i] = CODES.get(r.STATUS, SOLD)  # неизвестный статус — место не продаём
+            sm.ids[i] = r.ID
+        return sm
+
+    def _index(self, coach: int, seat_no: int) -> int:
+        c = coach - self.first_coach
+        if 0 <= c < self.coaches and 1 <= seat_no <= self.per_coach:
+            return c * self.per_coach + seat_no - 1
+        return -1
+
+    def status(self, coach: int, seat_no: int) -> int:
+        i = self._index(coach, seat_no)
+        return self.state[i] if i >= 0 else MISSING
+
+    def status_name(self, coach: int, seat_no: int):
+        """'FREE' / 'HELD' / 'SOLD' или None, если места нет."""
+        return NAMES[self.status(coach, seat_no)]
+
+    def seat_id(self, coach: int, seat_no: int):
+        i = self._index(coach, seat_no)
+        return self.ids[i] if i >= 0 and self.state[i] != MISSING else None
+
+    def coach_state(self, coach: int) -> bytearray:
+        c = coach - self.first_coach
+        return self.state[c * self.per_coach:(c + 1) * self.per_coach]
+
+    def free_count(self, coach: int | None = None) -> int:
+        return (self.state if coach is None else self.coach_state(coach)).count(FREE)
+
+    def encode(self) -> str:
+        """Состояние строкой: '0' свободно, '1' бронь, '2' куплено, '-' нет места."""
+        return bytes(self.state).translate(_ENCODE).decode("ascii")
+
+    def to_dict(self) -> dict:
+        """Компактное представление для JSON. ID мест обычно идут подряд —
+        тогда передаём только первый ID, иначе весь список."""
+        d = {"first_coach": self.first_coach, "coaches": self.coaches,
+             "per_coach": self.per_coach, "state": self.encode()}
+        present = [(i, sid) for i, sid in enumerate(self.ids) if self.state[i] != MISSING]
+        base = present[0][1] - present[0][0] if present else 0
+        if all(sid == base + i for i, sid in present):
+            d["id_base"] = base
+        else:
+            d["ids"] = [sid if self.state[i] != MISSING else None for i, sid in enumerate(self.ids)]
+        return d
+
+    # ---------- подбор мест рядом ----------
+    # Раскладка вагона: ряды по 4 места — 1, 2 | коридор | 3, 4 (см. SEATS_TEMPLATE).
+    # Уровни (меньше — лучше): 0 — один ряд, одна сторона; 1 — один ряд;
+    # 2 — одна сторона соседних рядов; 3 — соседние ряды вагона. Между вагонами не делим.
+    ROW = 4
+    TIERS = ("рядом", "в одном ряду", "друг за другом", "в одном вагоне")
+
+    def mark_taken(self, seat_id: int) -> None:
+        """Место занято (например, перехвачено при блокировке) — больше его не предлагать."""
+        try:
+            i = self.ids.index(seat_id)
+        except ValueError:
+            return
+        if self.state[i] == FREE:
+            self.state[i] = HELD
+
+    def best_block(self, n: int) -> "Block | None":
+        """Лучший блок из n свободных мест за один проход по всем вагонам."""
+        if n < 1 or n > self.per_coach:
+            return None
+        rows = -(-self.per_coach // self.ROW)
+        best = None
+        for c in range(self.coaches):
+            base = c * self.per_coach
+            free = [[sn for sn in range(r * self.ROW + 1, min((r + 1) * self.ROW, self.per_coach) + 1)
+                     if self.state[base + sn - 1] == FREE] for r in range(rows)]
+            if sum(map(len, free)) < n:
+                continue
+            left = [[sn for sn in row if (sn - 1) % self.ROW < 2] for row in free]
+            right = [[sn for sn in row if (sn - 1) % self.ROW >= 2] for row in free]
+            for tier, variants, max_span in ((0, (left, right), 1), (1, (free,), 1),
+                                             (2, (left, right), rows), (3, (free,), rows)):
+                if best is not None and tier > best[0][0]:
+                    break
+                for variant in variants:
+                    found = _window(variant, n, max_span)
+                    if found is None:
+                        continue
+                    key = (tier, found[0], c, found[1])
+                    if best is None or key < best[0]:
+                        best = (key, c, found[2])
+                if best is not None and best[0][0] == tier:
+                    break  # в этом вагоне лучше уровня не будет
+            if best is not None and best[0][:2] == (0, 1):
+                break  # лучше «рядом в одном ряду» не бывает
+        if best is None:
+            return None
+        (tier, _, _, _), c, seats = best
+        coach = self.first_coach + c
+        return Block(coach, seats, [self.ids[c * self.per_coach + sn - 1] for sn in seats], tier)
+
+
+def _window(rows, n: int, max_span: int):
+    """Самое узкое окно соседних рядов (не шире max_span), где свободно >= n мест.
+    Возвращает (ширина, первый ряд, номера мест) или None."""
+    for span in range(1, min(max_span, len(rows)) + 1):
+        for start in range(len(rows) - span + 1):
+            seats = [sn for row in rows[start:start + span] for sn in row]
+            if len(seats) >= n:
+                return span, start, seats[:n]
+    return None
+
+
+# coach — номер вагона, seats — номера мест, ids — их ID, tier — индекс в SeatMap.TIERS
+Block = namedtuple("Block", "coach seats ids tier")
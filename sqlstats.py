@@ -0,0 +1,257 @@
+# sqlstats.py
+# --------------------
+# Статистика SQL процесса и журнал медленных запросов.
+#
+# Пул (db.get_pool) выдаёт TracedConnection, её курсоры — TracedCursor: каждый
+# execute/executemany и каждая выборка замеряются отдельно и складываются в «отпечаток»
+# запроса — SQL без литералов, комментариев и лишних пробелов, списки binds IN (:s0, :s1, ...)
+# сворачиваются в (:list). Имя отпечатка — «ГЛАГОЛ ТАБЛИЦА #хэш», стабильно между воркерами.
+#
+# Выполнение считается завершённым, когда выборка исчерпана, курсор закрыт/собран
+# или на нём запущен следующий запрос. Если оно дольше SLOW_QUERY_MS — строка JSON
+# в журнал медленных запросов (SLOW_QUERY_LOG или stdout с префиксом [SQL][SLOW]).
+# В журнал попадают типы binds, но не значения (там пароли, e-mail, коды).
+#
+# Round trip'ы — оценка: execute — один, дальше по одному на каждые arraysize строк
+# сверх prefetchrows.
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+import oracledb
+import tracing
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG")  # путь к файлу JSON lines; не задан — stdout
+SQL_STATS_SAMPLES = int(os.getenv("SQL_STATS_SAMPLES", "512"))  # последних длительностей на отпечаток для p95
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r"(?<![\w:$#])\d+(?:\.\d+)?")
+_BIND_LIST = re.compile(r"\(\s*:\w+(?:\s*,\s*:\w+)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|JOIN)\s+([A-Z_][\w$#.]*)", re.I)
+
+
+class Fingerprint:
+    __slots__ = ("id", "name", "sql")
+
+    def __init__(self, sql: str):
+        norm = _COMMENTS.sub(" ", sql)
+        norm = _STRINGS.sub("'?'", norm)
+        norm = _NUMBERS.sub("?", norm)
+        norm = _BIND_LIST.sub("(:list)", norm)
+        self.sql = _SPACE.sub(" ", norm).strip()
+        self.id = hashlib.sha1(self.sql.encode()).hexdigest()[:10]
+        verb = self.sql.split(" ", 1)[0].upper() if self.sql else "?"
+        table = _TABLE.search(self.sql)
+        self.name = f"{verb} {table.group(1).upper() if table else '-'} #{self.id}"
+
+
+_fp_cache = {}  # текст SQL -> Fingerprint: в приложении одни и те же строки, нормализуем один раз
+
+
+def fingerprint(sql: str) -> Fingerprint:
+    fp = _fp_cache.get(sql)
+    if fp is None:
+        if len(_fp_cache) > 4096:
+            _fp_cache.clear()
+        fp = _fp_cache[sql] = Fingerprint(sql)
+    return fp
+
+
+class _Stat:
+    __slots__ = ("fp", "calls", "exec_s", "fetch_s", "rows", "round_trips", "slow", "max_s", "samples")
+
+    def __init__(self, fp: Fingerprint):
+        self.fp = fp
+        self.calls = 0
+        self.exec_s = self.fetch_s = self.max_s = 0.0
+        self.rows = self.round_trips = self.slow = 0
+        self.samples = deque(maxlen=SQL_STATS_SAMPLES)
+
+    def p95(self) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def to_dict(self) -> dict:
+        total = self.exec_s + self.fetch_s
+        return {
+            "name": self.fp.name, "sql": self.fp.sql, "calls": self.calls,
+            "total_ms": round(total * 1000, 2), "exec_ms": round(self.exec_s * 1000, 2),
+            "fetch_ms": round(self.fetch_s * 1000, 2),
+            "avg_ms": round(total * 1000 / self.calls, 3) if self.calls else 0.0,
+            "p95_ms": round(self.p95() * 1000, 3), "max_ms": round(self.max_s * 1000, 3),
+            "rows": self.rows, "round_trips": self.round_trips, "slow": self.slow,
+        }
+
+
+_lock = threading.Lock()
+_stats = {}  # fp.id -> _Stat
+_started_at = datetime.now(timezone.utc)
+_log_lock = threading.Lock()
+
+
+def _bind_shape(binds, many: bool):
+    """Типы binds без значений: {"name": "int"} / ["str", ...]; для executemany — форма первой строки."""
+    if many:
+        rows = binds if isinstance(binds, list) else []
+        return {"rows": len(rows), "shape": _bind_shape(rows[0], False) if rows else None}
+    if isinstance(binds, dict):
+        return {k: type(v).__name__ for k, v in binds.items()}
+    if isinstance(binds, (list, tuple)):
+        return [type(v).__name__ for v in binds]
+    return None if binds is None else type(binds).__name__
+
+
+def _write_slow(entry: dict) -> None:
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    if not SLOW_QUERY_LOG:
+        print(f"[SQL][SLOW] {line}")
+        return
+    with _log_lock:
+        with open(SLOW_QUERY_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class _Execution:
+    __slots__ = ("fp", "binds", "exec_s", "fetch_s", "rows", "round_trips")
+
+    def __init__(self, fp, binds, exec_s, rows):
+        self.fp = fp
+        self.binds = binds
+        self.exec_s = exec_s
+        self.fetch_s = 0.0
+        self.rows = rows
+        self.round_trips = 1
+
+
+def _record(ex: _Execution) -> None:
+    total = ex.exec_s + ex.fetch_s
+    slow = total * 1000 >= SLOW_QUERY_MS
+    with _lock:
+        st = _stats.get(ex.fp.id)
+        if st is None:
+            st = _stats[ex.fp.id] = _Stat(ex.fp)
+        st.calls += 1
+        st.exec_s += ex.exec_s
+        st.fetch_s += ex.fetch_s
+        st.rows += ex.rows
+        st.round_trips += ex.round_trips
+        st.max_s = max(st.max_s, total)
+        st.samples.append(total)
+        st.slow += slow
+    tracing.record("db", total, ex.fp.name)
+    if slow:
+        _write_slow({
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "pid": os.getpid(),
+            "fingerprint": ex.fp.id, "name": ex.fp.name, "sql": ex.fp.sql,
+            "ms": round(total * 1000, 2), "exec_ms": round(ex.exec_s * 1000, 2),
+            "fetch_ms": round(ex.fetch_s * 1000, 2), "rows": ex.rows, "round_trips": ex.round_trips,
+            "binds": ex.binds,
+        })
+
+
+class TracedCursor(oracledb.Cursor):
+    """Курсор, замеряющий выполнение и выборку (см. начало файла)."""
+    _ex = None
+
+    def _finish(self) -> None:
+        ex, self._ex = self._ex, None
+        if ex is not None:
+            _record(ex)
+
+    def execute(self, statement, parameters=None, **kw):
+        self._finish()
+        t0 = time.perf_counter()
+        result = super().execute(statement, parameters, **kw)
+        # у SELECT rowcount пока 0 — строки досчитает выборка; у DML это число изменённых строк
+        self._ex = _Execution(fingerprint(statement or ""), _bind_shape(parameters or kw or None, False),
+                              time.perf_counter() - t0, 0 if self.description else max(self.rowcount, 0))
+        if self.description is None:
+            self._finish()
+        return result
+
+    def executemany(self, statement, parameters, **kw):
+        self._finish()
+        t0 = time.perf_counter()
+        result = super().executemany(statement, parameters, **kw)
+        self._ex = _Execution(fingerprint(statement or ""), _bind_shape(parameters, True),
+                              time.perf_counter() - t0, max(self.rowcount, 0))
+        self._finish()
+        return result
+
+    def _fetched(self, t0: float, n: int, done: bool) -> None:
+        ex = self._ex
+        if ex is None:
+            return
+        ex.fetch_s += time.perf_counter() - t0
+        ex.rows += n
+        ex.round_trips = 1 + max(0, -(-(ex.rows - self.prefetchrows) // max(self.arraysize, 1)))
+        if done:
+            self._finish()
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None, **kw):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(size, **kw) if size is not None else super().fetchmany(**kw)
+        self._fetched(t0, len(rows), len(rows) < (size or self.arraysize))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows), True)
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(t0, 0, True)
+            raise
+        self._fetched(t0, 1, False)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+        parent = getattr(super(), "__del__", None)
+        if parent is not None:
+            parent()
+
+
+class TracedConnection(oracledb.Connection):
+    """Соединение пула: cursor() выдаёт TracedCursor."""
+
+    def cursor(self, scrollable: bool = False) -> TracedCursor:
+        return TracedCursor(self, scrollable)
+
+
+def top(by: str = "total", limit: int = 20) -> dict:
+    """Топ отпечатков процесса по суммарному времени (by="total") или p95 (by="p95")."""
+    with _lock:
+        rows = [st.to_dict() for st in _stats.values()]
+    key = "p95_ms" if by == "p95" else "total_ms"
+    rows.sort(key=lambda r: r[key], reverse=True)
+    return {"pid": os.getpid(), "since": _started_at.isoformat(timespec="seconds"),
+            "slow_query_ms": SLOW_QUERY_MS, "fingerprints": len(rows), "top": rows[:limit]}
@@ -0,0 +1,8 @@
+# tests/conftest.py
+# --------------------
+# Модули приложения лежат в корне репозитория (без пакета) — делаем их импортируемыми.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,46 @@
+from datetime import datetime
+import pytest
+from fares import ScheduleFares, segment
+
+START = datetime(2026, 5, 1, 8, 0)
+
+# остановки 0..3: 0 / 100 / 250 / 400 км, 0 / 60 / 150 / 240 минут от отправления
+CUM_KM = [0.0, 100.0, 250.0, 400.0]
+CUM_MIN = [0, 60, 150, 240]
+
+
+@pytest.fixture
+def trip():
+    return ScheduleFares(START, 2.5, CUM_KM, CUM_MIN)
+
+
+def test_whole_trip(trip):
+    f = trip.fare(0, 3)
+    assert (f.distance_km, f.price, f.minutes) == (400.0, 1000.0, 240)
+    assert (f.depart, f.arrive) == (START, datetime(2026, 5, 1, 12, 0))
+
+
+def test_sub_segment(trip):
+    f = trip.fare(1, 3)
+    assert (f.distance_km, f.price, f.minutes) == (300.0, 750.0, 180)
+    assert (f.depart, f.arrive) == (datetime(2026, 5, 1, 9, 0), datetime(2026, 5, 1, 12, 0))
+
+
+def test_segments_add_up_to_whole_trip(trip):
+    parts = [trip.fare(0, 1), trip.fare(1, 2), trip.fare(2, 3)]
+    whole = trip.fare(0, 3)
+    assert sum(p.price for p in parts) == whole.price
+    assert sum(p.minutes for p in parts) == whole.minutes
+    assert parts[0].arrive == parts[1].depart
+
+
+def test_bad_segment(trip):
+    for a, b in ((2, 2), (3, 1), (-1, 2), (0, 4)):
+        with pytest.raises(ValueError):
+            trip.fare(a, b)
+
+
+def test_rounding_half_up_like_oracle():
+    # 0.5 км * 1.25 = 0.625 -> 0.63 (round() дал бы 0.62)
+    f = segment(START, 1.25, 10.0, 0, 10.5, 7)
+    assert (f.distance_km, f.price, f.minutes) == (0.5, 0.63, 7)
@@ -0,0 +1,81 @@
+# Маленький граф с путями, посчитанными вручную.
+#
+#        B(10)
+#     1 / | \ 2
+#  A(1)   5   D(1) — 1 — E(100)
+#     2 \ | / 4
+#        C(50)          и ещё ребро A—D длиной 12
+#
+# Простые пути A→D:   расстояние   популярность (сумма по городам)
+#   A-B-D                   3            12
+#   A-C-D                   6            52
+#   A-C-B-D                 9            62
+#   A-B-C-D                10            62
+#   A-D                    12             2
+# E висит на D и в простой путь A→D не попадает.
+
+import pytest
+from route_graph import RouteGraph
+
+A, B, C, D, E = 1, 2, 3, 4, 5
+
+
+@pytest.fixture
+def graph():
+    cities = [(A, "A", 1), (B, "B", 10), (C, "C", 50), (D, "D", 1), (E, "E", 100)]
+    edges = [(A, B, 1), (B, D, 2), (A, C, 2), (C, D, 4), (A, D, 12), (B, C, 5), (D, E, 1)]
+    return RouteGraph(cities, edges)
+
+
+def test_shortest_path(graph):
+    p = graph.shortest_path(A, D)
+    assert p.city_ids == (A, B, D)
+    assert p.distance_km == 3
+    assert p.depth == 2
+    assert p.popularity == 12
+    assert p.path_city_ids == "1->2->4"
+    assert p.cities_sequence == "A → B → D"
+
+
+def test_k_shortest_paths_in_order(graph):
+    paths = graph.k_shortest_paths(A, D, 10)
+    assert [p.city_ids for p in paths] == [(A, B, D), (A, C, D), (A, C, B, D), (A, B, C, D), (A, D)]
+    assert [p.distance_km for p in paths] == [3, 6, 9, 10, 12]
+
+
+def test_k_shortest_paths_k_and_depth(graph):
+    assert [p.city_ids for p in graph.k_shortest_paths(A, D, 2)] == [(A, B, D), (A, C, D)]
+    assert [p.city_ids for p in graph.k_shortest_paths(A, D, 10, max_depth=1)] == [(A, D)]
+    assert [p.city_ids for p in graph.k_shortest_paths(A, D, 10, max_depth=2)] == [(A, B, D), (A, C, D), (A, D)]
+
+
+def test_time_and_price_metrics_keep_order(graph):
+    by_time = graph.k_shortest_paths(A, D, 3, "time", speed_kmph=60)
+    by_price = graph.k_shortest_paths(A, D, 3, "price", price_per_km=2.5)
+    assert [p.city_ids for p in by_time] == [p.city_ids for p in by_price] == [(A, B, D), (A, C, D), (A, C, B, D)]
+
+
+def test_no_path(graph):
+    assert graph.k_shortest_paths(A, A, 3) == []
+    assert graph.k_shortest_paths(A, 99, 3) == []
+    assert graph.shortest_path(A, D, max_depth=0) is None
+
+
+def test_popular_paths_top_k(graph):
+    paths = graph.popular_paths(A, D, 3)
+    # при равной популярности раньше идёт более короткий путь
+    assert [(p.city_ids, p.popularity) for p in paths] == [
+        ((A, C, B, D), 62), ((A, B, C, D), 62), ((A, C, D), 52)]
+
+
+def test_popular_paths_all_and_depth(graph):
+    assert [p.popularity for p in graph.popular_paths(A, D, 10)] == [62, 62, 52, 12, 2]
+    assert [p.city_ids for p in graph.popular_paths(A, D, 10, max_depth=2)] == [(A, C, D), (A, B, D), (A, D)]
+
+
+def test_popular_paths_prefers_popular_detour_over_short_path():
+    # долгий крюк через популярный город X обгоняет все короткие пути
+    cities = [(1, "S", 1), (2, "T", 1), (3, "M", 2), (4, "X", 90)]
+    edges = [(1, 3, 1), (3, 2, 1), (1, 2, 3), (1, 4, 1000), (4, 2, 1000)]
+    top = RouteGraph(cities, edges).popular_paths(1, 2, 1)
+    assert [(p.city_ids, p.popularity, p.distance_km) for p in top] == [((1, 4, 2), 92, 2000)]
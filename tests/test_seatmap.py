@@ -0,0 +1,111 @@
+from collections import namedtuple
+from seatmap import SeatMap, FREE, HELD, SOLD, ALL_LEGS, leg_mask, leg_range, leg_status
+
+Seat = namedtuple("Seat", "ID COACH_NO SEAT_NO STATUS")
+
+
+def seat_map(*coaches, per_coach=8, first_coach=1):
+    """coaches — строки статусов по вагонам: '.' свободно, 'h' бронь, 's' куплено."""
+    codes = {".": "FREE", "h": "HELD", "s": "SOLD"}
+    rows = [Seat(100 * (c + first_coach) + sn, c + first_coach, sn, codes[st])
+            for c, states in enumerate(coaches) for sn, st in enumerate(states, 1)]
+    return SeatMap.from_rows(rows)
+
+
+# ---------- подбор мест рядом (вагон 8 мест: ряды 1-4 и 5-8, стороны 1,2 | 3,4) ----------
+def test_pair_side_by_side():
+    b = seat_map("........").best_block(2)
+    assert (b.coach, b.seats, b.ids, b.tier) == (1, [1, 2], [101, 102], 0)
+
+
+def test_three_in_one_row():
+    b = seat_map("........").best_block(3)
+    assert (b.seats, b.tier) == ([1, 2, 3], 1)
+
+
+def test_skips_full_coach():
+    b = seat_map("ssssssss", "........").best_block(2)
+    assert (b.coach, b.seats, b.ids) == (2, [1, 2], [201, 202])
+
+
+def test_better_tier_in_later_coach_wins():
+    # в 1-м вагоне пара только через проход, во 2-м — рядом
+    b = seat_map(".s.sssss", "ssss..ss").best_block(2)
+    assert (b.coach, b.seats, b.tier) == (2, [5, 6], 0)
+
+
+def test_spreads_over_adjacent_rows_when_no_row_fits():
+    # свободны 1, 4, 6, 7: в одном ряду больше двух не сесть
+    sm = seat_map(".ss.s..s")
+    assert (sm.best_block(2).seats, sm.best_block(2).tier) == ([1, 4], 1)
+    b = sm.best_block(3)
+    assert (b.seats, b.tier) == ([1, 4, 6], 3)
+
+
+def test_n_larger_than_free_seats():
+    sm = seat_map(".ss.s..s", "hhhh..hh")
+    assert sm.best_block(5) is None
+    assert sm.best_block(9) is None  # больше, чем мест в вагоне
+    assert sm.best_block(0) is None
+
+
+def test_full_train():
+    assert seat_map("ssssssss", "hhhhhhhh").best_block(1) is None
+
+
+def test_mark_taken():
+    sm = seat_map("..ssssss")
+    sm.mark_taken(101)
+    assert sm.status(1, 1) == HELD
+    assert sm.best_block(2) is None
+    assert sm.best_block(1).seats == [2]
+
+
+# ---------- занятость по перегонам ----------
+LegSeat = namedtuple("LegSeat", "ID COACH_NO SEAT_NO STATUS HELD_MASK SOLD_MASK")
+
+
+def test_leg_mask_bits():
+    assert leg_mask(0, 1) == 0b1
+    assert leg_mask(1, 3) == 0b110
+    assert leg_mask(2, 5) == 0b11100
+
+
+def test_leg_mask_whole_trip():
+    assert leg_mask() == ALL_LEGS
+    assert leg_mask(3, 3) == ALL_LEGS   # пустой участок
+    assert leg_mask(4, 2) == ALL_LEGS
+    assert leg_mask(0, 31) == ALL_LEGS  # за пределами 31 бита
+
+
+def test_overlapping_and_disjoint_trips():
+    assert leg_mask(0, 2) & leg_mask(1, 3)          # общий перегон 1->2
+    assert not leg_mask(0, 2) & leg_mask(2, 4)      # общая только остановка 2
+    assert leg_mask(1, 4) & ALL_LEGS == leg_mask(1, 4)
+
+
+def test_leg_status():
+    held, sold = leg_mask(0, 2), leg_mask(3, 5)
+    assert leg_status(held, sold, leg_mask(1, 2)) == HELD
+    assert leg_status(held, sold, leg_mask(2, 3)) == FREE
+    assert leg_status(held, sold, leg_mask(4, 6)) == SOLD
+    assert leg_status(held, sold, leg_mask(1, 4)) == SOLD  # куплено важнее брони
+    assert leg_status(held, sold, ALL_LEGS) == SOLD
+
+
+def test_seat_map_for_a_trip():
+    rows = [LegSeat(1, 1, 1, "HELD", leg_mask(0, 2), 0),   # Тверь -> Москва в брони
+            LegSeat(2, 1, 2, "SOLD", 0, leg_mask(1, 3)),
+            LegSeat(3, 1, 3, "FREE", 0, 0)]
+    sm = SeatMap.from_rows(rows, mask=leg_mask(2, 4))
+    assert [sm.status_name(1, sn) for sn in (1, 2, 3)] == ["FREE", "SOLD", "FREE"]
+    sm = SeatMap.from_rows(rows, mask=leg_mask(0, 1))
+    assert [sm.status_name(1, sn) for sn in (1, 2, 3)] == ["HELD", "FREE", "FREE"]
+
+
+def test_leg_range_inverts_leg_mask():
+    assert leg_range(ALL_LEGS) is None
+    assert leg_range(leg_mask(2, 5)) == (2, 5)
+    for a in range(30):
+        for b in range(a + 1, 31):
+            assert leg_range(leg_mask(a, b)) == (a, b)
@@ -0,0 +1,145 @@
+# tracing.py
+# --------------------
+# Лёгкие спаны внутри одного запроса: где ушло время — БД, хэш пароля, письмо, шаблон.
+#
+# Текущая трасса лежит в contextvar, поэтому span()/record() можно звать из любого
+# кода (sqlstats, mailer, app) без передачи объекта: вне трассы они ничего не делают.
+# Итог по категориям уходит клиенту заголовком Server-Timing (см. app.py), а
+# выборочные трассы — строкой JSON в TRACE_LOG: доля TRACE_SAMPLE_RATE всех запросов
+# и все, что дольше TRACE_SLOW_MS. Файл читается без коллектора:
+#
+#   python tracing.py                      # 20 самых долгих трасс из TRACE_LOG
+#   python tracing.py --top 5 --name seats
+
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+TRACE_LOG = os.getenv("TRACE_LOG") or os.path.join(tempfile.gettempdir(), "routes_traces.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+TRACE_MAX_SPANS = 500  # дальше спаны только суммируются в totals
+
+_current = ContextVar("trace", default=None)
+_log_lock = threading.Lock()
+
+
+class Trace:
+    __slots__ = ("name", "t0", "spans", "totals", "done")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.spans = []   # (категория, деталь, начало от t0, длительность), секунды
+        self.totals = {}  # категория -> [число спанов, секунды]
+        self.done = False
+
+    def add(self, category: str, detail, start: float, seconds: float) -> None:
+        if self.done:
+            return  # например, курсор собран уже после ответа
+        tot = self.totals.setdefault(category, [0, 0.0])
+        tot[0] += 1
+        tot[1] += seconds
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((category, detail, start - self.t0, seconds))
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.t0
+
+
+def start(name: str):
+    """Начать трассу в текущем контексте. Возвращает токен для finish()."""
+    return _current.set(Trace(name))
+
+
+def current() -> Trace | None:
+    return _current.get()
+
+
+def finish(token, **attrs) -> Trace | None:
+    """Закрыть трассу; выборочно записать её в TRACE_LOG. attrs — поля строки журнала."""
+    trace = _current.get()
+    _current.reset(token)
+    if trace is None:
+        return None
+    total = trace.elapsed()
+    trace.done = True
+    if total * 1000 >= TRACE_SLOW_MS or random.random() < TRACE_SAMPLE_RATE:
+        try:
+            _write(trace, total, attrs)
+        except OSError as e:
+            print(f"[TRACE][WRITE ERROR] {e}")
+    return trace
+
+
+@contextmanager
+def span(category: str, detail=None):
+    """with span("password_hash"): ... — замер блока в текущей трассе."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(category, detail, t0, time.perf_counter() - t0)
+
+
+def record(category: str, seconds: float, detail=None) -> None:
+    """Уже замеренное событие, закончившееся только что (sqlstats, сигналы шаблонов)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(category, detail, time.perf_counter() - seconds, seconds)
+
+
+def server_timing(trace: Trace) -> str:
+    """Значение заголовка Server-Timing: по категории на элемент + total."""
+    parts = [f'{cat};dur={sec * 1000:.1f};desc="{n}x"' for cat, (n, sec) in trace.totals.items()]
+    parts.append(f"total;dur={trace.elapsed() * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _write(trace: Trace, total: float, attrs: dict) -> None:
+    entry = {
+        "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "pid": os.getpid(),
+        "name": trace.name, "ms": round(total * 1000, 2), **attrs,
+        "totals": {cat: {"n": n, "ms": round(sec * 1000, 2)} for cat, (n, sec) in trace.totals.items()},
+        "spans": [{"cat": cat, "detail": detail, "start_ms": round(st * 1000, 2), "ms": round(sec * 1000, 2)}
+                  for cat, detail, st, sec in trace.spans],
+    }
+    line = json.dumps(entry, ensure_ascii=False, default=str)
+    with _log_lock:
+        with open(TRACE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Самые долгие трассы из журнала")
+    ap.add_argument("--file", default=TRACE_LOG)
+    ap.add_argument("--top", type=int, default=20)
+    ap.add_argument("--name", default=None, help="подстрока имени трассы (endpoint)")
+    args = ap.parse_args()
+
+    traces = []
+    with open(args.file, encoding="utf-8") as f:
+        for line in f:
+            try:
+                t = json.loads(line)
+            except ValueError:
+                continue
+            if args.name is None or args.name in t["name"]:
+                traces.append(t)
+    traces.sort(key=lambda t: t["ms"], reverse=True)
+    for t in traces[:args.top]:
+        parts = ", ".join(f"{cat} {v['ms']}ms/{v['n']}" for cat, v in
+                          sorted(t["totals"].items(), key=lambda kv: -kv[1]["ms"]))
+        print(f"{t['ts']} {t['name']} {t.get('status', '')} {t['ms']}ms  [{parts}]")
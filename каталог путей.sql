@@ -0,0 +1,64 @@
+-- ===== Каталог путей маршрутов вместо рекурсивного представления route_popularity
+-- Заполняется и обновляется из Python: python path_catalog.py --full (первый раз),
+-- дальше python path_catalog.py пересчитывает только маршруты, затронутые изменениями city_path.
+
+CREATE TABLE route_path_catalog (
+  route_id          INT NOT NULL REFERENCES route(id),
+  path_city_ids     VARCHAR2(1000) NOT NULL,
+  cities_sequence   VARCHAR2(2000) NOT NULL,
+  total_distance    NUMBER(8,1) NOT NULL,
+  depth             NUMBER(3) NOT NULL,
+  total_popularity  INT NOT NULL,
+  cities_count      NUMBER(3) NOT NULL,
+  CONSTRAINT pk_route_path_catalog PRIMARY KEY (route_id, path_city_ids)
+);
+
+-- Версии данных: кэши процессов сравнивают их, чтобы понять, что пора перечитать
+CREATE TABLE data_version (
+  name        VARCHAR2(32) PRIMARY KEY,
+  version     NUMBER DEFAULT 0 NOT NULL,
+  updated_at  TIMESTAMP WITH TIME ZONE DEFAULT SYSTIMESTAMP NOT NULL
+);
+
+INSERT INTO data_version (name, version) VALUES ('PATH_CATALOG', 0);
+
+-- Журнал изменений рёбер: что добавили / удалили / перевесили
+CREATE TABLE city_path_change (
+  id           NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  op           CHAR(1) NOT NULL CHECK (op IN ('I', 'U', 'D')),
+  old_a_id     INT NULL,
+  old_b_id     INT NULL,
+  old_dist_km  NUMBER(6) NULL,
+  new_a_id     INT NULL,
+  new_b_id     INT NULL,
+  new_dist_km  NUMBER(6) NULL,
+  changed_at   TIMESTAMP WITH TIME ZONE DEFAULT SYSTIMESTAMP NOT NULL
+);
+
+CREATE OR REPLACE TRIGGER trg_city_path_change
+AFTER INSERT OR UPDATE OR DELETE ON city_path
+FOR EACH ROW
+BEGIN
+  INSERT INTO city_path_change (op, old_a_id, old_b_id, old_dist_km, new_a_id, new_b_id, new_dist_km)
+  VALUES (
+    CASE WHEN INSERTING THEN 'I' WHEN UPDATING THEN 'U' ELSE 'D' END,
+    :OLD.city_a_id, :OLD.city_b_id, :OLD.dist_km,
+    :NEW.city_a_id, :NEW.city_b_id, :NEW.dist_km
+  );
+END;
+/
+
+-- route_popularity теперь просто читает каталог (старые INSERT-ы расписания работают без изменений)
+CREATE OR REPLACE VIEW route_popularity AS
+SELECT
+  route_id,
+  path_city_ids,
+  cities_sequence,
+  total_distance,
+  depth,
+  total_popularity,
+  cities_count
+FROM route_path_catalog;
+
+SELECT *
+FROM data_version
@@ -0,0 +1,91 @@
+-- ===== Места рейсов (schedule_seats): индексы под схему мест
+-- Страница мест читает один вагон и сводку по вагонам — обе выборки
+-- покрываются этим индексом без обращения к таблице.
+CREATE INDEX ix_schedule_seats_coach
+  ON schedule_seats (schedule_id, coach_no, seat_no, status, id);
+
+-- ===== Версия схемы мест рейса (ETag для /api/schedules/<id>/seats).
+-- Растёт при брони (db_hold_seats), оплате (db_mark_order_paid) и отмене заказа.
+ALTER TABLE route_schedule ADD (seats_version NUMBER DEFAULT 0 NOT NULL);
+
+-- ===== Лента изменений мест для живого обновления схемы (SSE, seat_feed.py).
+-- Пишет триггер — значит, попадают все смены статуса: бронь, оплата, отмена.
+-- Воркеры читают по id > последнего; старые строки чистит seat_feed (SEAT_FEED_RETENTION_MIN).
+CREATE TABLE seat_change_log (
+  id           NUMBER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+  schedule_id  INT NOT NULL,
+  seat_id      INT NOT NULL,
+  coach_no     NUMBER(3) NOT NULL,
+  seat_no      NUMBER(3) NOT NULL,
+  status       VARCHAR2(8) NOT NULL,
+  changed_at   TIMESTAMP WITH TIME ZONE DEFAULT SYSTIMESTAMP NOT NULL
+);
+
+CREATE INDEX ix_seat_change_log_changed ON seat_change_log (changed_at);
+
+CREATE OR REPLACE TRIGGER trg_seat_change_log
+AFTER UPDATE OF status ON schedule_seats
+FOR EACH ROW
+WHEN (NEW.status <> OLD.status)
+BEGIN
+  INSERT INTO seat_change_log (schedule_id, seat_id, coach_no, seat_no, status)
+  VALUES (:NEW.schedule_id, :NEW.id, :NEW.coach_no, :NEW.seat_no, :NEW.status);
+END;
+/
+
+-- ===== Истечение броней (reaper.py): когда место стало HELD.
+-- Старые HELD получают текущее время — истекут через HOLD_TTL_MIN после миграции.
+ALTER TABLE schedule_seats ADD (held_at TIMESTAMP WITH TIME ZONE NULL);
+UPDATE schedule_seats SET held_at = SYSTIMESTAMP WHERE status = 'HELD';
+COMMIT;
+
+-- в индекс попадают только HELD (для остальных выражение NULL) — он крошечный
+CREATE INDEX ix_schedule_seats_held ON schedule_seats (CASE WHEN status = 'HELD' THEN held_at END);
+-- просроченные заказы NEW
+CREATE INDEX ix_orders_status_created ON orders (status, created_at);
+
+-- ===== Занятость по перегонам (seatmap.leg_mask, booking.py).
+-- Бит i = перегон stop_seq i -> i+1 (route_schedule_stop). Поездка Тверь -> Москва
+-- занимает только свои перегоны; свободно = BITAND(held_mask, m) = 0 AND BITAND(sold_mask, m) = 0.
+-- status остаётся сводкой «на весь рейс» и пересчитывается теми же UPDATE-ами.
+-- 2147483647 (ALL_LEGS) — «весь рейс»: так переносятся существующие брони и продажи.
+ALTER TABLE schedule_seats ADD (
+  held_mask  NUMBER DEFAULT 0 NOT NULL,
+  sold_mask  NUMBER DEFAULT 0 NOT NULL
+);
+UPDATE schedule_seats
+SET held_mask = CASE status WHEN 'HELD' THEN 2147483647 ELSE 0 END,
+    sold_mask = CASE status WHEN 'SOLD' THEN 2147483647 ELSE 0 END;
+
+-- перегоны, купленные позицией заказа (NULL у старых позиций = весь рейс)
+ALTER TABLE order_items ADD (leg_mask NUMBER NULL);
+COMMIT;
+
+-- схема мест читает маски вместо status
+DROP INDEX ix_schedule_seats_coach;
+CREATE INDEX ix_schedule_seats_coach
+  ON schedule_seats (schedule_id, coach_no, seat_no, held_mask, sold_mask, id);
+
+-- лента изменений несёт маски: статус для своего участка считает клиент
+ALTER TABLE seat_change_log ADD (
+  held_mask  NUMBER DEFAULT 0 NOT NULL,
+  sold_mask  NUMBER DEFAULT 0 NOT NULL
+);
+
+CREATE OR REPLACE TRIGGER trg_seat_change_log
+AFTER UPDATE OF status, held_mask, sold_mask ON schedule_seats
+FOR EACH ROW
+WHEN (NEW.held_mask <> OLD.held_mask OR NEW.sold_mask <> OLD.sold_mask OR NEW.status <> OLD.status)
+BEGIN
+  INSERT INTO seat_change_log (schedule_id, seat_id, coach_no, seat_no, status, held_mask, sold_mask)
+  VALUES (:NEW.schedule_id, :NEW.id, :NEW.coach_no, :NEW.seat_no, :NEW.status, :NEW.held_mask, :NEW.sold_mask);
+END;
+/
+
+-- Сводка по вагонам рейса
+SELECT coach_no, COUNT(*) AS total,
+       SUM(CASE WHEN status = 'FREE' THEN 1 ELSE 0 END) AS free
+FROM schedule_seats
+WHERE schedule_id = :sid
+GROUP BY coach_no
+ORDER BY coach_no
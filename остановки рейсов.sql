@@ -0,0 +1,62 @@
+-- ===== Остановки рейсов: нормализованный PATH_CITY_IDS
+-- Одна строка на каждый город пути рейса. stop_seq с 0 (0 — город отправления),
+-- отрезок i — это перегон между остановками i и i+1.
+-- Поиск «из A в B» = две остановки одного рейса с from.stop_seq < to.stop_seq,
+-- это обслуживается индексом, а не INSTR по строке.
+CREATE TABLE route_schedule_stop (
+  schedule_id  NUMBER NOT NULL REFERENCES route_schedule(schedule_id) ON DELETE CASCADE,
+  stop_seq     NUMBER(3) NOT NULL,
+  city_id      INT NOT NULL REFERENCES city(id),
+  cum_dist_km  NUMBER(8,1) NOT NULL,  -- км от города отправления рейса
+  cum_minutes  NUMBER(8) NOT NULL,    -- минут от отправления рейса
+  CONSTRAINT pk_route_schedule_stop PRIMARY KEY (schedule_id, stop_seq)
+) ORGANIZATION INDEX;
+
+-- «все рейсы, проходящие через город» + сразу stop_seq без обращения к таблице
+CREATE INDEX ix_rss_city_schedule ON route_schedule_stop (city_id, schedule_id, stop_seq);
+
+-- категория + диапазон дат вместо TRUNC(start_datetime) = :d
+CREATE INDEX ix_route_schedule_cat_start ON route_schedule (category, start_datetime);
+
+
+-- ===== Миграция: заполнить остановки для всех рейсов, у которых их ещё нет.
+-- Тот же запрос выполняется после генерации расписания (см. «расписание маршрутов.sql»).
+INSERT INTO route_schedule_stop (schedule_id, stop_seq, city_id, cum_dist_km, cum_minutes)
+WITH stops AS (
+  SELECT
+    rs.schedule_id,
+    rs.speed_kmph,
+    s.stop_seq,
+    TO_NUMBER(REGEXP_SUBSTR(rs.path_city_ids, '[^->]+', 1, s.stop_seq + 1)) AS city_id
+  FROM route_schedule rs
+  CROSS APPLY (
+    SELECT LEVEL - 1 AS stop_seq FROM dual
+    CONNECT BY LEVEL <= REGEXP_COUNT(rs.path_city_ids, '->') + 1
+  ) s
+  WHERE NOT EXISTS (SELECT 1 FROM route_schedule_stop x WHERE x.schedule_id = rs.schedule_id)
+),
+legs AS (
+  SELECT
+    st.*,
+    LAG(st.city_id) OVER (PARTITION BY st.schedule_id ORDER BY st.stop_seq) AS prev_city_id
+  FROM stops st
+)
+SELECT
+  l.schedule_id,
+  l.stop_seq,
+  l.city_id,
+  SUM(NVL(d.dist_km, 0)) OVER (PARTITION BY l.schedule_id ORDER BY l.stop_seq) AS cum_dist_km,
+  ROUND(SUM(NVL(d.dist_km, 0)) OVER (PARTITION BY l.schedule_id ORDER BY l.stop_seq) / l.speed_kmph * 60) AS cum_minutes
+FROM legs l
+LEFT JOIN v_city_path_dir d
+  ON d.from_city_id = l.prev_city_id AND d.to_city_id = l.city_id;
+
+COMMIT;
+
+-- Проверка: у каждого рейса последняя остановка совпадает с total_distance_km
+SELECT rs.schedule_id, rs.total_distance_km, s.cum_dist_km
+FROM route_schedule rs
+JOIN route_schedule_stop s ON s.schedule_id = rs.schedule_id
+WHERE s.stop_seq = REGEXP_COUNT(rs.path_city_ids, '->')
+  AND s.cum_dist_km != rs.total_distance_km
+FETCH FIRST 20 ROWS ONLY;
@@ -0,0 +1,23 @@
+-- ===== Outbox для писем: view кладёт письмо в таблицу в своей транзакции,
+-- фоновый отправитель (mailer.py) забирает пачками и шлёт через одно SMTP-соединение.
+CREATE TABLE email_outbox (
+  id               NUMBER GENERATED BY DEFAULT ON NULL AS IDENTITY PRIMARY KEY,
+  to_email         VARCHAR2(254) NOT NULL,
+  subject          VARCHAR2(255) NOT NULL,
+  body             VARCHAR2(4000) NOT NULL,
+  status           VARCHAR2(8) DEFAULT 'PENDING' NOT NULL,  -- PENDING | SENT | FAILED
+  attempts         NUMBER(3) DEFAULT 0 NOT NULL,
+  next_attempt_at  TIMESTAMP WITH TIME ZONE DEFAULT SYSTIMESTAMP NOT NULL,
+  last_error       VARCHAR2(1000) NULL,
+  created_at       TIMESTAMP WITH TIME ZONE DEFAULT SYSTIMESTAMP NOT NULL,
+  sent_at          TIMESTAMP WITH TIME ZONE NULL,
+  CONSTRAINT ck_email_outbox_status CHECK (status IN ('PENDING', 'SENT', 'FAILED'))
+);
+
+-- выборка очереди: PENDING с наступившим next_attempt_at
+CREATE INDEX ix_email_outbox_pending ON email_outbox (status, next_attempt_at);
+
+-- Очередь и ошибки
+SELECT status, COUNT(*), MAX(attempts), MIN(created_at)
+FROM email_outbox
+GROUP BY status
@@ -259,4 +259,39 @@ WHERE tt.id = 3
   )
   
 SELECT *
-FROM ROUTE_SCHEDULE
\ No newline at end of file
+FROM ROUTE_SCHEDULE
+
+-- 5. ОСТАНОВКИ новых рейсов (route_schedule_stop, см. «остановки рейсов.sql»)
+INSERT INTO route_schedule_stop (schedule_id, stop_seq, city_id, cum_dist_km, cum_minutes)
+WITH stops AS (
+  SELECT
+    rs.schedule_id,
+    rs.speed_kmph,
+    s.stop_seq,
+    TO_NUMBER(REGEXP_SUBSTR(rs.path_city_ids, '[^->]+', 1, s.stop_seq + 1)) AS city_id
+  FROM route_schedule rs
+  CROSS APPLY (
+    SELECT LEVEL - 1 AS stop_seq FROM dual
+    CONNECT BY LEVEL <= REGEXP_COUNT(rs.path_city_ids, '->') + 1
+  ) s
+  WHERE NOT EXISTS (SELECT 1 FROM route_schedule_stop x WHERE x.schedule_id = rs.schedule_id)
+),
+legs AS (
+  SELECT
+    st.*,
+    LAG(st.city_id) OVER (PARTITION BY st.schedule_id ORDER BY st.stop_seq) AS prev_city_id
+  FROM stops st
+)
+SELECT
+  l.schedule_id,
+  l.stop_seq,
+  l.city_id,
+  SUM(NVL(d.dist_km, 0)) OVER (PARTITION BY l.schedule_id ORDER BY l.stop_seq) AS cum_dist_km,
+  ROUND(SUM(NVL(d.dist_km, 0)) OVER (PARTITION BY l.schedule_id ORDER BY l.stop_seq) / l.speed_kmph * 60) AS cum_minutes
+FROM legs l
+LEFT JOIN v_city_path_dir d
+  ON d.from_city_id = l.prev_city_id AND d.to_city_id = l.city_id
+
+
+-- Ночное продление окна (дописывает только недостающие дни, вместе с остановками):
+--   python schedule_gen.py --days 90
@@ -6,4 +6,7 @@ CREATE TABLE DISCOUNT_REQUESTS (
   STATUS       VARCHAR2(16) DEFAULT 'PENDING' NOT NULL,  -- PENDING | APPROVED | REJECTED
   CREATED_AT   TIMESTAMP WITH TIME ZONE DEFAULT SYSTIMESTAMP NOT NULL,
   REVIEWED_AT  TIMESTAMP WITH TIME ZONE NULL
-)
\ No newline at end of file
+)
+-- SHA-256 содержимого вложения: считается при потоковой записи BLOB (attachments.py),
+-- у файлов, загруженных раньше, остаётся NULL
+ALTER TABLE DISCOUNT_REQUEST_FILES ADD (SHA256 VARCHAR2(64) NULL);